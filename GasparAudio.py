@@ -0,0 +1,215 @@
+__author__ = 'jimarlow'
+# Renders tablature straight to a WAV file with a plucked string model, without a MIDI synthesizer
+#
+# The notes are the ones the MIDI compiler plays: every string of every course, bourdons included, each ringing
+# until the next notes start. Each string is plucked with the Karplus-Strong model - a burst of noise that
+# circulates in a delay line one period long, losing its high harmonics as it goes. The delay line is worked out
+# a period at a time, so each step is a whole vector of samples - with NumPy if it is installed, otherwise with
+# Python lists.
+#
+# The notes are mixed a block at a time and each block is written as soon as it is mixed, so memory stays flat
+# however long the piece. The piece can also be cut into sections of time that are rendered in separate processes -
+# every sample depends only on the notes, so the sections join up exactly.
+import array
+import functools
+import multiprocessing
+import random
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from operator import add
+
+from GasparMIDICompiler import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# NumPy is optional. Without it the delay lines are worked out with Python lists, which is many times slower,
+# so every real time factor says which was used
+RENDERER = "NumPy" if numpy is not None else "Python lists, without NumPy"
+
+SAMPLERATE = 44100
+# Samples mixed at a time
+BLOCKSIZE = 4096
+# The length of the sections rendered by each process, in blocks
+SECTIONBLOCKS = 64
+# How long a string takes to die away by 60dB, and to stop once it is damped, in seconds
+RINGTIME = 4.0
+RELEASETIME = 0.03
+# Each string is plucked this loud, which leaves room for the ten strings of a chord
+PLUCKLEVEL = 0.2
+MAXSAMPLE = 32767
+
+
+def frequency(key):
+    return 440.0 * 2 ** ((key - 69) / 12)
+
+
+@functools.lru_cache(maxsize=128)
+def pluck(key, string, samples, rate=SAMPLERATE):
+    """
+    A plucked string by the Karplus-Strong model, which ends with a short fade as it is damped.
+    Plucks are cached, as a piece plays the same notes for the same lengths over and over.
+    :param key: the MIDI number of the note
+    :param string: the string of the course - each string has its own pluck, so unisons don't cancel or double
+    :param samples: the length of the note, including its release
+    :return: the samples, a NumPy array or an array of doubles
+    """
+    # The delay line, with the two point average that damps it, is period + weight samples long
+    period, weight = divmod(rate / frequency(key), 1)
+    period = int(period)
+    # Lose 60dB over the ring time
+    gain = 10 ** (-3 / (RINGTIME * frequency(key)))
+    a, b = gain * (1 - weight), gain * weight
+    noise = random.Random(key * 2 + string)
+    burst = [noise.uniform(-PLUCKLEVEL, PLUCKLEVEL) for i in range(period)]
+    # y[0] is the silence before the pluck, and each period of samples comes from the period before it
+    if numpy is not None:
+        y = numpy.zeros(samples + 1 + period)
+        y[1:period + 1] = burst
+        for start in range(period + 1, samples + 1, period):
+            end = min(start + period, samples + 1)
+            y[start:end] = a * y[start - period:end - period] + b * y[start - period - 1:end - period - 1]
+    else:
+        y = [0.0] + burst + [0.0] * samples
+        for start in range(period + 1, samples + 1, period):
+            end = min(start + period, samples + 1)
+            y[start:end] = [a * u + b * v for u, v in zip(y[start - period:end - period], y[start - period - 1:end - period - 1])]
+    y = y[1:samples + 1]
+    release = min(int(RELEASETIME * rate), samples)
+    fade = [1 - (i + 1) / release for i in range(release)]
+    if numpy is not None:
+        y[samples - release:] *= fade
+    else:
+        y[samples - release:] = [s * f for s, f in zip(y[samples - release:], fade)]
+        # A quarter of the memory of a list, for the cache
+        y = array.array("d", y)
+    return y
+
+
+def toPCM(block):
+    # Clips to 16 bits, little endian as WAV files are
+    if numpy is not None:
+        return (numpy.clip(block, -1, 1) * MAXSAMPLE).astype("<i2").tobytes()
+    pcm = array.array("h", [int(MAXSAMPLE if s > 1 else -MAXSAMPLE if s < -1 else s * MAXSAMPLE) for s in block])
+    if sys.byteorder == "big":
+        pcm.byteswap()
+    return pcm.tobytes()
+
+
+def renderBlocks(notes, first, last, rate=SAMPLERATE):
+    """
+    Mixes the notes a block at a time
+    :param notes: [(start, samples, key, string)] in the order they start
+    :param first: the sample to start from
+    :param last: the sample to stop before
+    :return: a generator of the 16 bit PCM for each block
+    """
+    upcoming = iter([n for n in notes if n[0] < last and n[0] + n[1] > first])
+    following = next(upcoming, None)
+    sounding = []
+    for blockStart in range(first, last, BLOCKSIZE):
+        blockEnd = min(blockStart + BLOCKSIZE, last)
+        while following is not None and following[0] < blockEnd:
+            sounding.append(following)
+            following = next(upcoming, None)
+        block = numpy.zeros(blockEnd - blockStart) if numpy is not None else [0.0] * (blockEnd - blockStart)
+        for start, samples, key, string in sounding:
+            y = pluck(key, string, samples, rate)
+            # The part of the note in this block
+            a, b = max(start, blockStart), min(start + samples, blockEnd)
+            if numpy is not None:
+                block[a - blockStart:b - blockStart] += y[a - start:b - start]
+            else:
+                block[a - blockStart:b - blockStart] = map(add, block[a - blockStart:b - blockStart], y[a - start:b - start])
+        sounding = [n for n in sounding if n[0] + n[1] > blockEnd]
+        yield toPCM(block)
+
+
+def renderSection(notes, first, last, rate=SAMPLERATE):
+    # Renders a section of the piece in a worker process
+    return b"".join(renderBlocks(notes, first, last, rate))
+
+
+class GasparAudioCompiler(GasparMIDICompiler):
+    """
+    Renders the notes the MIDI compiler plays to a mono 16 bit WAV file
+    :param jobs: render sections of the piece in this many processes
+    """
+    version = 1
+
+    def __init__(self, filename, courses=None, tempo=DEFAULTTEMPO, jobs=1, rate=SAMPLERATE):
+        GasparMIDICompiler.__init__(self, filename, courses, tempo)
+        self.outputFilename = splitext(self.filename)[0] + ".wav"
+        self.jobs = jobs
+        self.rate = rate
+        # The length of the piece and the time it took to render, in seconds
+        self.duration = 0
+        self.renderTime = 0
+
+    def sampleNotes(self):
+        """
+        :return: [(start, samples, key, string)] for every note, in the order they start, and the length of the piece
+        """
+        samplesPerTick = self.rate * 60 / (self.tempo * TICKSPERCROTCHET)
+        release = int(RELEASETIME * self.rate)
+        notes = []
+        for start, stop, course, string, key in self.notes:
+            first = round(start * samplesPerTick)
+            notes.append((first, round(stop * samplesPerTick) - first + release, key, string))
+        length = max([start + samples for start, samples, key, string in notes], default=0)
+        return notes, length
+
+    def write(self):
+        started = time.perf_counter()
+        notes, length = self.sampleNotes()
+        with wave.open(self.outputFilename, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.rate)
+            if self.jobs > 1 and length > BLOCKSIZE * SECTIONBLOCKS:
+                self.renderInParallel(notes, length, out)
+            else:
+                for pcm in renderBlocks(notes, 0, length, self.rate):
+                    out.writeframes(pcm)
+        self.duration = length / self.rate
+        self.renderTime = time.perf_counter() - started
+
+    def renderInParallel(self, notes, length, out):
+        # Each process renders whole sections, which are written in order as they arrive
+        size = BLOCKSIZE * SECTIONBLOCKS
+        bounds = list(range(0, length, size)) + [length]
+        sections = [([n for n in notes if n[0] < b and n[0] + n[1] > a], a, b) for a, b in zip(bounds, bounds[1:])]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(self.jobs, context) as pool:
+            for pcm in pool.map(renderSection, *zip(*sections), [self.rate] * len(sections)):
+                out.writeframes(pcm)
+
+    def realtimeFactor(self):
+        # How many times faster than real time the piece was rendered
+        return self.duration / self.renderTime if self.renderTime else 0
+
+    def summary(self):
+        # The length of the piece and how fast it was rendered, with what
+        return "%.1fs of audio in %.2fs, %.1fx real time with %s" % (self.duration, self.renderTime,
+                                                                    self.realtimeFactor(), RENDERER)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render .sanz files to WAV with a plucked string model.')
+    parser.add_argument('sanzFileNames', nargs='+', help='The .sanz files to render')
+    parser.add_argument('--jobs', type=int, default=1, help='Render sections of each piece in this many processes')
+    parser.add_argument('--rate', type=int, default=SAMPLERATE, help='The sample rate')
+    args = parser.parse_args()
+
+    for f in args.sanzFileNames:
+        p = GasparAudioCompiler(f, jobs=args.jobs, rate=args.rate)
+        p.parseLines()
+        p.write()
+        print("%s: %s" % (p.outputFilename, p.summary()))
@@ -0,0 +1,167 @@
+__author__ = 'jimarlow'
+# Builds many .sanz files at once e.g. the whole Instruccion library
+# Files are built in a pool of processes, one file per task, and, like make, an output that is
+# newer than its source is left alone
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import splitext
+
+from GasparPostscriptCompiler import *
+
+# The backends and the suffix each one adds to the name of the .sanz file, less its extension
+# SVG is one file per page, and we judge whether it is up to date by its first page
+backendSuffixes = {"ps": ".ps", "midi": ".midi", "ly": "Lilypond.ly", "pdf": ".pdf", "svg": "-1.svg", "wav": ".wav"}
+BACKENDS = ("ps", "midi", "ly")
+
+
+def sources(paths):
+    """
+    Expands files, directories and glob patterns into .sanz files
+    :param paths: e.g. ["Instruccion", "TestMedia/Canarios*.sanz", "Rujero.sanz"]
+    :return: the .sanz files in order, each one once, and the paths that matched nothing
+    """
+    found = []
+    missing = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "*.sanz")))
+        elif os.path.isfile(path):
+            matches = [path]
+        else:
+            matches = sorted(m for m in glob.glob(path) if os.path.isfile(m))
+        if not matches:
+            missing.append(path)
+        for m in matches:
+            m = os.path.abspath(m)
+            if m not in found:
+                found.append(m)
+    return found, missing
+
+
+def outputFilename(filename, backend):
+    return splitext(filename)[0] + backendSuffixes[backend]
+
+
+def isUpToDate(filename, output):
+    # An output is up to date when it is at least as new as its source
+    try:
+        return os.path.getmtime(output) >= os.path.getmtime(filename)
+    except OSError:
+        return False
+
+
+class BatchResult:
+    def __init__(self, filename):
+        self.filename = filename
+        self.built = []
+        self.skipped = []
+        self.seconds = 0
+        # Anything worth reporting about the outputs e.g. how fast the audio was rendered
+        self.notes = []
+        self.error = None
+        self.bytes = os.path.getsize(filename)
+
+
+def buildFile(filename, backends=BACKENDS, force=False, useCache=True, compact=False, stream=False, pageJobs=1,
+              pages=None, split=False):
+    """
+    Builds the out of date outputs of one .sanz file. Runs in a worker process.
+    :param pages: the Postscript pages to render e.g. "1-3,5", see tabset
+    :return: a BatchResult - a failure is recorded in its error rather than raised, so one bad file doesn't stop the batch
+    """
+    result = BatchResult(filename)
+    start = time.perf_counter()
+    try:
+        b = Build(filename, cache=defaultCache() if useCache else None)
+        for backend in backends:
+            # The .ps file may hold other pages than the ones asked for, so a selection is always built
+            selected = backend == "ps" and (pages or split)
+            if not force and not selected and isUpToDate(filename, outputFilename(filename, backend)):
+                result.skipped.append(backend)
+                continue
+            if backend == "ps" and stream:
+                streamset(filename, cache=b.cache, compact=compact, pages=pages)
+            elif backend == "ps":
+                b.build(GasparPostscriptCompiler, "ps", cache=b.cache, compact=compact, jobs=pageJobs,
+                        pages=tuple(parsePageRange(pages)) if pages else None, split=split)
+            elif backend == "svg":
+                svgset(filename, b.score)
+            elif backend == "pdf":
+                b.build(GasparPDFCompiler, "pdf")
+            elif backend == "wav":
+                # Long pieces are rendered in sections, in pageJobs processes
+                p = b.build(GasparAudioCompiler, "wav", jobs=pageJobs)
+                if p is not None:
+                    result.notes.append("wav: " + p.summary())
+            elif backend == "midi":
+                b.build(GasparMIDICompiler, "midi")
+            else:
+                b.build(GasparLilyCompiler, "ly")
+            result.built.append(backend)
+    except Exception as e:
+        result.error = "%s: %s" % (type(e).__name__, e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def report(result):
+    name = os.path.relpath(result.filename)
+    if result.error:
+        print("%-40s FAILED %s" % (name, result.error))
+    elif result.built:
+        print("%-40s %7.3fs %s%s" % (name, result.seconds, " ".join(result.built),
+                                     " (%s up to date)" % " ".join(result.skipped) if result.skipped else ""))
+        for note in result.notes:
+            print("%-40s         %s" % ("", note))
+    else:
+        print("%-40s    up to date" % name)
+
+
+def batch(paths, backends=BACKENDS, jobs=1, force=False, useCache=True, compact=False, stream=False, pageJobs=1,
+          pages=None, split=False):
+    """
+    Builds every .sanz file in paths with a pool of jobs processes and prints the time taken by each file
+    and the throughput of the whole batch
+    :param paths: files, directories and glob patterns
+    :param backends: any of "ps", "midi", "ly", "pdf", "svg" and "wav"
+    :param jobs: the number of files built at once
+    :param force: build every output, even if it is newer than its source
+    :param pages: the Postscript pages to render e.g. "1-3,5", counted from 1 in each file
+    :param split: write each Postscript page to a file of its own
+    :return: [BatchResult] in the order the files were found
+    """
+    files, missing = sources(paths)
+    for path in missing:
+        print("File ", path, " does not exist")
+    options = dict(backends=tuple(backends), force=force, useCache=useCache, compact=compact, stream=stream,
+                   pageJobs=pageJobs, pages=pages, split=split)
+    start = time.perf_counter()
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(min(jobs, len(files))) as pool:
+            futures = [pool.submit(buildFile, f, **options) for f in files]
+            # Report each file as soon as it is done
+            for future in as_completed(futures):
+                report(future.result())
+            results = [future.result() for future in futures]
+    else:
+        results = []
+        for f in files:
+            results.append(buildFile(f, **options))
+            report(results[-1])
+    summarize(results, time.perf_counter() - start, jobs)
+    return results
+
+
+def summarize(results, seconds, jobs):
+    built = [r for r in results if r.built and not r.error]
+    failed = [r for r in results if r.error]
+    outputs = sum(len(r.built) for r in built)
+    # The time spent building, summed over the files, against the time it took: how well the pool was used
+    busy = sum(r.seconds for r in results)
+    sourceBytes = sum(r.bytes for r in built)
+    print("%d files: %d built, %d up to date, %d failed" % (len(results), len(built), len(results) - len(built) - len(failed), len(failed)))
+    print("%d outputs in %.3fs with %d jobs: %.1f files/s, %.1f KB/s of source, %.1f of %d jobs busy" %
+          (outputs, seconds, jobs, len(built) / seconds if seconds else 0, sourceBytes / 1024 / seconds if seconds else 0,
+           busy / seconds if seconds else 0, jobs))
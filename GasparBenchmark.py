@@ -0,0 +1,1002 @@
+__author__ = 'jimarlow'
+# Benchmarks for the Gaspar pipeline
+# Run all of them with: python GasparBenchmark.py
+# or just some of them with e.g.: python GasparBenchmark.py parser
+# render and glyphs compare with the code the performance work started from, given as a git revision with
+# --baseline <revision> or GASPAR_BASELINE
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from GasparScore import *
+from GasparPostscript import PSWriter
+from GasparLilyCompiler import *
+
+corpusDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Instruccion")
+
+
+def corpus():
+    return sorted(glob.glob(os.path.join(corpusDir, "*.sanz")))
+
+
+def syntheticScore(pages, directory=None):
+    """
+    Writes a synthetic anthology of the given number of pages, made by repeating the pages of CanariosB1P8.sanz
+    :return: the name of the .sanz file
+    """
+    source = open(os.path.join(corpusDir, "CanariosB1P8.sanz")).read()
+    firstPage = source.index("P-1")
+    preamble, body = source[:firstPage], source[firstPage:]
+    bodyPages = ["P-" + p for p in body.split("P-") if p]
+    fd, filename = tempfile.mkstemp(suffix=".sanz", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        f.write(preamble)
+        for i in range(pages):
+            f.write(bodyPages[i % len(bodyPages)])
+    return filename
+
+
+def peakMemory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def baselineTree(revision=None):
+    """
+    Checks out the code as it was before the performance work into a temporary directory
+    :param revision: the git revision of that code, or GASPAR_BASELINE when None
+    :return: the directory
+    """
+    revision = revision or os.environ.get("GASPAR_BASELINE")
+    if not revision:
+        raise ValueError("No baseline to compare with: set GASPAR_BASELINE or pass --baseline to the revision "
+                         "the performance work started from")
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        archive = subprocess.run(["git", "archive", revision], cwd=here, capture_output=True, check=True).stdout
+    except OSError as e:
+        raise RuntimeError("Can't run git to check out the baseline %s: %s" % (revision, e))
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError("Can't check out the baseline %s: %s" % (revision, e.stderr.decode().strip()))
+    directory = tempfile.mkdtemp()
+    try:
+        subprocess.run(["tar", "-x", "-C", directory], input=archive, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        shutil.rmtree(directory)
+        raise RuntimeError("Can't unpack the baseline %s: %s" % (revision, e))
+    return directory
+
+
+def runBaseline(code, *args, revision=None):
+    """
+    Runs a script against the baseline code, see baselineTree
+    :param code: the script, which prints its measurements on its last line
+    :param revision: the git revision of the baseline, or GASPAR_BASELINE when None
+    :return: [measurement]
+    """
+    directory = baselineTree(revision)
+    try:
+        result = subprocess.run([sys.executable, "-c", code] + [str(a) for a in args], cwd=directory,
+                                capture_output=True, text=True)
+    finally:
+        shutil.rmtree(directory)
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError("The baseline script failed:\n%s" % result.stderr)
+    return [float(v) for v in lines[-1].split()]
+
+
+def timeIt(fn, repeat=5):
+    # Best of repeat runs, in seconds
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmarkParser(repeat=20):
+    """
+    Parses every .sanz file in the Instruccion corpus
+    :return: lines per second
+    """
+    files = corpus()
+    lines = sum(len(open(f).readlines()) for f in files)
+
+    def parseCorpus():
+        for f in files:
+            parseScore(f)
+
+    seconds = timeIt(parseCorpus, repeat)
+    print("parser: %d files, %d lines in %.4fs = %.0f lines/s" % (len(files), lines, seconds, lines / seconds))
+    return lines / seconds
+
+
+# The prefixes the parser used to test each line against in turn, before the table driven lexer
+legacyPrefixes = ["P-", "S-", "T-", "SB-", "TB-", "DB-", "LSB-", "B-", "BP-", "EB-",
+                  "W ", "M ", "M. ", "C ", "C. ", "Q ", "Q. ", "SQ ", "SQ. ", "R-", "AB-", "SECTION", "TITLE ", "COMPOSER "]
+legacySettingPrefixes = ["PAGEWIDTH ", "PAGEHEIGHT ", "TOPMARGIN ", "BOTTOMMARGIN ", "LEFTMARGIN ", "RIGHTMARGIN ",
+                         "STAVESEPARATION ", "SLOTS ", "COURSES ", "NUMBEROFCOURSES ", "SHOWCOURSES", "COURSESPACING ",
+                         "JUSTIFIED", "BARLINESPACING ", "BARBERPOLESPACING ", "TITLEFACE ", "TITLESIZE ",
+                         "TITLEYPOSITION ", "COMPOSERFACE ", "COMPOSERSIZE ", "COMPOSERYPOSITION ", "FRETFACE ",
+                         "FRETSIZE ", "FRETMAP ", "FRETMAPPINGOFF", "FRENCH", ";"]
+
+
+def legacyClassify(line):
+    # The old startswith chain, without any of the work done by each branch
+    line = line.strip()
+    for p in legacyPrefixes:
+        if line.startswith(p): return p
+    if line == "": return ""
+    if re.match('^[0-9]', line): return "NOTES"
+    for p in legacySettingPrefixes:
+        if line.startswith(p): return p
+    return None
+
+
+def benchmarkLexer(repeat=20):
+    """
+    Classifies every line of the Instruccion corpus with the old startswith chain and with the lexer
+    :return: lines per second before and after
+    """
+    lines = [line for f in corpus() for line in open(f)]
+
+    def before():
+        for line in lines:
+            legacyClassify(line)
+
+    def after():
+        for line in lines:
+            tokenizeLine(line)
+
+    beforeRate = len(lines) / timeIt(before, repeat)
+    afterRate = len(lines) / timeIt(after, repeat)
+    print("lexer: %d lines, startswith chain %.0f lines/s, lexer %.0f lines/s (x%.1f)" %
+          (len(lines), beforeRate, afterRate, afterRate / beforeRate))
+    return beforeRate, afterRate
+
+
+def benchmarkStreaming(pages=(25, 100, 400)):
+    """
+    Engraves synthetic anthologies to Postscript in one go and streamed a page at a time
+    :return: [(pages, peak bytes in one go, peak bytes streamed)]
+    """
+    from GasparPostscriptCompiler import tabset, streamset
+    results = []
+    for n in pages:
+        filename = syntheticScore(n)
+        output = os.path.splitext(filename)[0] + ".ps"
+        try:
+            whole = peakMemory(lambda: tabset(filename, cache=None))
+            wholeOutput = open(output).read()
+            streamed = peakMemory(lambda: streamset(filename, cache=None))
+            identical = open(output).read() == wholeOutput
+        finally:
+            os.remove(filename)
+            os.remove(output)
+        print("streaming: %4d pages, peak memory %8.1f KB in one go, %8.1f KB streamed, identical output: %s" %
+              (n, whole / 1024, streamed / 1024, identical))
+        results.append((n, whole, streamed))
+    return results
+
+
+def benchmarkMIDI(pages=100, repeat=5):
+    """
+    Encodes the note events of a synthetic score as the old encoder did, with four one byte writes to the file
+    per event, and with a MIDITrack, which encodes them in memory for a single write
+    :return: events per second before and after
+    """
+    from GasparMIDICompiler import GasparMIDICompiler, MIDIFile, MIDITrack
+    filename = syntheticScore(pages)
+    # Record the note ons and offs as (delta time, key, velocity) as the compiler's track is encoded
+    events = []
+    channelEvent = MIDITrack.channelEvent
+    MIDITrack.channelEvent = lambda self, deltaTime, status, key, velocity: events.append((deltaTime, key, velocity))
+    try:
+        p = GasparMIDICompiler(filename)
+        p.compile(parseScore(filename))
+        p.midiFile()
+    finally:
+        MIDITrack.channelEvent = channelEvent
+        os.remove(filename)
+
+    def before():
+        with open(os.devnull, "wb") as out:
+            for deltaTime, key, velocity in events:
+                out.write(deltaTime.to_bytes(length=1, byteorder='big'))
+                out.write((0x90).to_bytes(length=1, byteorder='big'))
+                out.write(key.to_bytes(length=1, byteorder='big'))
+                out.write(velocity.to_bytes(length=1, byteorder='big'))
+
+    def after():
+        midiFile = MIDIFile()
+        track = midiFile.addTrack()
+        for deltaTime, key, velocity in events:
+            track.noteOn(deltaTime, key, velocity)
+        track.endOfTrack()
+        with open(os.devnull, "wb") as out:
+            out.write(midiFile.getvalue())
+
+    beforeRate = len(events) / timeIt(before, repeat)
+    afterRate = len(events) / timeIt(after, repeat)
+    print("midi: %d pages, %d events, four writes an event %.0f events/s, in memory %.0f events/s (x%.1f)" %
+          (pages, len(events), beforeRate, afterRate, afterRate / beforeRate))
+    return beforeRate, afterRate
+
+
+def benchmarkTracks(pages=100, repeat=3, jobs=4):
+    """
+    Encodes a synthetic score as a single track, as a track for each string, with the tracks shared between a pool
+    of jobs processes, and from a cache of tracks after the notes on one course have changed
+    :return: the seconds taken by each
+    """
+    from GasparMIDICompiler import GasparMIDICompiler, STRINGTRACKS
+    from GasparCache import ArtifactCache
+    filename = syntheticScore(pages)
+    directory = tempfile.mkdtemp()
+    try:
+        score = parseScore(filename)
+        compilers = {}
+        for name, options in (("single", {}), ("strings", {"tracks": STRINGTRACKS}),
+                              ("jobs", {"tracks": STRINGTRACKS, "jobs": jobs}),
+                              ("cached", {"tracks": STRINGTRACKS, "cache": ArtifactCache(directory)})):
+            compilers[name] = GasparMIDICompiler(filename, **options)
+            compilers[name].compile(score)
+        cached = compilers["cached"]
+        cached.midiFile()
+        notes = cached.notes
+
+        edits = []
+
+        def editCourse():
+            # Transpose the first course a little further each time, so that its tracks, and only those, are encoded again
+            edits.append(1)
+            cached.notes = [[start, stop, course, string, key + len(edits) * (course == 1)]
+                            for start, stop, course, string, key in notes]
+            cached.midiFile()
+
+        results = {name: timeIt(compilers[name].midiFile, repeat) for name in ("single", "strings", "jobs")}
+        results["cached"] = timeIt(editCourse, repeat)
+    finally:
+        os.remove(filename)
+        shutil.rmtree(directory)
+    tracks = len(compilers["strings"].trackNotes())
+    print("tracks: %d pages, %d notes, one track %.3fs, %d string tracks %.3fs, with %d jobs %.3fs (%d cores), "
+          "one course changed %.3fs (%d tracks encoded)" %
+          (pages, len(notes), results["single"], tracks, results["strings"], jobs, results["jobs"], os.cpu_count() or 1,
+           results["cached"], cached.encodedTracks))
+    return results
+
+
+def legacyNoteToMIDINumber(noteString):
+    # The old lookups, which built their tables afresh for every string of every course of every note
+    offsets = {"C": 0, "C#": 1, "D": 2, "D#": 3, "E": 4, "F": 5, "F#": 6, "G": 7, "G#": 8, "A": 9, "A#": 10, "B": 11}
+    note, octave = re.match('([A-G]#?)([0-9]+)', noteString.strip()).groups()
+    return (int(octave) + 1) * 12 + offsets[note]
+
+
+def legacyCourseFretToMIDINumbers(courses, course, fret):
+    midiCourses = [[legacyNoteToMIDINumber(s) for s in c] for c in courses]
+    return [s + fret for s in midiCourses[course - 1]]
+
+
+def legacyMIDINumberToLily(num):
+    octaves = [",,,,", ",,,", ",,", ",", "", "'", "''", "'''"]
+    notes = ["c", "cis", "d", "dis", "e", "f", "fis", "g", "gis", "a", "ais", "b"]
+    octave, note = divmod(int(num), 12)
+    return notes[note] + octaves[octave]
+
+
+def benchmarkTuning(repeat=5):
+    """
+    Looks up the MIDI numbers and Lilypond notes of every note in the Instruccion corpus, working them out from
+    the courses for each note as the compilers used to, and from a Tuning
+    :return: notes per second before and after
+    """
+    from TabToMIDI import getTuning
+    # (courses, course, fret) for every note
+    notes = []
+    for f in corpus():
+        courses = GlobalContext().courses
+        for e in parseScore(f).events():
+            if isinstance(e, ScoreSetting) and e.name == "courses":
+                courses = e.value
+            elif isinstance(e, ScoreChord):
+                notes.extend((courses, n.course, int(n.fret)) for n in e.notes if n.fret.isnumeric())
+
+    def before():
+        for courses, course, fret in notes:
+            keys = legacyCourseFretToMIDINumbers(courses, course, fret)
+            [legacyMIDINumberToLily(k) for k in keys]
+
+    def after():
+        tuning = None
+        for courses, course, fret in notes:
+            # The compilers get a new tuning when the courses change
+            if tuning is None or tuning.courses is not courses:
+                tuning = getTuning(courses)
+            tuning.keys(course, fret)
+            tuning.lilyNotes(course, fret)
+
+    beforeRate = len(notes) / timeIt(before, repeat)
+    afterRate = len(notes) / timeIt(after, repeat)
+    print("tuning: %d notes, worked out for each note %.0f notes/s, tuning tables %.0f notes/s (x%.1f)" %
+          (len(notes), beforeRate, afterRate, afterRate / beforeRate))
+    return beforeRate, afterRate
+
+
+def benchmarkAudio(pages=(2, 8)):
+    """
+    Renders the Instruccion corpus to WAV with the plucked string model, then synthetic anthologies to show that
+    memory stays flat as pieces get longer
+    :return: [(piece, seconds of audio, times faster than real time)]
+    """
+    from GasparAudio import GasparAudioCompiler, RENDERER
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        for f in corpus():
+            p = GasparAudioCompiler(shutil.copy(f, directory))
+            p.parseLines()
+            p.write()
+            print("audio: %-30s %6.1fs of audio in %6.3fs, %5.1fx real time" %
+                  (os.path.basename(f), p.duration, p.renderTime, p.realtimeFactor()))
+            results.append((os.path.basename(f), p.duration, p.realtimeFactor()))
+        total = sum(r[1] for r in results)
+        print("audio: corpus %.1fs of audio, %.1fx real time with %s" %
+              (total, total / sum(r[1] / r[2] for r in results), RENDERER))
+        for n in pages:
+            filename = syntheticScore(n, directory)
+            p = GasparAudioCompiler(filename)
+            p.parseLines()
+            peak = peakMemory(p.write)
+            print("audio: %4d pages, %6.1fs of audio, peak memory %8.1f KB while rendering" % (n, p.duration, peak / 1024))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def benchmarkImport(pages=(10, 20, 40), repeat=3):
+    """
+    Exports synthetic anthologies as MIDI and imports them again, checking that every chord comes back with the
+    same pitches at the same time
+    :return: [(notes, seconds to import)]
+    """
+    from GasparMIDICompiler import GasparMIDICompiler
+    from GasparImport import GasparMIDIImporter, chordFingerings, keyPositions, readMIDI
+
+    def chordsAt(filename):
+        # From the first chord, as tablature can't start with a rest
+        ticks, notes, timeSignature = readMIDI(filename)
+        result = {}
+        for start, key, length in notes:
+            result.setdefault(start - notes[0][0], set()).add(key)
+        return result
+
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        for n in pages:
+            source = GasparMIDICompiler(syntheticScore(n, directory))
+            source.parseLines()
+            source.write()
+            importer = GasparMIDIImporter(source.outputFilename, courses=source.tuning.courses)
+
+            def cold():
+                # Work the fingerings out afresh each time
+                keyPositions.cache_clear()
+                chordFingerings.cache_clear()
+                importer.write()
+
+            seconds = timeIt(cold, repeat)
+            copy = GasparMIDICompiler(importer.outputFilename)
+            copy.parseLines()
+            copy.write()
+            same = chordsAt(source.outputFilename) == chordsAt(copy.outputFilename)
+            notes = len(readMIDI(source.outputFilename)[1])
+            print("import: %3d pages, %5d notes imported in %.3fs (%.0f notes/s), %s" %
+                  (n, notes, seconds, notes / seconds, "round trip identical" if same else "ROUND TRIP DIFFERS"))
+            results.append((notes, seconds))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+class LegacyLilyCompiler(GasparLilyCompiler):
+    # Compiles the way the Lilypond compiler used to, adding each chord to ever longer header and body strings
+    def __init__(self, filename, courses=None):
+        GasparLilyCompiler.__init__(self, filename, courses)
+        self.header = lpOpenHeader
+        self.body = lpOpenBody
+
+    def appendToHeader(self, s):
+        self.header += s
+
+    def appendToBody(self, s):
+        self.body += s
+
+    def compileChord(self, chord):
+        chordString = ""
+        chordString += " < "
+        for n in chord.notes:
+            if n.fret.isnumeric():
+                chordString = chordString + " " + self.tuning.lilyNotes(n.course, int(n.fret))[0]
+        self.appendToBody(chordString + " >" + self.duration + ("  \\omit Score.BarLine" if self.barlines else ""))
+
+    def compile(self, score):
+        GasparLilyCompiler.compile(self, score)
+        self.compileBody(score)
+
+    def write(self, f=None):
+        print(self.header, file=f)
+        print(self.body, file=f)
+
+
+def benchmarkLily(pages=(100, 200, 400), repeat=3):
+    """
+    Compiles synthetic anthologies of tens of thousands of chords to Lilypond, adding each chord to a string as the
+    compiler used to, and streaming it to the file
+    :return: [(chords, seconds before, seconds after)]
+    """
+    results = []
+    for n in pages:
+        filename = syntheticScore(n)
+        try:
+            score = parseScore(filename)
+        finally:
+            os.remove(filename)
+        chords = sum(1 for e in score.events() if isinstance(e, ScoreChord))
+
+        def compileWith(compilerClass):
+            def run():
+                p = compilerClass(filename)
+                p.compile(score)
+                with open(os.devnull, "w") as f:
+                    p.write(f)
+            return run
+
+        before = timeIt(compileWith(LegacyLilyCompiler), repeat)
+        after = timeIt(compileWith(GasparLilyCompiler), repeat)
+        print("lily: %4d pages, %6d chords, strings %.3fs (%.2fus a chord), streamed %.3fs (%.2fus a chord)" %
+              (n, chords, before, before / chords * 1e6, after, after / chords * 1e6))
+        results.append((chords, before, after))
+    return results
+
+
+def benchmarkIndex(files=2000, repeat=20):
+    """
+    Indexes a library made of copies of the Instruccion corpus in nested directories, indexes it again unchanged and
+    with one file edited, then times some queries
+    :return: the seconds taken to index, to index again unchanged, and by each query
+    """
+    from GasparIndex import CorpusIndex
+    directory = tempfile.mkdtemp()
+    try:
+        sources = corpus()
+        for i in range(files):
+            subdirectory = os.path.join(directory, "book%d" % (i // 100))
+            os.makedirs(subdirectory, exist_ok=True)
+            shutil.copy(sources[i % len(sources)], os.path.join(subdirectory, "piece%d.sanz" % i))
+        index = CorpusIndex(os.path.join(directory, "index.sqlite"))
+        start = time.perf_counter()
+        index.update([directory])
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        index.update([directory])
+        unchanged = time.perf_counter() - start
+        with open(os.path.join(directory, "book0", "piece0.sanz"), "a") as f:
+            f.write("\n;An edit\n")
+        start = time.perf_counter()
+        indexed = index.update([directory])[0]
+        edited = time.perf_counter() - start
+        print("index: %d files indexed in %.2fs, again unchanged in %.3fs, with one edit in %.3fs (%d indexed)" %
+              (files, full, unchanged, edited, indexed))
+        queries = {"chacona in triple time": dict(title="chacona", time="3"),
+                   "alfabeto C with rasgueado DU": dict(alfabeto="C", rasgueado="DU"),
+                   "a chord": dict(keys=[59, 64]),
+                   "over 50 bars": dict(minBars=50)}
+        results = {"full": full, "unchanged": unchanged}
+        for name, conditions in queries.items():
+            found = len(index.find(**conditions))
+            results[name] = timeIt(lambda: index.find(**conditions), repeat)
+            print("index: %-30s %5d pieces in %.2fms" % (name, found, results[name] * 1000))
+        index.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def benchmarkConcordance(pieces=10000, notes=300, queries=200, length=12):
+    """
+    Indexes the interval n-grams of a synthetic corpus of melodies that wander by mostly small steps, as the
+    pieces of the corpus do, then searches for snippets of them transposed to other keys
+    :return: the mean and slowest query in seconds, and the fraction of snippets whose source was the best match
+    """
+    import random
+    from GasparConcordance import ConcordanceIndex
+    generator = random.Random(1)
+    steps = [-12, -7, -5, -4, -3, -2, -1, 0, 0, 1, 2, 3, 4, 5, 7, 12]
+    weights = [1, 2, 4, 3, 6, 12, 10, 8, 8, 10, 12, 6, 3, 4, 2, 1]
+    melodies = []
+    for i in range(pieces):
+        key = generator.randint(55, 72)
+        melody = []
+        for step in generator.choices(steps, weights, k=notes):
+            # Keep to the compass of the guitar
+            key = key + step if 40 <= key + step <= 88 else key - step
+            melody.append((key,))
+        melodies.append(melody)
+    concordance = ConcordanceIndex()
+    start = time.perf_counter()
+    for i, melody in enumerate(melodies):
+        concordance.add("piece%d.sanz" % i, melody)
+    built = time.perf_counter() - start
+    directory = tempfile.mkdtemp()
+    try:
+        concordance.save(os.path.join(directory, "concordance.pickle"))
+        size = os.path.getsize(os.path.join(directory, "concordance.pickle"))
+    finally:
+        shutil.rmtree(directory)
+    print("concordance: %d pieces, %d notes, %d n-grams, %d postings indexed in %.2fs, %.1f MB" %
+          (pieces, pieces * notes, len(concordance.postings), concordance.size(), built, size / 1024 / 1024))
+    times = []
+    found = 0
+    for i in range(queries):
+        piece = generator.randrange(pieces)
+        position = generator.randrange(notes - length)
+        transposition = generator.randint(-5, 5)
+        snippet = [(k + transposition,) for (k,) in melodies[piece][position:position + length]]
+        start = time.perf_counter()
+        matches = concordance.search(snippet)
+        times.append(time.perf_counter() - start)
+        found += bool(matches) and matches[0].path == "piece%d.sanz" % piece and matches[0].position == position
+    mean, slowest = sum(times) / len(times), max(times)
+    print("concordance: %d queries of %d notes, mean %.2fms, slowest %.2fms, source found first %d%%" %
+          (queries, length, mean * 1000, slowest * 1000, 100 * found / queries))
+    return mean, slowest, found / queries
+
+
+class PrintWriter(PSWriter):
+    # Renders the way the glyphs used to, with a print to the file for every line of Postscript
+    def __init__(self, file, context=None):
+        PSWriter.__init__(self, file, context)
+        self.trackState = False
+
+    def out(self, line):
+        print(line, file=self.file)
+
+    def write(self, s):
+        self.file.write(s)
+
+    def flush(self):
+        pass
+
+
+# Renders a score with the baseline code, which prints each line of Postscript to the file as it draws it
+baselineRender = """
+import os, sys, time
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+p = GasparPostscriptCompiler(sys.argv[1])
+p.parseLines()
+best = None
+for i in range(int(sys.argv[2])):
+    with open(os.devnull, "w") as f:
+        start = time.perf_counter()
+        p.render(f)
+        elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+print(best)
+"""
+
+
+def benchmarkRender(pages=100, repeat=3, baseline=None):
+    """
+    Renders a compiled synthetic score with the baseline code, with a print per line, and with a PSWriter
+    that writes each line as it comes and one that tracks the graphics state
+    :param baseline: the git revision of the baseline code, or GASPAR_BASELINE when None
+    :return: glyphs per second with the baseline code and with the PSWriter that tracks the graphics state
+    """
+    from GasparPostscriptCompiler import GasparPostscriptCompiler
+    filename = syntheticScore(pages)
+    try:
+        p = GasparPostscriptCompiler(filename)
+        p.compile(parseScore(filename))
+        baselineTime = runBaseline(baselineRender, filename, repeat, revision=baseline)[0]
+    finally:
+        os.remove(filename)
+    glyphs = sum(len(s.glyphs) for page in p.pages for s in page.staves)
+
+    def render(writer, trackGraphicsState=True):
+        p.context.trackGraphicsState = trackGraphicsState
+        with open(os.devnull, "w") as out:
+            w = writer(out, p.context)
+            p.render(w)
+            w.flush()
+
+    printRate = glyphs / timeIt(lambda: render(PrintWriter), repeat)
+    untrackedRate = glyphs / timeIt(lambda: render(PSWriter, False), repeat)
+    afterRate = glyphs / timeIt(lambda: render(PSWriter), repeat)
+    beforeRate = glyphs / baselineTime
+    print("render: %d pages, %d glyphs, baseline %.0f glyphs/s, print per line %.0f glyphs/s, "
+          "PSWriter %.0f glyphs/s, PSWriter tracking the graphics state %.0f glyphs/s (x%.2f)" %
+          (pages, glyphs, beforeRate, printRate, untrackedRate, afterRate, afterRate / beforeRate))
+    return beforeRate, afterRate
+
+
+# Compiles a score with the baseline code, which places and justifies the glyphs as it parses the lines,
+# and prints the bytes each glyph holds and the glyphs compiled per second
+baselineGlyphs = """
+import gc, sys, time, tracemalloc
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+def compileScore():
+    p = GasparPostscriptCompiler(sys.argv[1])
+    p.parseLines()
+    p.lines = None
+    return p
+gc.collect()
+tracemalloc.start()
+p = compileScore()
+size = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+glyphs = sum(len(s.glyphs) for page in p.pages for s in page.staves)
+best = None
+for i in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    compileScore()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+print(size / glyphs, glyphs / best)
+"""
+
+
+def benchmarkGlyphs(pages=100, repeat=5, baseline=None):
+    """
+    Lays out a synthetic score: compiles it to glyphs and lays out and justifies every stave,
+    and compares parsing, compiling and laying it out with the baseline code
+    :param baseline: the git revision of the baseline code, or GASPAR_BASELINE when None
+    :return: bytes per glyph, glyphs laid out per second
+    """
+    import gc
+    from GasparPostscriptCompiler import GasparPostscriptCompiler
+
+    def compileScore(score):
+        p = GasparPostscriptCompiler(filename)
+        p.compile(score)
+        return p
+
+    def placeScore(p):
+        for page in p.pages:
+            for s in page.staves:
+                s.layout(True)
+
+    filename = syntheticScore(pages)
+    try:
+        score = parseScore(filename)
+        baselineSize, baselineRate = runBaseline(baselineGlyphs, filename, repeat, revision=baseline)
+        parseTime = timeIt(lambda: placeScore(compileScore(parseScore(filename))), repeat)
+    finally:
+        os.remove(filename)
+
+    gc.collect()
+    tracemalloc.start()
+    p = compileScore(score)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    glyphs = sum(len(s.glyphs) for page in p.pages for s in page.staves)
+    layoutRate = glyphs / timeIt(lambda: placeScore(compileScore(score)), repeat)
+    placeRate = glyphs / timeIt(lambda: placeScore(p), repeat)
+    parseRate = glyphs / parseTime
+    print("glyphs: %d pages, %d glyphs, %.0f bytes/glyph, compile and layout %.0f glyphs/s, layout alone %.0f glyphs/s" %
+          (pages, glyphs, size / glyphs, layoutRate, placeRate))
+    print("glyphs: baseline %.0f -> %.0f bytes/glyph, parse, compile and layout %.0f -> %.0f glyphs/s (x%.2f)" %
+          (baselineSize, size / glyphs, baselineRate, parseRate, parseRate / baselineRate))
+    return size / glyphs, layoutRate
+
+
+def benchmarkLayout(pages=100, widths=(595, 842, 1190), repeat=3):
+    """
+    Engraves a synthetic score at several page widths, parsing and compiling it for every width
+    and compiling it once and laying it out again for every width
+    :return: seconds recompiling, seconds laying out again
+    """
+    from GasparPostscriptCompiler import GasparPostscriptCompiler
+    filename = syntheticScore(pages)
+
+    def render(p):
+        with open(os.devnull, "w") as out:
+            w = PSWriter(out, p.context)
+            p.render(w)
+            w.flush()
+
+    def recompile():
+        for width in widths:
+            p = GasparPostscriptCompiler(filename)
+            p.compile(parseScore(filename))
+            p.layout(pageWidth=width)
+            render(p)
+
+    def relayout():
+        p = GasparPostscriptCompiler(filename)
+        p.compile(parseScore(filename))
+        for width in widths:
+            p.layout(pageWidth=width)
+            render(p)
+
+    try:
+        before = timeIt(recompile, repeat)
+        after = timeIt(relayout, repeat)
+    finally:
+        os.remove(filename)
+    print("layout: %d pages at %d widths, parse and compile each %.3fs, compile once and lay out again %.3fs (x%.2f)" %
+          (pages, len(widths), before, after, before / after))
+    return before, after
+
+
+def benchmarkParallel(pages=200, repeat=3):
+    """
+    Renders a compiled synthetic score serially and with a pool of 2, 4, ... processes, up to the number of cores,
+    without a cache and with an empty one, as a first build with the default settings has.
+    The synthetic score repeats the same few pages, so with a cache most of its staves are rendered once and reused.
+    :return: [(jobs, seconds without a cache, seconds with a cache)]
+    """
+    from GasparPostscriptCompiler import GasparPostscriptCompiler
+    from GasparCache import ArtifactCache
+    filename = syntheticScore(pages)
+    try:
+        # Compiled with a cache, so the staves know the hashes of their source, and rendered with or without one
+        p = GasparPostscriptCompiler(filename, cache=ArtifactCache(tempfile.mkdtemp()))
+        p.compile(parseScore(filename))
+    finally:
+        os.remove(filename)
+        shutil.rmtree(p.cache.directory)
+    cores = os.cpu_count() or 1
+    jobs = [1] + [2 ** i for i in range(1, cores.bit_length() + 1) if 2 ** i <= max(cores, 2)]
+
+    def render(n, cached=False):
+        p.jobs = n
+        directory = tempfile.mkdtemp() if cached else None
+        p.cache = ArtifactCache(directory) if cached else None
+        try:
+            w = PSWriter(context=p.context)
+            p.render(w)
+            return w.getvalue()
+        finally:
+            if directory:
+                shutil.rmtree(directory)
+
+    serial = {cached: render(1, cached) for cached in (False, True)}
+    results = []
+    for n in jobs:
+        seconds = [timeIt(lambda: render(n, cached), repeat) for cached in (False, True)]
+        results.append((n, seconds[0], seconds[1]))
+        print("parallel: %d pages, %2d jobs on %d cores, no cache %.3fs (x%.2f), empty cache %.3fs (x%.2f), "
+              "identical output: %s" % (pages, n, cores, seconds[0], results[0][1] / seconds[0], seconds[1],
+                                        results[0][2] / seconds[1],
+                                        all(render(n, cached) == serial[cached] for cached in (False, True))))
+    return results
+
+
+def interpretationTime(filename, repeat=3):
+    # Time Ghostscript interpreting the file without rendering it, or None if Ghostscript isn't installed
+    gs = shutil.which("gs")
+    if gs is None:
+        return None
+    command = [gs, "-q", "-dNODISPLAY", "-dBATCH", "-dNOPAUSE", "-dNOSAFER", filename]
+    return timeIt(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), repeat)
+
+
+def benchmarkCompact():
+    """
+    Engraves the Instruccion corpus as normal and as compact Postscript
+    :return: total bytes normal, total bytes compact
+    """
+    from GasparPostscriptCompiler import tabset
+    totals = [0, 0]
+    times = [0, 0]
+    directory = tempfile.mkdtemp()
+    try:
+        for f in corpus():
+            sanz = shutil.copy(f, directory)
+            ps = os.path.splitext(sanz)[0] + ".ps"
+            sizes = []
+            for i, compact in enumerate((False, True)):
+                tabset(sanz, cache=None, compact=compact)
+                sizes.append(os.path.getsize(ps))
+                totals[i] += sizes[i]
+                t = interpretationTime(ps)
+                times[i] = None if t is None or times[i] is None else times[i] + t
+            print("compact: %-30s %8d -> %8d bytes (%.1fx smaller)" % (os.path.basename(f), sizes[0], sizes[1], sizes[0] / sizes[1]))
+    finally:
+        shutil.rmtree(directory)
+    print("compact: corpus %d -> %d bytes (%.1fx smaller)" % (totals[0], totals[1], totals[0] / totals[1]))
+    if times[0] is None:
+        print("compact: install Ghostscript (gs) to measure interpretation time")
+    else:
+        print("compact: interpretation %.3fs -> %.3fs (%.1fx faster)" % (times[0], times[1], times[0] / times[1]))
+    return totals
+
+
+def benchmarkConcurrency(compilations=64, threads=8):
+    """
+    Stress test: compiles and renders the French and Italian Canarios over and over in a pool of threads.
+    Each compilation has its own context, so a French piece must never flip the courses of an Italian one
+    :return: the number of compilations whose output differed from compiling the piece on its own
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from GasparPostscriptCompiler import GasparPostscriptCompiler
+    testMedia = os.path.join(os.path.dirname(corpusDir), "TestMedia")
+    pieces = [os.path.join(testMedia, f) for f in ("CanariosFrench.sanz", "CanariosItalian.sanz")]
+    scores = [parseScore(f) for f in pieces]
+
+    def engrave(i):
+        p = GasparPostscriptCompiler(pieces[i % 2])
+        p.compile(scores[i % 2])
+        w = PSWriter(context=p.context)
+        p.render(w)
+        return w.getvalue()
+
+    def engraveAll(pool):
+        return list(pool.map(engrave, range(compilations)))
+
+    class Serial:
+        map = staticmethod(map)
+
+    expected = [engrave(0), engrave(1)]
+    serial = timeIt(lambda: engraveAll(Serial), 3)
+    with ThreadPoolExecutor(threads) as pool:
+        concurrent = timeIt(lambda: engraveAll(pool), 3)
+        results = engraveAll(pool)
+    mismatches = sum(r != expected[i % 2] for i, r in enumerate(results))
+    print("concurrency: %d compilations, serial %.3fs, %d threads %.3fs, %d mismatched outputs" %
+          (compilations, serial, threads, concurrent, mismatches))
+    return mismatches
+
+
+def benchmarkPDF(repeat=3):
+    """
+    Engraves the Instruccion corpus to Postscript, converting it to PDF with Ghostscript if it is installed,
+    and straight to PDF
+    :return: total bytes of Postscript, total bytes of PDF through Ghostscript (or None), total bytes of native PDF
+    """
+    from GasparPostscriptCompiler import tabset, pdfset
+    gs = shutil.which("gs")
+    totals = [0, 0 if gs else None, 0]
+    times = [0, 0 if gs else None, 0]
+    directory = tempfile.mkdtemp()
+    try:
+        for f in corpus():
+            sanz = shutil.copy(f, directory)
+            ps = os.path.splitext(sanz)[0] + ".ps"
+            pdf = os.path.splitext(sanz)[0] + ".pdf"
+            times[0] += timeIt(lambda: tabset(sanz, cache=None), repeat)
+            totals[0] += os.path.getsize(ps)
+            if gs:
+                command = [gs, "-q", "-dBATCH", "-dNOPAUSE", "-dNOSAFER", "-sDEVICE=pdfwrite", "-sOutputFile=" + pdf, ps]
+                times[1] += timeIt(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), repeat)
+                totals[1] += os.path.getsize(pdf)
+            times[2] += timeIt(lambda: pdfset(sanz, cache=None), repeat)
+            totals[2] += os.path.getsize(pdf)
+    finally:
+        shutil.rmtree(directory)
+    print("pdf: corpus to Postscript %d bytes in %.3fs" % (totals[0], times[0]))
+    if gs:
+        print("pdf: through Ghostscript %d bytes in %.3fs (Postscript and conversion)" % (totals[1], times[0] + times[1]))
+    else:
+        print("pdf: install Ghostscript (gs) to time the Postscript to PDF conversion")
+    print("pdf: native PDF %d bytes in %.3fs (%.1fx smaller than the Postscript)" % (totals[2], times[2], totals[0] / totals[2]))
+    return totals
+
+
+def benchmarkSVG():
+    """
+    Engraves the Instruccion corpus to SVG with every glyph drawn inline and with repeated glyphs as symbols
+    :return: total bytes inline, total bytes with symbols
+    """
+    from GasparPostscriptCompiler import svgset
+    totals = [0, 0]
+    pages = 0
+    directory = tempfile.mkdtemp()
+    try:
+        for f in corpus():
+            sanz = shutil.copy(f, directory)
+            sizes = []
+            for symbols in (False, True):
+                svgset(sanz, symbols=symbols)
+                svgs = glob.glob(os.path.splitext(sanz)[0] + "-*.svg")
+                sizes.append(sum(os.path.getsize(s) for s in svgs))
+                for s in svgs:
+                    os.remove(s)
+            pages += len(svgs)
+            totals = [totals[0] + sizes[0], totals[1] + sizes[1]]
+            print("svg: %-30s %8d -> %8d bytes (%.1fx smaller)" % (os.path.basename(f), sizes[0], sizes[1], sizes[0] / sizes[1]))
+    finally:
+        shutil.rmtree(directory)
+    print("svg: corpus %d pages, %d bytes inline -> %d bytes with symbols (%.1fx smaller)" %
+          (pages, totals[0], totals[1], totals[0] / totals[1]))
+    return totals
+
+
+# The Postscript operators that change the graphics state
+stateOperators = ("setlinewidth", "setrgbcolor", "findfont", "stroke")
+
+
+def benchmarkGraphicsState():
+    """
+    Engraves the Instruccion corpus with and without graphics state tracking,
+    turning it off with the GRAPHICSSTATETRACKINGOFF switch
+    :return: total bytes without, total bytes with
+    """
+    from GasparPostscriptCompiler import tabset
+    totals = [0, 0]
+    counts = [dict.fromkeys(stateOperators, 0), dict.fromkeys(stateOperators, 0)]
+    times = [0, 0]
+    directory = tempfile.mkdtemp()
+    try:
+        for f in corpus():
+            sanz = os.path.join(directory, os.path.basename(f))
+            ps = os.path.splitext(sanz)[0] + ".ps"
+            source = open(f).read()
+            for i in (0, 1):
+                with open(sanz, "w") as out:
+                    out.write(source if i else "GRAPHICSSTATETRACKINGOFF\n" + source)
+                tabset(sanz, cache=None)
+                postscript = open(ps).read()
+                totals[i] += len(postscript)
+                for op in stateOperators:
+                    counts[i][op] += len(re.findall(r"\b%s\b" % op, postscript))
+                t = interpretationTime(ps)
+                times[i] = None if t is None or times[i] is None else times[i] + t
+    finally:
+        shutil.rmtree(directory)
+    for op in stateOperators:
+        print("state: %-12s %6d -> %6d" % (op, counts[0][op], counts[1][op]))
+    print("state: corpus %d -> %d bytes (%.1fx smaller)" % (totals[0], totals[1], totals[0] / totals[1]))
+    if times[0] is None:
+        print("state: install Ghostscript (gs) to measure interpretation time")
+    else:
+        print("state: interpretation %.3fs -> %.3fs (%.1fx faster)" % (times[0], times[1], times[0] / times[1]))
+    return totals
+
+
+benchmarks = {"lexer": benchmarkLexer,
+              "parser": benchmarkParser,
+              "streaming": benchmarkStreaming,
+              "render": benchmarkRender,
+              "glyphs": benchmarkGlyphs,
+              "layout": benchmarkLayout,
+              "parallel": benchmarkParallel,
+              "concurrency": benchmarkConcurrency,
+              "compact": benchmarkCompact,
+              "pdf": benchmarkPDF,
+              "svg": benchmarkSVG,
+              "midi": benchmarkMIDI,
+              "tracks": benchmarkTracks,
+              "tuning": benchmarkTuning,
+              "audio": benchmarkAudio,
+              "import": benchmarkImport,
+              "lily": benchmarkLily,
+              "index": benchmarkIndex,
+              "concordance": benchmarkConcordance,
+              "state": benchmarkGraphicsState}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    if "--baseline" in names:
+        # The revision the render and glyphs benchmarks compare with
+        i = names.index("--baseline")
+        os.environ["GASPAR_BASELINE"] = names[i + 1]
+        del names[i:i + 2]
+    for name in names or benchmarks:
+        benchmarks[name]()
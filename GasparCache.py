@@ -0,0 +1,216 @@
+__author__ = 'jimarlow'
+# An on-disk cache of parsed scores, generated artifacts (.ps, .midi, Lilypond.ly),
+# the rendered Postscript of individual pages and staves and the encoded tracks of MIDI files
+#
+# Every entry is keyed by a hash of
+#   the .sanz source
+#   the effective GlobalContext settings of the compilation, with options such as compact Postscript applied
+#   the backend name and version
+# so a rebuild of an unchanged library is just hash checks and file copies.
+#
+# The cache is a directory of entries, one directory per key. Each hit touches the entry so that,
+# when the cache grows beyond its size limit, the least recently used entries are evicted first.
+#
+# Inspect or clear the cache with: python GasparCache.py info|list|evict|clear
+import hashlib
+import os
+import pickle
+import shutil
+
+from GasparConfig import *
+from GasparScore import scoreVersion
+
+# Set GASPAR_CACHE to a directory to move the cache, or to "off" to disable it
+# Set GASPAR_CACHE_MB to change the size limit
+defaultCacheDir = os.environ.get("GASPAR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gaspar"))
+defaultMaxBytes = int(os.environ.get("GASPAR_CACHE_MB", 256)) * 1024 * 1024
+
+SCOREFILE = "score.pickle"
+ARTIFACTFILE = "artifact"
+FRAGMENTFILE = "fragment"
+
+
+def hashBytes(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def contextHash(context):
+    return hashBytes(repr(sorted(vars(context).items())))
+
+
+class ArtifactCache:
+    def __init__(self, directory=defaultCacheDir, maxBytes=defaultMaxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        # The size of the cache is only scanned from disk when we first write and when we evict
+        self.knownSize = None
+
+    def sourceHash(self, filename):
+        with open(filename, "rb") as f:
+            return hashBytes(f.read())
+
+    def scoreKey(self, sourceHash):
+        return hashBytes("score", scoreVersion, sourceHash)
+
+    def artifactKey(self, sourceHash, backend, version, context=None):
+        """
+        :param context: the GlobalContext the compilation starts from, or None for a backend that only uses the defaults
+        """
+        return hashBytes("artifact", backend, version, contextHash(context or GlobalContext()), sourceHash)
+
+    def fragmentKey(self, *parts):
+        return hashBytes("fragment", *parts)
+
+    def entryDir(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def touch(self, entry):
+        os.utime(entry)
+
+    def getScore(self, sourceHash):
+        entry = self.entryDir(self.scoreKey(sourceHash))
+        try:
+            with open(os.path.join(entry, SCOREFILE), "rb") as f:
+                score = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        self.touch(entry)
+        return score
+
+    def putScore(self, sourceHash, score):
+        def writeScore(path):
+            with open(path, "wb") as f:
+                pickle.dump(score, f, pickle.HIGHEST_PROTOCOL)
+        self.put(self.scoreKey(sourceHash), SCOREFILE, writeScore)
+
+    def fetch(self, key, outputFilename):
+        """
+        Copies a cached artifact to outputFilename
+        :return: True on a hit, False on a miss
+        """
+        entry = self.entryDir(key)
+        try:
+            shutil.copyfile(os.path.join(entry, ARTIFACTFILE), outputFilename)
+        except OSError:
+            self.misses += 1
+            return False
+        self.touch(entry)
+        self.hits += 1
+        return True
+
+    def store(self, key, outputFilename):
+        self.put(key, ARTIFACTFILE, lambda path: shutil.copyfile(outputFilename, path))
+
+    def getFragment(self, key, binary=False):
+        """
+        :param binary: the fragment is bytes e.g. an encoded MIDI track, otherwise it is text
+        :return: the cached fragment of output for key, or None
+        """
+        entry = self.entryDir(key)
+        try:
+            with open(os.path.join(entry, FRAGMENTFILE), "rb" if binary else "r", encoding=None if binary else "utf-8") as f:
+                fragment = f.read()
+        except OSError:
+            return None
+        self.touch(entry)
+        return fragment
+
+    def putFragment(self, key, fragment):
+        def writeFragment(path):
+            binary = isinstance(fragment, bytes)
+            with open(path, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+                f.write(fragment)
+        self.put(key, FRAGMENTFILE, writeFragment)
+
+    def put(self, key, name, writer):
+        # Write to a temporary file and rename so that a concurrent reader never sees half an entry
+        entry = self.entryDir(key)
+        os.makedirs(entry, exist_ok=True)
+        path = os.path.join(entry, name)
+        temp = path + ".%d.tmp" % os.getpid()
+        writer(temp)
+        os.replace(temp, path)
+        self.touch(entry)
+        if self.knownSize is None:
+            self.knownSize = self.size()
+        else:
+            self.knownSize += os.path.getsize(path)
+        if self.knownSize > self.maxBytes:
+            self.evict()
+
+    def entries(self):
+        """
+        :return: [(lastUsed, size, entryDir)] for every entry in the cache, least recently used first
+        """
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for prefix in os.listdir(self.directory):
+            prefixDir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefixDir):
+                continue
+            for key in os.listdir(prefixDir):
+                entry = os.path.join(prefixDir, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                    result.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    pass
+        return sorted(result)
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self):
+        # Least recently used entries go first
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for lastUsed, size, entry in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        self.knownSize = total
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.knownSize = 0
+
+
+def defaultCache():
+    # The cache the command line tools, batch builds and the watcher use. Library calls such as tabset only
+    # use a cache they are given, so they never write to the user's cache directory unless asked
+    if defaultCacheDir.lower() == "off":
+        return None
+    return ArtifactCache()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Inspect or clear the Gaspar artifact cache.')
+    parser.add_argument('command', choices=['info', 'list', 'evict', 'clear'],
+                        help='info: summary, list: every entry, evict: shrink to the size limit, clear: empty the cache')
+    parser.add_argument('--dir', default=defaultCacheDir, help='The cache directory')
+    parser.add_argument('--max-mb', type=int, default=defaultMaxBytes // (1024 * 1024), help='The size limit in megabytes')
+    args = parser.parse_args()
+
+    cache = ArtifactCache(args.dir, args.max_mb * 1024 * 1024)
+    if args.command == 'evict':
+        cache.evict()
+    if args.command == 'clear':
+        cache.clear()
+        print("Cleared ", cache.directory)
+    else:
+        entries = cache.entries()
+        if args.command == 'list':
+            for lastUsed, size, entry in entries:
+                print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(lastUsed)), "%10d" % size, os.path.basename(entry), ", ".join(os.listdir(entry)))
+        print("Cache ", cache.directory, ": ", len(entries), " entries, ", sum(e[1] for e in entries), " bytes (limit ", cache.maxBytes, ")", sep="")
@@ -0,0 +1,211 @@
+__author__ = 'jimarlow'
+# Finds concordances - passages in other pieces that share a melodic or harmonic pattern
+#
+# Each piece is reduced to a line of pitches, the highest note of each chord for the melody or the lowest for the
+# bass, using the pitches of the courses and frets that the corpus index records (see GasparIndex). The line is
+# turned into the intervals between its notes, so the same pattern matches in any key, and every run of NGRAM
+# intervals is an n-gram. The inverted index maps each n-gram to where it occurs, packed into an array of
+# integers, (piece << 32) | position.
+#
+# A query snippet is cut into n-grams the same way. Each occurrence of one of its n-grams votes for an alignment of
+# the snippet with a piece, and the alignments with the most votes are verified by comparing the intervals of the
+# snippet with the piece note by note.
+#
+# Build with:  python GasparConcordance.py build
+# Query with:  python GasparConcordance.py query --keys "64 62 60 59 57 59 60"
+import array
+import os
+import pickle
+import time
+from collections import Counter
+
+from GasparIndex import CorpusIndex, defaultIndexFile, splitPitches, summarize
+
+defaultConcordanceFile = os.path.splitext(defaultIndexFile)[0] + "-concordance.pickle"
+
+# The intervals in an n-gram
+NGRAM = 4
+# Intervals wider than this are folded to it, so each interval fits in a byte
+MAXINTERVAL = 60
+# N-grams that occur more often than this, such as a run of repeated notes, say little about a passage and
+# would make queries slow, so they don't vote unless the snippet has nothing else
+MAXPOSTINGS = 100000
+# The alignments with the most votes that are verified
+CANDIDATES = 50
+
+# The voices a piece can be reduced to
+TOP = "top"
+BASS = "bass"
+voices = {TOP: max, BASS: min}
+
+
+def line(chords, voice=TOP):
+    """
+    :param chords: the MIDI numbers of each chord e.g. [(52, 59), (55, 62, 67)]
+    :return: the pitch of the voice in each chord e.g. [59, 67] for the top voice
+    """
+    pick = voices[voice]
+    return [pick(chord) for chord in chords if chord]
+
+
+def intervals(pitches):
+    # The steps between successive pitches, in semitones
+    return array.array("b", [max(-MAXINTERVAL, min(MAXINTERVAL, b - a)) for a, b in zip(pitches, pitches[1:])])
+
+
+def ngrams(steps, n=NGRAM):
+    """
+    :return: each run of n intervals packed into an integer, a byte an interval, in the order they occur
+    """
+    # Each n-gram is the one before shifted along by an interval
+    mask = (1 << 8 * n) - 1
+    grams = []
+    gram = 0
+    for i, step in enumerate(steps):
+        gram = (gram << 8 | step + 128) & mask
+        if i >= n - 1:
+            grams.append(gram)
+    return grams
+
+
+class Concordance:
+    """
+    A match of a snippet in a piece
+    :param position: the note of the piece the snippet starts at, counted from 0
+    :param score: the fraction of the intervals of the snippet that are the same in the piece
+    :param votes: the n-grams of the snippet found at this position
+    """
+    __slots__ = ("path", "position", "score", "votes")
+
+    def __init__(self, path, position, score, votes):
+        self.path = path
+        self.position = position
+        self.score = score
+        self.votes = votes
+
+    def __repr__(self):
+        return "Concordance(%r, %d, %.2f, %d)" % (self.path, self.position, self.score, self.votes)
+
+
+class ConcordanceIndex:
+    """
+    An inverted index of the interval n-grams of a corpus
+    :param voice: TOP for melodic concordances, BASS for harmonic ones
+    """
+    def __init__(self, voice=TOP, n=NGRAM):
+        self.voice = voice
+        self.n = n
+        self.paths = []
+        # The intervals of each piece, to verify matches
+        self.steps = []
+        # n-gram -> array of (piece << 32) | position
+        self.postings = {}
+
+    def add(self, path, chords):
+        """
+        Adds a piece to the index
+        :param chords: the MIDI numbers of each of its chords
+        """
+        piece = len(self.paths)
+        steps = intervals(line(chords, self.voice))
+        self.paths.append(path)
+        self.steps.append(steps)
+        postings = self.postings
+        base = piece << 32
+        for position, gram in enumerate(ngrams(steps, self.n)):
+            found = postings.get(gram)
+            if found is None:
+                found = postings[gram] = array.array("Q")
+            found.append(base | position)
+
+    def addCorpus(self, corpus):
+        """
+        Adds every piece in a CorpusIndex, from the pitches it has recorded
+        """
+        for row in corpus.db.execute("SELECT path, pitches FROM pieces ORDER BY path"):
+            self.add(row["path"], splitPitches(row["pitches"]))
+
+    def addFiles(self, filenames):
+        # Parses each file, for a corpus that hasn't been indexed
+        for f in filenames:
+            self.add(os.path.abspath(f), splitPitches(summarize(f)["pitches"]))
+
+    def save(self, filename=defaultConcordanceFile):
+        # Plain values, so an index saved by the command line loads anywhere
+        with open(filename, "wb") as f:
+            pickle.dump((self.voice, self.n, self.paths, self.steps, self.postings), f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename=defaultConcordanceFile):
+        with open(filename, "rb") as f:
+            voice, n, paths, steps, postings = pickle.load(f)
+        index = ConcordanceIndex(voice, n)
+        index.paths, index.steps, index.postings = paths, steps, postings
+        return index
+
+    def search(self, chords, limit=10, minScore=0.5):
+        """
+        Finds the passages that share the pattern of a snippet, in any key
+        :param chords: the MIDI numbers of each chord of the snippet, or of each note of a melody e.g. [(64,), (62,)]
+        :param limit: the most matches to return
+        :param minScore: the least fraction of the snippet's intervals a match must share
+        :return: [Concordance], best first
+        """
+        chords = [c if isinstance(c, (tuple, list)) else (c,) for c in chords]
+        steps = intervals(line(chords, self.voice))
+        grams = ngrams(steps, self.n)
+        # Each posting of each n-gram votes for the piece and position the snippet would start at
+        votes = Counter()
+        found = [(offset, self.postings.get(gram, ())) for offset, gram in enumerate(grams)]
+        common = [f for f in found if len(f[1]) <= MAXPOSTINGS]
+        for offset, postings in common or found:
+            votes.update(p - offset for p in postings if p & 0xFFFFFFFF >= offset)
+        matches = []
+        for start, count in votes.most_common(CANDIDATES):
+            piece, position = start >> 32, start & 0xFFFFFFFF
+            same = sum(1 for a, b in zip(steps, self.steps[piece][position:position + len(steps)]) if a == b)
+            score = same / len(steps)
+            if score >= minScore:
+                matches.append(Concordance(self.paths[piece], position, score, count))
+        matches.sort(key=lambda m: (-m.score, -m.votes))
+        return matches[:limit]
+
+    def size(self):
+        # The number of postings
+        return sum(len(p) for p in self.postings.values())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Find concordances - passages that share a melodic or harmonic pattern.')
+    parser.add_argument('--db', default=defaultIndexFile, help='The corpus index, see GasparIndex.py')
+    parser.add_argument('--concordance', default=defaultConcordanceFile, help='The concordance index')
+    commands = parser.add_subparsers(dest='command', required=True)
+    buildParser = commands.add_parser('build', help='Build the concordance index from the corpus index')
+    buildParser.add_argument('--voice', choices=sorted(voices), default=TOP, help='The voice to find patterns in')
+    queryParser = commands.add_parser('query', help='Find the passages that share the pattern of a snippet')
+    snippet = queryParser.add_mutually_exclusive_group(required=True)
+    snippet.add_argument('--keys', help='The MIDI numbers of a melody e.g. "64 62 60 59 57"')
+    snippet.add_argument('--sanz', help='A .sanz file holding the snippet')
+    queryParser.add_argument('--limit', type=int, default=10, help='The most matches to list')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'build':
+        corpus = CorpusIndex(args.db)
+        concordance = ConcordanceIndex(args.voice)
+        concordance.addCorpus(corpus)
+        corpus.close()
+        concordance.save(args.concordance)
+        print("Indexed %d pieces, %d n-grams, %d postings in %.2fs - %s" %
+              (len(concordance.paths), len(concordance.postings), concordance.size(), time.perf_counter() - start,
+               args.concordance))
+    else:
+        concordance = ConcordanceIndex.load(args.concordance)
+        loaded = time.perf_counter()
+        chords = [(int(k),) for k in args.keys.split()] if args.keys else splitPitches(summarize(args.sanz)["pitches"])
+        matches = concordance.search(chords, args.limit)
+        for m in matches:
+            print("%-50s note %5d  %3.0f%% of intervals  %d n-grams" % (os.path.relpath(m.path), m.position, m.score * 100, m.votes))
+        print("%d matches in %.1fms" % (len(matches), (time.perf_counter() - loaded) * 1000))
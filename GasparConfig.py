@@ -16,6 +16,13 @@ SEMIQUAVER = 3
 
 DOTTED = True
 
+# Defaults that glyphs and Postscript primitives need before there is a context to read them from
+DEFAULTNUMBEROFCOURSES = 5
+TICKBODYRADIUS = 2.5
+
+# Every compilation has its own GlobalContext, which starts from the defaults and collects the settings in its score,
+# so any number of compilations can run at once e.g. in a thread pool
+
 class GlobalContext:
     def __init__(self):
         self.reset()
@@ -33,7 +40,7 @@ class GlobalContext:
 
         # Stave layout
         self.staveSeparation = 48
-        self.numberOfCourses=5
+        self.numberOfCourses=DEFAULTNUMBEROFCOURSES
         self.courseSpacing=10
         self.slots=30
         self.courses=[['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D4', 'D4'], ['A4', 'A4']]
@@ -49,7 +56,7 @@ class GlobalContext:
         self.barlineSize = 8
 
         # Rythm
-        self.tickBodyRadius = 2.5
+        self.tickBodyRadius = TICKBODYRADIUS
 
         # Text
         self.titleFace = "Zapfino"
@@ -75,14 +82,17 @@ class GlobalContext:
         self.mapFrets = True
         self.french = False
 
-
-GC = GlobalContext()
+        # Output
+        # Compact Postscript defines short procedures in the prolog and prints numbers with a fixed precision
+        self.compactPostscript = False
+        # Only set the line width, colour and font when they change, and stroke runs of lines as one path
+        self.trackGraphicsState = True
 
 
-def getStaveHeight(): return (GC.numberOfCourses-1) * GC.courseSpacing
+def getStaveHeight(context): return (context.numberOfCourses-1) * context.courseSpacing
 
 
-def getCourseYOffset(courseNumber=1): return (courseNumber-1) * GC.courseSpacing
+def getCourseYOffset(context, courseNumber=1): return (courseNumber-1) * context.courseSpacing
 
 
 def toS(line, pattern="-"): return line.split(pattern)[1].lstrip()
@@ -0,0 +1,390 @@
+__author__ = 'jimarlow'
+# Imports standard MIDI files as .sanz tablature - the inverse of GasparMIDICompiler
+#
+# The notes that start together are a chord, and each chord lasts until the next one starts.
+# Each chord can be played in many ways, a course and fret for each of its notes, so we choose the fingering of the
+# whole piece that is easiest to play: a dynamic programme over the chords, where each fingering costs its stretch
+# and how high it is up the neck, and each move from one fingering to the next costs the distance the hand shifts.
+# The fingerings of each distinct chord are worked out once and only the cheapest few are kept, so a piece of a
+# thousand notes imports in a few milliseconds.
+#
+# Import with: python GasparImport.py Canarios.midi
+import functools
+import math
+import os
+
+from GasparConfig import *
+from TabToMIDI import getTuning
+
+# The highest fret we finger
+MAXIMPORTFRET = 12
+# The cheapest fingerings of each chord that the search keeps
+BEAM = 8
+# Costs: each fret the hand spans beyond a comfortable stretch (squared), each fret up the neck, each fret the
+# hand shifts between chords, a string that sounds a note that isn't in the chord and a note that can't be played
+STRETCHCOST = 2.0
+COMFORTABLESTRETCH = 3
+HEIGHTCOST = 0.2
+SHIFTCOST = 1.0
+EXTRACOST = 1.5
+DROPCOST = 100.0
+
+# The duration prefixes and their length in crotchets
+importDurations = [("W", 4), ("M.", 3), ("M", 2), ("C.", 1.5), ("C", 1), ("Q.", 0.75), ("Q", 0.5), ("SQ.", 0.375), ("SQ", 0.25)]
+
+# The time signatures that tablature writes with a single figure
+singleTimeSignatures = {(4, 4): "C", (3, 4): "3", (2, 4): "2"}
+
+# MIDI channel 10 is percussion
+PERCUSSION = 9
+
+
+def readQuantity(data, i):
+    # Reads a variable length quantity, see variableLengthQuantity
+    value = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value = value << 7 | byte & 0x7F
+        if not byte & 0x80:
+            return value, i
+
+
+def readMIDI(filename):
+    """
+    Reads the notes of a standard MIDI file of any format, from all its tracks
+    :return: the ticks per crotchet, [(start, key, length)] in ticks in the order they start,
+    and the first time signature as (top, bottom) or None
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd":
+        raise ValueError("%s is not a MIDI file" % filename)
+    headerLength = int.from_bytes(data[4:8], "big")
+    tracks = int.from_bytes(data[10:12], "big")
+    ticks = int.from_bytes(data[12:14], "big")
+    if ticks & 0x8000:
+        raise ValueError("%s counts time in SMPTE frames, which isn't supported" % filename)
+    notes = []
+    timeSignature = None
+    i = 8 + headerLength
+    for track in range(tracks):
+        if data[i:i + 4] != b"MTrk":
+            raise ValueError("%s has a damaged track" % filename)
+        end = i + 8 + int.from_bytes(data[i + 4:i + 8], "big")
+        i += 8
+        now = 0
+        status = None
+        # Key and channel -> the starts of the notes that are sounding
+        sounding = {}
+        while i < end:
+            delta, i = readQuantity(data, i)
+            now += delta
+            if data[i] == 0xFF:
+                kind = data[i + 1]
+                length, i = readQuantity(data, i + 2)
+                if kind == 0x58 and timeSignature is None:
+                    timeSignature = (data[i], 2 ** data[i + 1])
+                i += length
+                status = None
+            elif data[i] in (0xF0, 0xF7):
+                length, i = readQuantity(data, i + 1)
+                i += length
+                status = None
+            else:
+                if data[i] & 0x80:
+                    status = data[i]
+                    i += 1
+                kind, channel = status & 0xF0, status & 0x0F
+                if kind in (0xC0, 0xD0):
+                    # Program change and channel pressure have one data byte
+                    i += 1
+                    continue
+                key, velocity = data[i], data[i + 1]
+                i += 2
+                if channel == PERCUSSION:
+                    continue
+                if kind == 0x90 and velocity:
+                    sounding.setdefault((key, channel), []).append(now)
+                elif kind == 0x80 or kind == 0x90:
+                    starts = sounding.get((key, channel))
+                    if starts:
+                        start = starts.pop(0)
+                        notes.append((start, key, now - start))
+        # Notes that are never stopped last until the end of the track
+        for (key, channel), starts in sounding.items():
+            notes.extend((start, key, now - start) for start in starts)
+        i = end
+    notes.sort()
+    return ticks, notes, timeSignature
+
+
+def chords(notes, tolerance):
+    """
+    Groups notes that start within tolerance ticks of each other into chords
+    :return: [(start, keys, length)], the length being that of the longest note, for the last chord
+    """
+    result = []
+    for start, key, length in notes:
+        if result and start - result[-1][0] <= tolerance:
+            result[-1][1].add(key)
+            result[-1][2] = max(result[-1][2], length)
+        else:
+            result.append([start, {key}, length])
+    return [(start, frozenset(keys), length) for start, keys, length in result]
+
+
+def durationPrefix(ticks, ticksPerCrotchet):
+    # The duration closest to the number of ticks, by ratio
+    crotchets = max(ticks, 1) / ticksPerCrotchet
+    return min(importDurations, key=lambda d: abs(math.log(crotchets / d[1])))[0]
+
+
+class Fingering:
+    """
+    The courses and frets for a chord, the cost of playing it and where the hand is
+    :param notes: ((course, fret), ...) in course order
+    :param position: the lowest fret stopped, or None if every course is open
+    """
+    __slots__ = ("notes", "cost", "position")
+
+    def __init__(self, notes, cost, position):
+        self.notes = notes
+        self.cost = cost
+        self.position = position
+
+
+def shiftCost(a, b):
+    # Open chords leave the hand free to go anywhere
+    if a.position is None or b.position is None:
+        return 0
+    return SHIFTCOST * abs(a.position - b.position)
+
+
+@functools.lru_cache(maxsize=None)
+def keyPositions(courses, key):
+    """
+    :param courses: the courses as a tuple of tuples, so that they can be a cache key
+    :return: ((course, fret), ...) for each way to play the key, or to play it an octave or more away if it is out of range
+    """
+    tuning = getTuning(courses)
+    for octave in (0, -12, 12, -24, 24):
+        positions = tuple((course, fret) for course in range(1, len(courses) + 1)
+                          for fret in range(MAXIMPORTFRET + 1) if key + octave in tuning.keys(course, fret))
+        if positions:
+            return positions
+    return ()
+
+
+@functools.lru_cache(maxsize=None)
+def chordFingerings(courses, keys):
+    """
+    Every way to play a chord on the courses, a course for each note, cheapest first.
+    Worked out once for each distinct chord, as pieces use the same chords over and over.
+    :param keys: a frozenset of MIDI numbers
+    :return: the BEAM cheapest Fingerings
+    """
+    tuning = getTuning(courses)
+    keys = sorted(keys)
+    found = []
+
+    def search(i, chosen, covered, drops):
+        # Finger the ith key, unless a course already chosen sounds it
+        if i == len(keys):
+            found.append(fingering(chosen, drops))
+            return
+        if keys[i] in covered:
+            search(i + 1, chosen, covered, drops)
+            return
+        used = {course for course, fret in chosen}
+        for course, fret in keyPositions(courses, keys[i]):
+            if course not in used:
+                search(i + 1, chosen + ((course, fret),), covered | set(tuning.keys(course, fret)), drops)
+        # A chord with more notes than we have courses drops some
+        search(i + 1, chosen, covered, drops + 1)
+
+    def fingering(chosen, drops):
+        stopped = [fret for course, fret in chosen if fret > 0]
+        stretch = max(stopped) - min(stopped) if stopped else 0
+        extras = sum(1 for course, fret in chosen for k in tuning.keys(course, fret) if k not in keys)
+        cost = (STRETCHCOST * max(0, stretch - COMFORTABLESTRETCH) ** 2 + HEIGHTCOST * sum(stopped) +
+                EXTRACOST * extras + DROPCOST * drops)
+        return Fingering(tuple(sorted(chosen)), cost, min(stopped) if stopped else None)
+
+    search(0, (), set(), 0)
+    found.sort(key=lambda f: f.cost)
+    return tuple(found[:BEAM])
+
+
+def fingerChords(courses, keySets):
+    """
+    Chooses the fingering of each chord so that the whole piece costs least to play
+    :param keySets: the keys of each chord
+    :return: the Fingering for each chord
+    """
+    courses = tuple(tuple(c) for c in courses)
+    previous = None
+    # For each chord, the best fingering of the chord before for each of its fingerings
+    choices = []
+    for keys in keySets:
+        options = chordFingerings(courses, keys)
+        if previous is None:
+            totals = [f.cost for f in options]
+            choices.append([None] * len(options))
+        else:
+            # The fingerings before, cheapest first, so that the search stops once no move can be cheaper
+            ranked = sorted(range(len(previous[0])), key=lambda k: previous[1][k])
+            totals = []
+            best = []
+            for f in options:
+                bestTotal, bestK = None, None
+                for k in ranked:
+                    if bestTotal is not None and previous[1][k] >= bestTotal:
+                        break
+                    total = previous[1][k] + shiftCost(previous[0][k], f)
+                    if bestTotal is None or total < bestTotal:
+                        bestTotal, bestK = total, k
+                totals.append(bestTotal + f.cost)
+                best.append(bestK)
+            choices.append(best)
+        previous = (options, totals)
+    if previous is None:
+        return []
+    # Follow the best fingerings back from the cheapest end
+    k = min(range(len(previous[1])), key=lambda k: previous[1][k])
+    result = []
+    for keys, best in zip(reversed(keySets), reversed(choices)):
+        result.append(chordFingerings(courses, keys)[k])
+        k = best[k]
+    result.reverse()
+    return result
+
+
+class GasparMIDIImporter:
+    """
+    Imports a MIDI file as .sanz tablature, written to e.g. CanariosImported.sanz so that it never overwrites a source
+    :param courses: the tuning to finger for, by default that of the settings
+    """
+    def __init__(self, filename, courses=None, title=None):
+        context = GlobalContext()
+        self.filename = filename
+        self.outputFilename = os.path.splitext(self.filename)[0] + "Imported.sanz"
+        self.courses = courses if courses is not None else context.courses
+        self.title = title if title is not None else os.path.splitext(os.path.basename(filename))[0]
+        # Staves are filled up to their slots, and pages with as many staves as fit between the margins
+        self.slots = context.slots - 1
+        self.stavesPerPage = max(1, math.floor((context.pageHeight - context.topMargin - context.bottomMargin) /
+                                               (getStaveHeight(context) + context.staveSeparation)))
+        self.lines = []
+
+    def read(self):
+        """
+        :return: [(start, duration prefix, Fingering)] for each chord, and the time signature
+        """
+        ticks, notes, timeSignature = readMIDI(self.filename)
+        grouped = chords(notes, ticks // 16)
+        fingerings = fingerChords(self.courses, [keys for start, keys, length in grouped])
+        result = []
+        for i, ((start, keys, length), fingering) in enumerate(zip(grouped, fingerings)):
+            duration = grouped[i + 1][0] - start if i + 1 < len(grouped) else length
+            result.append((start, durationPrefix(duration, ticks), fingering))
+        self.ticks = ticks
+        return result, timeSignature
+
+    def bars(self, chords, timeSignature):
+        """
+        Splits the chords into bars by the time signature, 4/4 if there isn't one
+        :return: [(number, chords)] for each bar with chords in it, numbered from 1 by where it is in the piece
+        """
+        top, bottom = timeSignature or (4, 4)
+        barLength = self.ticks * 4 * top // bottom
+        bars = []
+        for chord in chords:
+            bar = chord[0] // barLength
+            while len(bars) <= bar:
+                bars.append([])
+            bars[bar].append(chord)
+        # Bars without any chords start in the middle of a chord that was held, and keep their numbers
+        return [(number, b) for number, b in enumerate(bars, 1) if b]
+
+    def timeSignatureLine(self, timeSignature):
+        top, bottom = timeSignature
+        return "T-" + singleTimeSignatures.get((top, bottom), "%d-%d" % (top, bottom))
+
+    def startStave(self, lines, stave, timeSignature):
+        """
+        Starts a stave, and a new page when the last page is full
+        :return: the slots taken at the start of the stave
+        """
+        if (stave - 1) % self.stavesPerPage == 0:
+            page = (stave - 1) // self.stavesPerPage + 1
+            lines.append("P-%d" % page)
+            if page == 1:
+                lines.append("    TITLE " + self.title)
+        lines.append("    S-%d" % stave)
+        if stave == 1 and timeSignature:
+            lines.append("            " + self.timeSignatureLine(timeSignature))
+            return 3
+        return 0
+
+    def layout(self, chords, timeSignature):
+        """
+        Writes the chords out as pages, staves and bars. A stave holds as many whole bars as fit in its slots,
+        and a bar too long for a stave of its own carries on onto the next stave.
+        :return: the lines of the .sanz file
+        """
+        lines = ["COURSES " + " ".join("-".join(c) for c in self.courses)]
+        stave = 0
+        used = self.slots
+        lastPrefix = None
+        for number, bar in self.bars(chords, timeSignature):
+            # Each chord takes a slot, as does the barline before the bar
+            if used + len(bar) + 1 > self.slots:
+                stave += 1
+                used = self.startStave(lines, stave, timeSignature)
+                lastPrefix = None
+            else:
+                lines.append("        B-%d" % number)
+                used += 1
+            for start, prefix, fingering in bar:
+                if used >= self.slots:
+                    stave += 1
+                    used = self.startStave(lines, stave, timeSignature)
+                    lastPrefix = None
+                notes = " ".join("%d-%d" % n for n in fingering.notes)
+                if prefix != lastPrefix:
+                    notes = prefix + " " + notes
+                    lastPrefix = prefix
+                lines.append("            " + notes)
+                used += 1
+        lines.append("        EB-1")
+        return lines
+
+    def write(self):
+        chords, timeSignature = self.read()
+        self.lines = self.layout(chords, timeSignature)
+        with open(self.outputFilename, "w") as f:
+            f.write("\n".join(self.lines) + "\n")
+
+
+def importMIDI(filename, courses=None, title=None):
+    """
+    Imports a MIDI file as .sanz tablature
+    :return: the name of the .sanz file
+    """
+    importer = GasparMIDIImporter(filename, courses, title)
+    importer.write()
+    return importer.outputFilename
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import MIDI files as .sanz tablature.')
+    parser.add_argument('midiFileNames', nargs='+', help='The MIDI files to import')
+    parser.add_argument('--courses', help='The tuning to finger for e.g. "E4 B3-B3 G3-G3 D4-D4 A3-A3"')
+    args = parser.parse_args()
+
+    courses = [c.split("-") for c in args.courses.split()] if args.courses else None
+    for f in args.midiFileNames:
+        print("Imported", f, "as", importMIDI(f, courses))
@@ -0,0 +1,326 @@
+__author__ = 'jimarlow'
+# A searchable index of a library of .sanz files, kept in a SQLite database
+#
+# Each file is parsed once and its titles, composers, time signatures, courses, alfabeto and rasgueado, bar count
+# and the pitches of its chords are recorded. Indexing again only parses the files that have changed: a file whose
+# modification time and size are unchanged is skipped without being read, and one that has been touched but not
+# edited is recognised by the hash of its source.
+#
+# Index a library with: python GasparIndex.py index Instruccion
+# Query it with e.g.:   python GasparIndex.py query --title Chacona --time 3 --alfabeto B
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from GasparScore import *
+from GasparCache import hashBytes
+from GasparLilyCompiler import cleanText
+from TabToMIDI import getTuning
+
+# Set GASPAR_INDEX to move the index
+defaultIndexFile = os.environ.get("GASPAR_INDEX", os.path.join(os.path.expanduser("~"), ".cache", "gaspar-index.sqlite"))
+
+# Bump this whenever what is recorded for a file changes, so that every file is indexed again
+indexVersion = 1
+
+schema = """
+CREATE TABLE IF NOT EXISTS pieces (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, hash TEXT,
+    title TEXT, composer TEXT, courses TEXT, pages INTEGER, bars INTEGER, chords INTEGER, pitches TEXT);
+CREATE TABLE IF NOT EXISTS titles (piece INTEGER, title TEXT, composer TEXT);
+CREATE TABLE IF NOT EXISTS timeSignatures (piece INTEGER, top TEXT, bottom TEXT);
+CREATE TABLE IF NOT EXISTS alfabeto (piece INTEGER, chord TEXT, count INTEGER);
+CREATE TABLE IF NOT EXISTS rasgueado (piece INTEGER, pattern TEXT, count INTEGER);
+CREATE TABLE IF NOT EXISTS chords (piece INTEGER, keys TEXT, count INTEGER);
+CREATE INDEX IF NOT EXISTS titlesByPiece ON titles (piece);
+CREATE INDEX IF NOT EXISTS timeSignaturesByTop ON timeSignatures (top, piece);
+CREATE INDEX IF NOT EXISTS alfabetoByChord ON alfabeto (chord, piece);
+CREATE INDEX IF NOT EXISTS rasgueadoByPattern ON rasgueado (pattern, piece);
+CREATE INDEX IF NOT EXISTS chordsByKeys ON chords (keys, piece);
+"""
+
+# The columns of the pieces that queries list - the pitches can be long
+listedColumns = "id, path, mtime, size, hash, title, composer, courses, pages, bars, chords"
+
+# The tables that hold rows for each piece
+pieceTables = ("titles", "timeSignatures", "alfabeto", "rasgueado", "chords")
+
+
+def coursesText(courses):
+    # As written in a COURSES line e.g. "E4 B3-B3 G3-G3 D4-D4 A4-A4"
+    return " ".join("-".join(c) for c in courses)
+
+
+def keysText(keys):
+    return " ".join(str(k) for k in sorted(set(int(k) for k in keys)))
+
+
+def summarize(filename):
+    """
+    Parses a .sanz file and collects what the index records about it. Runs in a worker process.
+    :return: a dict of plain values
+    """
+    score = parseScore(filename)
+    courses = GlobalContext().courses
+    tuning = getTuning(courses)
+    firstCourses = None
+    summary = {"titles": [], "timeSignatures": [], "alfabeto": {}, "rasgueado": {}, "chords": {},
+               "pages": len(score.pages), "bars": 0}
+    # The pitches of each chord, in the order they are played
+    pitches = []
+    for e in score.events():
+        if isinstance(e, ScoreChord):
+            keys = [k for n in e.notes if n.fret.isnumeric() for k in tuning.keys(n.course, int(n.fret))]
+            if keys:
+                if firstCourses is None:
+                    firstCourses = courses
+                text = keysText(keys)
+                pitches.append(text)
+                summary["chords"][text] = summary["chords"].get(text, 0) + 1
+        elif isinstance(e, ScoreBarline):
+            # Unnumbered barlines are only there to justify the tablature
+            if e.kind != "B" or e.number[:1].isdigit():
+                summary["bars"] += 1
+        elif isinstance(e, ScoreTimeSignature):
+            if (e.top, e.bottom) not in summary["timeSignatures"]:
+                summary["timeSignatures"].append((e.top, e.bottom))
+        elif isinstance(e, ScoreAlfabeto):
+            summary["alfabeto"][e.chord] = summary["alfabeto"].get(e.chord, 0) + 1
+        elif isinstance(e, ScoreRasgueado):
+            summary["rasgueado"][e.pattern] = summary["rasgueado"].get(e.pattern, 0) + 1
+        elif isinstance(e, ScorePage):
+            if e.title or e.composer:
+                summary["titles"].append((cleanText(e.title.strip()), cleanText(e.composer.strip())))
+        elif isinstance(e, ScoreSetting) and e.name == "courses":
+            courses = e.value
+            tuning = getTuning(courses)
+    summary["courses"] = coursesText(firstCourses or courses)
+    # Chords are separated by commas, and the pitches of a chord by spaces e.g. "52 59,55 62 67"
+    summary["pitches"] = ",".join(pitches)
+    return summary
+
+
+def indexedFiles(paths):
+    """
+    Expands files and directory trees into .sanz files
+    :return: the absolute paths of the .sanz files, in order
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                found.extend(os.path.join(directory, f) for f in sorted(filenames) if f.endswith(".sanz"))
+        elif os.path.isfile(path):
+            found.append(path)
+    return list(dict.fromkeys(os.path.abspath(f) for f in found))
+
+
+def splitPitches(pitches):
+    """
+    :param pitches: the pitches of a piece as recorded in the index e.g. "52 59,55 62 67"
+    :return: the MIDI numbers of each chord e.g. [(52, 59), (55, 62, 67)]
+    """
+    return [tuple(int(k) for k in chord.split()) for chord in pitches.split(",")] if pitches else []
+
+
+class CorpusIndex:
+    """
+    The index of a library of .sanz files in a SQLite database
+    :param filename: the database, created if it doesn't exist, or ":memory:"
+    """
+    def __init__(self, filename=defaultIndexFile):
+        self.filename = filename
+        if filename != ":memory:" and os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(schema)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != indexVersion:
+            # Forget what an older version of the indexer recorded, so that every file is indexed again
+            self.db.execute("UPDATE pieces SET hash = NULL")
+            self.db.execute("PRAGMA user_version = %d" % indexVersion)
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths, jobs=1, force=False):
+        """
+        Indexes the .sanz files in paths that are new or have changed, and forgets files that no longer exist
+        :param paths: files and directories, which are searched recursively
+        :param jobs: parse the changed files in this many processes
+        :param force: index every file, changed or not
+        :return: the number of files (indexed, unchanged, removed)
+        """
+        known = {row["path"]: row for row in self.db.execute("SELECT id, path, mtime, size, hash FROM pieces")}
+        changed = []
+        unchanged = 0
+        for filename in indexedFiles(paths):
+            stat = os.stat(filename)
+            row = known.get(filename)
+            if not force and row is not None and row["hash"] is not None:
+                if row["mtime"] == stat.st_mtime and row["size"] == stat.st_size:
+                    unchanged += 1
+                    continue
+                with open(filename, "rb") as f:
+                    sourceHash = hashBytes(f.read())
+                if sourceHash == row["hash"]:
+                    # Touched but not edited
+                    self.db.execute("UPDATE pieces SET mtime = ? WHERE id = ?", (stat.st_mtime, row["id"]))
+                    unchanged += 1
+                    continue
+            changed.append((filename, stat))
+        filenames = [filename for filename, stat in changed]
+        if jobs > 1 and len(filenames) > 1:
+            with ProcessPoolExecutor(min(jobs, len(filenames))) as pool:
+                summaries = list(pool.map(summarize, filenames, chunksize=16))
+        else:
+            summaries = map(summarize, filenames)
+        for (filename, stat), summary in zip(changed, summaries):
+            with open(filename, "rb") as f:
+                sourceHash = hashBytes(f.read())
+            self.record(filename, stat, sourceHash, summary)
+        removed = [row for path, row in known.items() if not os.path.exists(path)]
+        for row in removed:
+            self.forget(row["id"])
+        self.db.commit()
+        return len(changed), unchanged, len(removed)
+
+    def forget(self, piece):
+        for table in pieceTables:
+            self.db.execute("DELETE FROM %s WHERE piece = ?" % table, (piece,))
+        self.db.execute("DELETE FROM pieces WHERE id = ?", (piece,))
+
+    def record(self, filename, stat, sourceHash, summary):
+        row = self.db.execute("SELECT id FROM pieces WHERE path = ?", (filename,)).fetchone()
+        if row is not None:
+            self.forget(row["id"])
+        title, composer = summary["titles"][0] if summary["titles"] else ("", "")
+        piece = self.db.execute(
+            "INSERT INTO pieces (path, mtime, size, hash, title, composer, courses, pages, bars, chords, pitches) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (filename, stat.st_mtime, stat.st_size, sourceHash, title, composer, summary["courses"], summary["pages"],
+             summary["bars"], sum(summary["chords"].values()), summary["pitches"])).lastrowid
+        self.db.executemany("INSERT INTO titles VALUES (?, ?, ?)", [(piece, t, c) for t, c in summary["titles"]])
+        self.db.executemany("INSERT INTO timeSignatures VALUES (?, ?, ?)",
+                            [(piece, top, bottom) for top, bottom in summary["timeSignatures"]])
+        for table in ("alfabeto", "rasgueado", "chords"):
+            self.db.executemany("INSERT INTO %s VALUES (?, ?, ?)" % table,
+                                [(piece, k, n) for k, n in summary[table].items()])
+
+    def find(self, title=None, composer=None, time=None, alfabeto=None, rasgueado=None, courses=None, keys=None,
+             minBars=None, maxBars=None):
+        """
+        Finds the pieces that match every condition given
+        :param title: part of any title on any page, in any case e.g. "chacona"
+        :param composer: part of any composer
+        :param time: a time signature as written after T- e.g. "3", which matches 3, 3-4 and 3-2, or "6-8"
+        :param alfabeto: an alfabeto chord used in the piece e.g. "B"
+        :param rasgueado: a rasgueado pattern used in the piece e.g. "DU"
+        :param courses: the courses as written in a COURSES line
+        :param keys: the MIDI numbers of a chord played in the piece e.g. [52, 59, 64]
+        :return: the matching pieces as rows of the pieces table without their pitches, by path
+        """
+        conditions, args = [], []
+        if title is not None:
+            conditions.append("id IN (SELECT piece FROM titles WHERE title LIKE ?)")
+            args.append("%" + title + "%")
+        if composer is not None:
+            conditions.append("id IN (SELECT piece FROM titles WHERE composer LIKE ?)")
+            args.append("%" + composer + "%")
+        if time is not None:
+            top, dash, bottom = time.partition("-")
+            if bottom:
+                conditions.append("id IN (SELECT piece FROM timeSignatures WHERE top = ? AND bottom = ?)")
+                args.extend((top, bottom))
+            else:
+                conditions.append("id IN (SELECT piece FROM timeSignatures WHERE top = ?)")
+                args.append(top)
+        if alfabeto is not None:
+            conditions.append("id IN (SELECT piece FROM alfabeto WHERE chord = ?)")
+            args.append(alfabeto)
+        if rasgueado is not None:
+            conditions.append("id IN (SELECT piece FROM rasgueado WHERE pattern = ?)")
+            args.append(rasgueado)
+        if courses is not None:
+            conditions.append("courses = ?")
+            args.append(courses)
+        if keys is not None:
+            conditions.append("id IN (SELECT piece FROM chords WHERE keys = ?)")
+            args.append(keysText(keys))
+        if minBars is not None:
+            conditions.append("bars >= ?")
+            args.append(minBars)
+        if maxBars is not None:
+            conditions.append("bars <= ?")
+            args.append(maxBars)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.db.execute("SELECT %s FROM pieces%s ORDER BY path" % (listedColumns, where), args).fetchall()
+
+    def piece(self, path):
+        """
+        :return: everything recorded about a file as a dict, or None if it isn't in the index
+        """
+        row = self.db.execute("SELECT * FROM pieces WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        piece = dict(row)
+        piece["titles"] = [tuple(r) for r in self.db.execute("SELECT title, composer FROM titles WHERE piece = ?", (row["id"],))]
+        piece["timeSignatures"] = ["-".join(t for t in r if t) for r in
+                                   self.db.execute("SELECT top, bottom FROM timeSignatures WHERE piece = ?", (row["id"],))]
+        for table, column in (("alfabeto", "chord"), ("rasgueado", "pattern")):
+            piece[table] = dict(tuple(r) for r in
+                                self.db.execute("SELECT %s, count FROM %s WHERE piece = ?" % (column, table), (row["id"],)))
+        return piece
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM pieces").fetchone()[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Index a library of .sanz files and search it.')
+    parser.add_argument('--db', default=defaultIndexFile, help='The index database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    indexParser = commands.add_parser('index', help='Index the .sanz files that are new or have changed')
+    indexParser.add_argument('paths', nargs='+', help='Files and directories, searched recursively')
+    indexParser.add_argument('--jobs', type=int, default=1, help='Parse files in this many processes')
+    indexParser.add_argument('--force', action='store_true', help='Index every file, changed or not')
+    queryParser = commands.add_parser('query', help='List the pieces that match every condition')
+    queryParser.add_argument('--title', help='Part of a title')
+    queryParser.add_argument('--composer', help='Part of a composer')
+    queryParser.add_argument('--time', help='A time signature e.g. 3 or 6-8')
+    queryParser.add_argument('--alfabeto', help='An alfabeto chord e.g. B')
+    queryParser.add_argument('--rasgueado', help='A rasgueado pattern e.g. DU')
+    queryParser.add_argument('--courses', help='The courses e.g. "E4 B3-B3 G3-G3 D4-D4 A4-A4"')
+    queryParser.add_argument('--keys', help='The MIDI numbers of a chord e.g. "52 59 64"')
+    queryParser.add_argument('--min-bars', type=int, help='At least this many bars')
+    queryParser.add_argument('--max-bars', type=int, help='At most this many bars')
+    showParser = commands.add_parser('show', help='Show everything recorded about files')
+    showParser.add_argument('paths', nargs='+', help='The .sanz files')
+    args = parser.parse_args()
+
+    index = CorpusIndex(args.db)
+    start = time.perf_counter()
+    if args.command == 'index':
+        indexed, unchanged, removed = index.update(args.paths, args.jobs, args.force)
+        print("Indexed %d files, %d unchanged, %d removed in %.3fs - %d files in %s" %
+              (indexed, unchanged, removed, time.perf_counter() - start, index.count(), index.filename))
+    elif args.command == 'query':
+        pieces = index.find(args.title, args.composer, args.time, args.alfabeto, args.rasgueado, args.courses,
+                            args.keys.split() if args.keys else None, args.min_bars, args.max_bars)
+        for p in pieces:
+            print("%-50s %-30s %5d bars  %s" % (os.path.relpath(p["path"]), p["title"], p["bars"], p["composer"]))
+        print("%d pieces in %.1fms" % (len(pieces), (time.perf_counter() - start) * 1000))
+    else:
+        for path in args.paths:
+            piece = index.piece(path)
+            if piece is None:
+                print(path, "is not in the index")
+                continue
+            for name in ("path", "title", "composer", "titles", "courses", "timeSignatures", "alfabeto", "rasgueado",
+                         "pages", "bars", "chords"):
+                print("%-15s %s" % (name, piece[name]))
+    index.close()
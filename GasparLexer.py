@@ -0,0 +1,79 @@
+__author__ = 'jimarlow'
+import re
+
+# Token kinds
+NOTES = "NOTES"             # 1-3 2-0
+DURATION = "DURATION"       # Q. 1-3 2-0
+DIRECTIVE = "DIRECTIVE"     # P-1, B-2, BP-2-4, T-3-4, AB-A, R-UD
+KEYWORD = "KEYWORD"         # TITLE Canarios, COURSES E4 B3-B3, FRENCH
+COMMENT = "COMMENT"         # ; a comment
+BLANK = "BLANK"             # an empty line is a space
+
+# One compiled pattern tokenizes a whole line in a single match
+# Note lines are by far the most common, so they are tried first
+lineSyntax = re.compile(r"""[ \t]*(?:
+      (?P<NOTES>[0-9].*?)
+    | (?P<DURATION>W|M\.?|C\.?|Q\.?|SQ\.?)[ \t]+(?P<durationValue>.*?)
+    | (?P<DIRECTIVE>[A-Z]+-)(?P<directiveValue>.*?)
+    | (?P<KEYWORD>[A-Z]+)(?:[ \t]+(?P<keywordValue>.*?))?
+    | (?P<COMMENT>;.*?)
+    | (?P<BLANK>)
+    )[ \t\r\n]*$""", re.VERBOSE)
+
+
+class Token:
+    # kind is one of the token kinds above
+    # directive is the dispatch key e.g. "B-", "Q.", "TITLE" or the kind for NOTES, COMMENT and BLANK
+    # value is the rest of the line e.g. "2" for B-2 or "1-3 2-0" for Q. 1-3 2-0
+    # lineNumber and column are 1 based and locate the directive in the source
+    def __init__(self, kind, directive, value, lineNumber, column):
+        self.kind = kind
+        self.directive = directive
+        self.value = value
+        self.lineNumber = lineNumber
+        self.column = column
+
+    def __repr__(self):
+        return "%s(%r, %r) at %d:%d" % (self.kind, self.directive, self.value, self.lineNumber, self.column)
+
+
+# The last group matched tells us which alternative matched
+# It maps to the token kind, the group holding the directive and the group holding the value
+lastGroups = {"NOTES": (NOTES, None, "NOTES"),
+              "durationValue": (DURATION, "DURATION", "durationValue"),
+              "directiveValue": (DIRECTIVE, "DIRECTIVE", "directiveValue"),
+              "keywordValue": (KEYWORD, "KEYWORD", "keywordValue"),
+              "KEYWORD": (KEYWORD, "KEYWORD", None),
+              "COMMENT": (COMMENT, None, "COMMENT"),
+              "BLANK": (BLANK, None, "BLANK")}
+
+
+def tokenizeLine(line, lineNumber=1):
+    m = lineSyntax.match(line)
+    if m is None:
+        # Anything we don't recognise (e.g. lower case text) is ignored, just as it always was
+        return None
+    kind, directiveGroup, valueGroup = lastGroups[m.lastgroup]
+    directive = m.group(directiveGroup) if directiveGroup else kind
+    value = m.group(valueGroup) if valueGroup else ""
+    return Token(kind, directive, value, lineNumber, m.start(directiveGroup or valueGroup) + 1)
+
+
+def tokenize(lines):
+    """
+    Tokenizes the lines of a .sanz file
+    :param lines: any iterable of lines e.g. an open file
+    :return: yields a Token for each line that is recognised
+    """
+    lineNumber = 0
+    for line in lines:
+        lineNumber += 1
+        token = tokenizeLine(line, lineNumber)
+        if token is not None:
+            yield token
+
+
+if __name__ == "__main__":
+    import sys
+    for t in tokenize(open(sys.argv[1])):
+        print(t)
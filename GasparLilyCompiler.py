@@ -1,5 +1,8 @@
 __author__ = 'jimarlow'
+import io
+
 from TabToMIDI import *
+from GasparScore import *
 from GasparConfig import *
 from os.path import *
 
@@ -20,6 +23,15 @@ lpThickThickBar = ' \\undo \\omit Score.BarLine \\bar ".." '
 lpTripleBar = ' \\undo \\omit Score.BarLine \\bar "|.|" '
 lpEndBar = ' \\undo \\omit Score.BarLine \\bar "|." '
 
+# The Lilypond duration for each duration - undotted and dotted
+lpDurations = {MINIM: (lpMinim, lpDottedMinim),
+               CROTCHET: (lpCrotchet, lpDottedCrotchet),
+               QUAVER: (lpQuaver, lpDottedQuaver),
+               SEMIQUAVER: (lpSemiquaver, lpDottedSemiquaver)}
+
+lpBarlines = {"B": lpSingleBar, "SB": lpSingleBar, "TB": lpTripleBar, "DB": lpDoubleBar,
+              "LSB": lpThickThinBar, "BP": lpBarberpole, "EB": lpEndBar}
+
 lpOpenBody = """\\transpose c c' \\absolute {\\override Staff.TimeSignature #'stencil = ##f \\time 1000/4"""
 lpOpenHeader = """\\header{ """
 
@@ -28,133 +40,132 @@ def cleanText(t):
     return t.replace("\\361", 'ñ')
 
 
-def MIDINumberToLily(num):
-    num = int(num)
-    octaves = [",,,,", ",,,", ",,", ",", "", "'", "''", "'''"]
-    notes = ["c", "cis", "d", "dis", "e", "f", "fis", "g", "gis", "a", "ais", "b"]
-    octave, note = divmod(num, 12)
-    return notes[note] + octaves[octave]
-
-
 def noteToLily(note):
     return MIDINumberToLily( noteToMIDINumber(note) )
 
 
 def courseFretToLily(courses, course, fret):
-    return [ MIDINumberToLily(num) for num in courseFretToMIDINumbers(courses, course, fret)]
+    return list(getTuning(courses).lilyNotes(course, fret))
 
 
 class GasparLilyCompiler:
-    def __init__(self, filename, courses=GC.courses):
+    """
+    Writes the header, from the titles and composers of the pages, and then streams the body straight to the file
+    a chord at a time, so the Lilypond is never held in memory.
+    Without a file to stream to, e.g. before write(), the body is collected in a list and joined once.
+    """
+    # Bump this whenever the output changes so that cached artifacts are not reused
+    version = 1
+
+    def __init__(self, filename, courses=None):
         self.filename = filename
         self.outputFilename = splitext(self.filename)[0] + "Lilypond.ly"
-        self.lpCourses = courses
+        self.courses = courses if courses is not None else GlobalContext().courses
+        self.lpCourses = self.courses
+        self.tuning = getTuning(self.lpCourses)
         self.duration = "16"
-        self.header = lpOpenHeader
-        self.body = lpOpenBody
+        self.header = [lpOpenHeader]
+        self.body = [lpOpenBody]
         self.barlines = False
+        self.score = None
+        # The file the body is streamed to
+        self.out = None
 
     def appendToHeader(self, s):
-        self.header += s
+        self.header.append(s)
 
     def appendToBody(self, s):
-        self.body += s
-
-    def write(self):
-        f = open(self.outputFilename, 'w')
-        print(self.header, file=f)
-        print(self.body, file=f)
-        f.close()
+        if self.out is None:
+            self.body.append(s)
+        else:
+            self.out.write(s)
+
+    def write(self, f=None):
+        """
+        Writes the header, then compiles the body into the file. The .sanz file is parsed first if it hasn't been.
+        The body is never kept, so every write walks the whole score again, starting from the default duration
+        and courses
+        :param f: a file to write to, by default outputFilename
+        """
+        if self.score is None:
+            self.parseLines()
+        if f is None:
+            with open(self.outputFilename, 'w') as f:
+                self.write(f)
+            return
+        f.write("".join(self.header) + "\n")
+        f.write("".join(self.body))
+        self.out = f
+        try:
+            self.compileBody(self.score)
+        finally:
+            self.out = None
+        f.write("\n")
+
+    def getvalue(self):
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
 
     def getCourse(self, num):
         return self.lpCourses[num-1]
 
-    def parseNotes(self, line):
-        notes = line.split()
+    def compileChord(self, chord):
         # Process a chord
-        chordString=""
-        chordString +=" < "
-        for n in notes:
-            course, fret = n.split('-')
-            if fret.isnumeric():
-                fret = int(fret)
-                course = int(course)
-                chordString = chordString + " " + courseFretToLily(self.lpCourses, course, fret)[0]
-        if self.barlines:
-            bl = "  \omit Score.BarLine"
-        else:
-            bl = ""
-        self.appendToBody(chordString+" >" + self.duration + bl)
-
-    def parseTimeSignature(self, line):
-        ts = line.split("-")
-        if len(ts) == 2:
-            self.appendToBody('\\time ' + ts[1] + "/4")
-        elif len(ts) == 3:
-            self.appendToBody('\\time ' + ts[1] + "/" + ts[2])
-
-
-    def parseLines(self):
+        notes = "".join(" " + self.tuning.lilyNotes(n.course, int(n.fret))[0] for n in chord.notes if n.fret.isnumeric())
+        bl = "  \\omit Score.BarLine" if self.barlines else ""
+        self.appendToBody(" < " + notes + " >" + self.duration + bl)
 
-        lines = [line.rstrip('\n') for line in open(self.filename)]
-
-        for line in lines:
-            line = line.strip()  # Get rid of any indentation
-            if line.startswith("M "):
-                self.duration = lpMinim
-                self.parseNotes(line[2:])
-            elif line.startswith("M. "):
-                self.duration = lpDottedMinim
-                self.parseNotes(line[3:])
-            elif line.startswith("C "):
-                self.duration = lpCrotchet
-                self.parseNotes(line[2:])
-            elif line.startswith("C. "):
-                self.duration = lpDottedCrotchet
-                self.parseNotes(line[3:])
-            elif line.startswith("Q "):
-                self.duration = lpQuaver
-                self.parseNotes(line[2:])
-            elif line.startswith("Q. "):
-                self.duration = lpDottedQuaver
-                self.parseNotes(line[3:])
-            elif line.startswith("SQ "):
-                self.duration = lpSemiquaver
-                self.parseNotes(line[3:])
-            elif line.startswith("SQ. "):
-                self.duration = lpDottedSemiquaver
-                self.parseNotes(line[4:])
-            elif re.match('^[0-9]', line):
-                self.parseNotes(line)
-            elif line.startswith("COURSES "):
-                self.lpCourses=[c.split("-") for c in toS(line, "COURSES ").split()]
-
-            # Title and composer
-            elif line.startswith("TITLE "):     self.appendToHeader(' title = "' + cleanText(toS(line, "TITLE ")) + '" ' )
-            elif line.startswith("COMPOSER "):  self.appendToHeader(' composer = "' + toS(line, "COMPOSER ") + '" ')
+    def compileTimeSignature(self, ts):
+        if ts.bottom is None:
+            self.appendToBody('\\time ' + ts.top + "/4")
+        else:
+            self.appendToBody('\\time ' + ts.top + "/" + ts.bottom)
+
+    def compileBarline(self, barline):
+        # Need to skip any unnumbered barlines that are may be placed
+        # in justified tablature for cosmetic purposes
+        if barline.kind == "B" and not re.match('[0-9]', barline.args[0]):
+            return
+        self.appendToBody(lpBarlines[barline.kind])
+        self.barlines = True
+
+    def compile(self, score):
+        # The header is compiled now, and the body as it is written
+        self.score = score
+        for page in score.pages:
+            if page.title:
+                self.appendToHeader(' title = "' + cleanText(page.title) + '" ')
+            if page.composer:
+                self.appendToHeader(' composer = "' + page.composer + '" ')
+        self.appendToHeader("}")
 
+    def compileBody(self, score):
+        # Start afresh, so the body can be written more than once
+        self.lpCourses = self.courses
+        self.tuning = getTuning(self.lpCourses)
+        self.duration = "16"
+        self.barlines = False
+        for e in score.events():
+            if isinstance(e, ScoreChord):
+                # Chords without a duration take the previous duration
+                if e.duration is None:
+                    self.compileChord(e)
+                elif e.duration in lpDurations:
+                    self.duration = lpDurations[e.duration][e.dotted]
+                    self.compileChord(e)
+            elif isinstance(e, ScoreBarline):
+                self.compileBarline(e)
+            elif isinstance(e, ScoreSetting) and e.name == "courses":
+                self.lpCourses = e.value
+                self.tuning = getTuning(e.value)
             # Time signature
-            #elif line.startswith("T-"):         self.parseTimeSignature(line)
-
-            # Barlines
-            elif line.startswith("SB-"): self.appendToBody(lpSingleBar) ; self.barlines = True
-            elif line.startswith("TB-"): self.appendToBody(lpTripleBar) ; self.barlines = True
-            elif line.startswith("DB-"): self.appendToBody(lpDoubleBar) ; self.barlines = True
-            elif line.startswith("LSB-"): self.appendToBody(lpThickThinBar) ; self.barlines = True
-
-            # Need to skip any unnumbered barlines that are may be placed
-            # in justified tablature for cosmetic purposes
-            elif re.match('B-[0-9]', line): self.appendToBody(lpSingleBar) ; self.barlines = True
-
-            #elif line.startswith("B-"): self.appendToBody(lpSingleBar) ; self.barlines = True
-            elif line.startswith("BP-"): self.appendToBody(lpBarberpole) ; self.barlines = True
-            elif line.startswith("EB-"): self.appendToBody(lpEndBar) ; self.barlines = True
-
-            else:
-                pass
-        self.appendToHeader("}")
+            #elif isinstance(e, ScoreTimeSignature): self.compileTimeSignature(e)
         self.appendToBody("}")
 
+    def parseLines(self):
+        self.compile(parseScore(self.filename))
+
 
 if __name__ == "__main__":
 
@@ -162,8 +173,7 @@ if __name__ == "__main__":
 
     p = GasparLilyCompiler("Rujero.sanz", courses=testCourses)
     p.parseLines()
-    print(p.header)
-    print(p.body)
+    print(p.getvalue(), end="")
 
 
 
@@ -1,7 +1,10 @@
 __author__ = 'jimarlow'
 import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from GasparConfig import *
 from TabToMIDI import *
+from GasparScore import *
 from os.path import *
 
 
@@ -58,165 +61,312 @@ crotchet = 16
 dottedCrotchet = 24
 minim = 32
 dottedMinim = 48
-
-
-class HeaderChunk:
-    # Format 0 MIDI files consist of a header-chunk and a single track-chunk.
-    def __init__(self, format=0, tracks=1, ticks=20):
-        self.type = bytes(b'MThd')
-        self.length = 6
+semibreve = 64
+dottedSemibreve = 96
+
+# The MIDI delta for each duration - undotted and dotted
+deltas = {BREVE: (semibreve, dottedSemibreve),
+          MINIM: (minim, dottedMinim),
+          CROTCHET: (crotchet, dottedCrotchet),
+          QUAVER: (quaver, dottedQuaver),
+          SEMIQUAVER: (semiquaver, dottedSemiquaver)}
+
+# Ticks per crotchet, and crotchets per minute - the speed we have always played at
+TICKSPERCROTCHET = crotchet
+DEFAULTTEMPO = 150
+
+NOTEON = 0x90
+VELOCITY = 0x40
+META = 0xFF
+TEMPO = 0x51
+TRACKNAME = 0x03
+ENDOFTRACK = 0x2F
+
+# Format 1 files can have a track for each course, or for each string so that bourdons can be balanced
+# against their octave strings
+COURSETRACKS = "courses"
+STRINGTRACKS = "strings"
+# Each track has its own channel - channel 10 is for percussion
+channels = [c for c in range(16) if c != 9]
+
+
+def variableLengthQuantity(value):
+    """
+    Encodes a number as a MIDI variable length quantity: 7 bits a byte, most significant first,
+    with the top bit set on every byte but the last
+    :param value: 200
+    :return: b'\x81\x48'
+    """
+    result = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        result.insert(0, value & 0x7F | 0x80)
+        value >>= 7
+    return bytes(result)
+
+
+# Nearly every delta time fits in a byte, so those are encoded once
+shortQuantities = [bytes([value]) for value in range(0x80)]
+
+
+class MIDITrack:
+    """
+    Encodes the events of one track straight into a bytearray as they are added.
+    Each event is given the ticks since the event before it.
+    :param channel: 0 to 15 i.e. MIDI channels 1 to 16
+    """
+    def __init__(self, channel=0):
+        self.channel = channel
+        self.data = bytearray()
+        # The status of the last channel event - the events after it with the same status leave it out
+        self.runningStatus = None
+        self.events = 0
+
+    def deltaTime(self, ticks):
+        self.data += shortQuantities[ticks] if ticks < 0x80 else variableLengthQuantity(ticks)
+
+    def channelEvent(self, deltaTime, status, key, velocity):
+        self.deltaTime(deltaTime)
+        status |= self.channel
+        if status != self.runningStatus:
+            self.data.append(status)
+            self.runningStatus = status
+        self.data.append(key)
+        self.data.append(velocity)
+        self.events += 1
+
+    def noteOn(self, deltaTime, key, velocity=VELOCITY):
+        self.channelEvent(deltaTime, NOTEON, key, velocity)
+
+    def noteOff(self, deltaTime, key):
+        # A note on with no velocity is a note off, and keeps the running status of the note ons
+        self.channelEvent(deltaTime, NOTEON, key, 0)
+
+    def metaEvent(self, deltaTime, kind, body):
+        self.deltaTime(deltaTime)
+        self.data += bytes((META, kind)) + variableLengthQuantity(len(body)) + body
+        # Meta events cancel the running status
+        self.runningStatus = None
+        self.events += 1
+
+    def tempo(self, deltaTime, crotchetsPerMinute):
+        self.metaEvent(deltaTime, TEMPO, round(60000000 / crotchetsPerMinute).to_bytes(length=3, byteorder='big'))
+
+    def endOfTrack(self, deltaTime=0):
+        self.metaEvent(deltaTime, ENDOFTRACK, b"")
+
+    def chunk(self):
+        return b"MTrk" + len(self.data).to_bytes(length=4, byteorder='big') + self.data
+
+
+class MIDIFile:
+    """
+    A MIDI file built in memory and written with a single write.
+    Format 0 files have one track, format 1 files have tracks that play together.
+    """
+    def __init__(self, format=0, ticks=TICKSPERCROTCHET):
         self.format = format
-        self.tracks = tracks
         self.ticks = ticks
+        # MIDITracks, or the chunks of tracks that have already been encoded
+        self.tracks = []
 
-    def write(self, file):
-        file.write(self.type)
-        file.write(self.length.to_bytes(length=4, byteorder='big'))
-        file.write(self.format.to_bytes(length=2, byteorder='big'))
-        file.write(self.tracks.to_bytes(length=2, byteorder='big'))
-        file.write(self.ticks.to_bytes(length=2, byteorder='big'))
-
+    def addTrack(self, channel=0):
+        track = MIDITrack(channel)
+        self.tracks.append(track)
+        return track
 
-class TrackChunk:
-    def __init__(self):
-        self.type = bytes(b'MTrk')
-        self.trackEvents = []
-        self.length = 0
-
-    def addTrackEvent(self, trackEvent):
-        self.trackEvents.append(trackEvent)
-        self.length += trackEvent.getLength()
-
-    def write(self, file):
-        file.write(self.type)
-        file.write(self.length.to_bytes(length=4, byteorder='big'))
-        for te in self.trackEvents:
-            te.write(file)
-
-
-# This is the only track event we need
-class NoteOnMIDIEvent:
-    # Keep deltaTime < 127 i.e. 1 byte so that we don't need MID variable length values
-    def __init__(self, deltaTime=100, key=0x3C, velocity=0x40, channel=1):
-        self.deltaTime = deltaTime
-        self.channel = channel
-        self.key = key
-        self.velocity = velocity
+    def addChunk(self, chunk):
+        self.tracks.append(chunk)
 
-    def getLength(self):
-        return 4
-
-    def write(self, file):
-        file.write(self.deltaTime.to_bytes(length=1, byteorder='big'))
-        file.write((0x90).to_bytes(length=1, byteorder='big'))
-        file.write(self.key.to_bytes(length=1, byteorder='big'))
-        file.write(self.velocity.to_bytes(length=1, byteorder='big'))
-
-
-class SingleTrackMIDIFile:
-    def __init__(self):
-        self.headerChunk = HeaderChunk()
-        self.trackChunk = TrackChunk()
-
-    def addNoteOnEvent(self, deltaTime=100, key=0x3C, velocity=0x40, channel=1):
-        self.trackChunk.addTrackEvent(NoteOnMIDIEvent(deltaTime, key, velocity, channel))
+    def getvalue(self):
+        header = b"MThd" + (6).to_bytes(length=4, byteorder='big') + self.format.to_bytes(length=2, byteorder='big') + \
+            len(self.tracks).to_bytes(length=2, byteorder='big') + self.ticks.to_bytes(length=2, byteorder='big')
+        return header + b"".join(t if isinstance(t, bytes) else t.chunk() for t in self.tracks)
 
     def write(self, filename):
-        midiFile = open(filename, 'wb')
-        self.headerChunk.write(midiFile)
-        self.trackChunk.write(midiFile)
-        midiFile.close()
+        with open(filename, 'wb') as midiFile:
+            midiFile.write(self.getvalue())
+
+
+def encodeTrack(notes, end, channel=0, tempo=None, name=None):
+    """
+    Encodes the notes of one track. Tracks are encoded independently, so they can be encoded in any order
+    or at once in separate processes.
+    :param notes: [(start, stop, key)] in ticks, in the order they start. Notes that don't last a tick are left out.
+    :param end: the tick the track ends at
+    :param tempo: crotchets per minute, set at the start of the track
+    :param name: the name of the track, shown by sequencers
+    :return: the track chunk
+    """
+    track = MIDITrack(channel)
+    if name:
+        track.metaEvent(0, TRACKNAME, name.encode("latin-1"))
+    if tempo:
+        track.tempo(0, tempo)
+    # A note that stops as it starts would have its note off sorted before its note on, and never stop
+    notes = [n for n in notes if n[1] > n[0]]
+    # At each tick, the notes that stop come before the notes that start, each in the order they started
+    events = sorted([(stop, False, i, key) for i, (start, stop, key) in enumerate(notes)] +
+                    [(start, True, i, key) for i, (start, stop, key) in enumerate(notes)])
+    now = 0
+    for tick, on, i, key in events:
+        if on:
+            track.noteOn(tick - now, key)
+        else:
+            track.noteOff(tick - now, key)
+        now = tick
+    track.endOfTrack(end - now)
+    return track.chunk()
+
+
+def encodeTracks(tracks):
+    # Encodes [(notes, end, channel, tempo, name)] in a worker process
+    return [encodeTrack(*t) for t in tracks]
 
 
 class GasparMIDICompiler:
-    def __init__(self, filename, courses=GC.courses):
+    # Bump this whenever the output changes so that cached artifacts are not reused
+    version = 3
+
+    def __init__(self, filename, courses=None, tempo=DEFAULTTEMPO, tracks=None, cache=None, jobs=1):
+        """
+        :param tracks: None for a format 0 file with a single track, or COURSETRACKS or STRINGTRACKS for
+        a format 1 file with a track and channel for each course or each string
+        :param cache: an ArtifactCache for the encoded tracks, so that only the tracks that have changed are encoded
+        :param jobs: encode the tracks in this many processes
+        """
         self.filename = filename
         self.outputFilename = splitext(self.filename)[0] + ".midi"
-        self.courses=courses
+        self.courses = courses if courses is not None else GlobalContext().courses
+        self.tuning = getTuning(self.courses)
+        self.tempo = tempo
+        self.tracks = tracks
+        self.cache = cache
+        self.jobs = jobs
+        # The duration of the current chord
         self.delta = 0
-        self.midiFile = SingleTrackMIDIFile()
+        # The tick the current chord starts at
+        self.now = 0
+        # Every note played as [start, stop, course, string, key] - a note stops when the next notes start
+        self.notes = []
+        self.sounding = []
+        self.encodedTracks = 0
 
     def write(self):
-        self.midiFile.write(filename=self.outputFilename)
-
-    def parseNotes(self, line):
-        notes = line.split()
-        # Process a chord
-        tempDelta = self.delta # Only use a duration for the first note in the chord
-        for n in notes:
-            course, fret = n.split('-')
-            if fret.isnumeric():
-                midiKeys = courseFretToMIDINumbers(self.courses, int(course), int(fret))
-                #print("Note: ", n, " Delta ", self.duration," Course ", course, " Fret ", fret, " MIDI key", midiKeys)
-                # Add the first string in the course
-                self.midiFile.addNoteOnEvent(deltaTime=tempDelta, key=midiKeys[0])
-                tempDelta = 0
-                # Add the second string in the course
-                if len(midiKeys) == 2:
-                    #print("Bourdon ", midiKeys[1])
-                    self.midiFile.addNoteOnEvent(deltaTime=tempDelta, key=midiKeys[1])
+        self.midiFile().write(filename=self.outputFilename)
+
+    def stopNotes(self):
+        for note in self.sounding:
+            note[1] = self.now
+        self.sounding = []
+
+    def compileNotes(self, chord):
+        # Process a chord - both strings of a course sound
+        notes = []
+        for n in chord.notes:
+            if n.fret.isnumeric():
+                for string, key in enumerate(self.tuning.keys(n.course, int(n.fret))):
+                    notes.append([self.now, None, n.course, string, key])
+        if notes:
+            # The notes before ring on until these start
+            self.stopNotes()
+            self.notes.extend(notes)
+            self.sounding = notes
+
+    def compileChord(self, chord):
+        if chord.duration in deltas:
+            self.delta = deltas[chord.duration][chord.dotted]
+        elif chord.duration is not None:
+            return
+        self.compileNotes(chord)
+        self.now += self.delta
+
+    def compile(self, score):
+        for e in score.events():
+            if isinstance(e, ScoreChord):
+                self.compileChord(e)
+            elif isinstance(e, ScoreSetting) and e.name == "courses":
+                self.courses = e.value
+                self.tuning = getTuning(e.value)
+        # The last notes last as long as their chord
+        self.stopNotes()
 
     def parseLines(self):
-
-        lines = [line.rstrip('\n') for line in open(self.filename)]
-
-        for line in lines:
-            line = line.strip()  # Get rid of any indentation
-            if line.startswith("M "):
-                self.parseNotes(line[2:])
-                self.delta = minim
-            elif line.startswith("M. "):
-                self.parseNotes(line[3:])
-                self.delta = dottedMinim
-            elif line.startswith("C "):
-                self.parseNotes(line[2:])
-                self.delta = crotchet
-            elif line.startswith("C. "):
-                self.parseNotes(line[3:])
-                self.delta = dottedCrotchet
-            elif line.startswith("Q "):
-                self.parseNotes(line[2:])
-                self.delta = quaver
-            elif line.startswith("Q. "):
-                self.parseNotes(line[3:])
-                self.delta = dottedQuaver
-            elif line.startswith("SQ "):
-                self.parseNotes(line[3:])
-                self.delta = semiquaver
-            elif line.startswith("SQ. "):
-                self.parseNotes(line[4:])
-                self.delta = dottedSemiquaver
-            elif re.match('^[0-9]', line):
-                self.parseNotes(line)
-            elif line.startswith("COURSES "): self.courses=[c.split("-") for c in toS(line, "COURSES ").split()]
-            else:
-                pass
+        self.compile(parseScore(self.filename))
+
+    def trackNotes(self):
+        """
+        :return: [(name, [(start, stop, key)])] for each track, in course and string order
+        """
+        if self.tracks is None:
+            return [(None, [(start, stop, key) for start, stop, course, string, key in self.notes])]
+        voices = {}
+        for start, stop, course, string, key in self.notes:
+            voice = (course, string) if self.tracks == STRINGTRACKS else (course, None)
+            voices.setdefault(voice, []).append((start, stop, key))
+        tracks = []
+        for course, string in sorted(voices, key=lambda v: (v[0], v[1] or 0)):
+            name = "Course %d" % course if string is None else "Course %d string %d" % (course, string + 1)
+            tracks.append((name, voices[(course, string)]))
+        return tracks
+
+    def midiFile(self):
+        """
+        Encodes the tracks, taking those that haven't changed from the cache
+        :return: a MIDIFile
+        """
+        if self.tracks is None:
+            tracks = [(notes, self.now, 0, self.tempo, None) for name, notes in self.trackNotes()]
+            midiFile = MIDIFile()
+        else:
+            # The first track of a format 1 file sets the tempo for all of them
+            tracks = [([], self.now, 0, self.tempo, None)]
+            tracks += [(notes, self.now, channels[i % len(channels)], None, name)
+                       for i, (name, notes) in enumerate(self.trackNotes())]
+            midiFile = MIDIFile(format=1)
+        keys = [self.cache.fragmentKey("midi track", self.version, repr(t)) for t in tracks] if self.cache else None
+        chunks = [self.cache.getFragment(k, binary=True) for k in keys] if self.cache else [None] * len(tracks)
+        missing = [i for i, c in enumerate(chunks) if c is None]
+        for i, chunk in zip(missing, self.encode([tracks[i] for i in missing])):
+            chunks[i] = chunk
+            if self.cache:
+                self.cache.putFragment(keys[i], chunk)
+        self.encodedTracks = len(missing)
+        for chunk in chunks:
+            midiFile.addChunk(chunk)
+        return midiFile
+
+    def encode(self, tracks):
+        # Encodes tracks, in a pool of processes if we have jobs, a share of the tracks to each
+        if self.jobs <= 1 or len(tracks) <= 1:
+            return encodeTracks(tracks)
+        jobs = min(self.jobs, len(tracks))
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        bounds = [len(tracks) * i // jobs for i in range(jobs + 1)]
+        with ProcessPoolExecutor(jobs, context) as pool:
+            return [chunk for chunks in pool.map(encodeTracks, [tracks[a:b] for a, b in zip(bounds, bounds[1:])])
+                    for chunk in chunks]
 
 
 if __name__ == "__main__":
 
-    mf = SingleTrackMIDIFile()
-    mf.addNoteOnEvent(key=0x3C, deltaTime=0)
-    mf.addNoteOnEvent(key=0x3D, deltaTime=30)
-    mf.addNoteOnEvent(key=0x3E, deltaTime=10)
-    mf.addNoteOnEvent(key=0x3F, deltaTime=20)
-    mf.addNoteOnEvent(key=0x4C, deltaTime=quaver)
-    mf.addNoteOnEvent(key=0x4D, deltaTime=crotchet)
-    mf.addNoteOnEvent(key=0x4E, deltaTime=crotchet)
-    mf.addNoteOnEvent(key=0x4F, deltaTime=crotchet)
+    mf = MIDIFile()
+    track = mf.addTrack()
+    track.tempo(0, DEFAULTTEMPO)
+    for key, deltaTime in ((0x3C, 0), (0x3D, 30), (0x3E, 10), (0x3F, 20), (0x4C, quaver), (0x4D, crotchet), (0x4E, 200)):
+        track.noteOn(deltaTime, key)
+        track.noteOff(crotchet, key)
+    track.endOfTrack()
     mf.write('test04.midi')
 
     bourdons = [['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D3', 'D3'], ['A2', 'A2']]
 
-    p = GasparMIDICompler(filename="Espanoletas.sanz", courses=bourdons)
+    p = GasparMIDICompiler(filename="Espanoletas.sanz", courses=bourdons)
     p.parseLines()
-    p.write("Espanoletas.midi")
-
-    #p = MIDIParser("Rujero.sanz")
-    #p.parseLines()
-    #p.write("Rujero.midi")
-
-    #p = MIDIParser("Paradetas.sanz")
-    #p.parseLines()
-    #p.write("Paradetas.midi")
+    p.write()
 
+    # A track for each string, so the bourdons can be muted or balanced against their octave strings
+    p = GasparMIDICompiler(filename="Espanoletas.sanz", courses=bourdons, tracks=STRINGTRACKS)
+    p.parseLines()
+    p.write()
@@ -0,0 +1,219 @@
+__author__ = 'jimarlow'
+# Writes PDF directly, without going through Postscript and a Postscript interpreter
+#
+# A PDFWriter draws the same glyphs as a PSWriter - Page.render draws into either.
+# Each page's content stream is compressed with zlib (Flate) and written as soon as the page is complete,
+# every page shares one font resource dictionary, and the cross-reference table is built from the offsets
+# of the objects as they are written, so the file is written in a single pass.
+import zlib
+
+from GasparPostscript import *
+
+# How a PDFWriter writes each operation, see verboseOps
+# Colours are set for both lines (RG) and filled circles (rg)
+pdfOps = {"width": "{0} w",
+          "color": "{0} {1} {2} RG {0} {1} {2} rg",
+          "font": "/{1} {0} Tf",
+          "text": "BT {1} {2} Td ({0}) Tj ET",
+          "firstSegment": "{0} {1} m {2} {3} l",
+          "segment": "{0} {1} m {2} {3} l",
+          "curve": "{0} {1} m {2} {3} {4} {5} {6} {7} c S",
+          "stroke": "S"}
+
+# PDF has no arc operator, so circles are drawn as Bezier curves, one for each quarter
+KAPPA = 0.5522847498
+
+# Fonts that every PDF viewer has, and the faces we use that they stand in for
+standardFonts = {"ArialMT": "Helvetica", "Arial": "Helvetica"}
+
+# The widths of the printable ASCII characters (32 to 126) in thousandths of the font size, from the Adobe font metrics
+# We need them to center and right justify text, which Postscript measures with stringwidth
+fontWidths = {
+    "Helvetica": [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+                  556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+                  1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+                  667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+                  333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+                  556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584],
+    "Times-Roman": [250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+                    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+                    921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+                    556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+                    333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+                    500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541]}
+# Other faces, and characters outside printable ASCII, are measured approximately
+DEFAULTCHARWIDTH = 556
+
+
+def baseFont(face):
+    # The PDF name of a face e.g. Times-Roman-ISOLatin1 -> Times-Roman, ArialMT -> Helvetica
+    face = face.replace("-ISOLatin1", "")
+    return standardFonts.get(face, face)
+
+
+def toWinAnsi(text):
+    """
+    Encodes text for a PDF string in WinAnsiEncoding
+    Postscript octal escapes such as \\247 (the section symbol) are kept
+    :return: bytes
+    """
+    result = bytearray()
+    i = 0
+    while i < len(text):
+        if text[i] == "\\" and text[i + 1:i + 4].isdigit():
+            result.append(int(text[i + 1:i + 4], 8) & 0xFF)
+            i += 4
+            continue
+        result += text[i].encode("cp1252", "replace")
+        i += 1
+    return bytes(result)
+
+
+def pdfString(encoded):
+    # The body of a PDF literal string, with any parentheses, backslashes and non-ASCII bytes escaped
+    return "".join("\\" + chr(b) if b in b"()\\" else chr(b) if 32 <= b < 127 else "\\%03o" % b for b in encoded)
+
+
+def textWidth(encoded, face, size):
+    widths = fontWidths.get(baseFont(face), fontWidths["Helvetica"])
+    return sum(widths[b - 32] if 32 <= b < 127 else DEFAULTCHARWIDTH for b in encoded) * size / 1000
+
+
+def pdfArc(x, y, radius, quarters, clockwise=False):
+    """
+    The path of an arc that starts at angle 0 and turns through a number of quarter circles
+    :return: a moveto and a curveto for each quarter
+    """
+    turn = -1 if clockwise else 1
+    # Unit vectors for 0, 90, 180 and 270 degrees
+    directions = ((1, 0), (0, turn), (-1, 0), (0, -turn))
+    cos, sin = directions[0]
+    path = [psc(x + radius * cos, y + radius * sin, "m")]
+    for q in range(quarters):
+        cos1, sin1 = directions[(q + 1) % 4]
+        path.append(psc(x + radius * (cos - KAPPA * sin * turn), y + radius * (sin + KAPPA * cos * turn),
+                        x + radius * (cos1 + KAPPA * sin1 * turn), y + radius * (sin1 - KAPPA * cos1 * turn),
+                        x + radius * cos1, y + radius * sin1, "c"))
+        cos, sin = cos1, sin1
+    return " ".join(path)
+
+
+class PDFWriter(PSWriter):
+    """
+    Writes the pages drawn into it to a binary file as a PDF document.
+    Each showpage finishes a page and close() finishes the document.
+    The graphics state is always tracked, as for a PSWriter. Every glyph is drawn in full, without procedures.
+    """
+    def __init__(self, file, context=None):
+        PSWriter.__init__(self, None, context)
+        self.context = context if context is not None else GlobalContext()
+        self.document = file
+        self.trackState = True
+        self.compact = False
+        self.useProcedures = False
+        self.useOps(pdfOps, psNum)
+        # The byte offset of each object, by object number
+        self.offsets = {}
+        self.position = 0
+        # Objects 1 to 3 are written last, once we know the pages and fonts
+        self.catalog, self.pageTree, self.fontResources = 1, 2, 3
+        self.nextObject = 4
+        self.pages = []
+        # Base font -> resource name e.g. Times-Roman -> F1
+        self.fonts = {}
+        self.put(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.lineWidth = 1
+        self.color = BLACK
+
+    def put(self, data):
+        self.document.write(data)
+        self.position += len(data)
+
+    def newObjectNumber(self):
+        self.nextObject += 1
+        return self.nextObject - 1
+
+    def putObject(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        self.put(b"%d 0 obj\n" % number + body.encode("latin-1"))
+        if stream is not None:
+            self.put(b"\nstream\n" + stream + b"\nendstream")
+        self.put(b"\nendobj\n")
+
+    def setFont(self, face, size):
+        name = baseFont(face)
+        if name not in self.fonts:
+            self.fonts[name] = "F%d" % (len(self.fonts) + 1)
+        PSWriter.setFont(self, self.fonts[name], size)
+
+    def setColor(self, r=0, g=0, b=0):
+        # The glyphs give colours as Postscript takes them, which clips each component to 0..1, and PDF doesn't
+        PSWriter.setColor(self, *(min(max(c, 0), 1) for c in (r, g, b)))
+
+    def text(self, text="Hello world", x=100, y=100, size=12.5, face="Times-Roman-ISOLatin1"):
+        PSWriter.text(self, pdfString(toWinAnsi(str(text))), x, y, size, face)
+
+    def placedText(self, encoded, x, y, size, face):
+        PSWriter.text(self, pdfString(encoded), x, y, size, face)
+
+    def centeredText(self, text="Hello world", pageWidth=595, y=742, size=28, face="Times-Roman"):
+        encoded = toWinAnsi(str(text))
+        self.placedText(encoded, pageWidth / 2 - textWidth(encoded, face, size) / 2, y, size, face)
+
+    def rightJustifiedText(self, text="Hello world", pageWidth=595, y=720, size=14, face="Times-Roman"):
+        encoded = toWinAnsi(str(text))
+        self.placedText(encoded, pageWidth - textWidth(encoded, face, size), y, size, face)
+
+    def arc(self, x, y, radius, lineWidth, quarters, clockwise=False, paint="S"):
+        self.prepare(lineWidth)
+        self.endPath()
+        self.out(pdfArc(x, y, radius, quarters, clockwise) + " " + paint)
+
+    def circle(self, x, y, radius, lineWidth=LINEWIDTH): self.arc(x, y, radius, lineWidth, 4)
+
+    def filledCircle(self, x, y, radius, lineWidth=LINEWIDTH): self.arc(x, y, radius, None, 4, paint="f")
+
+    def overSemicircle(self, x, y, radius, lineWidth=1): self.arc(x, y, radius, lineWidth, 2)
+
+    def underSemicircle(self, x, y, radius, lineWidth=1): self.arc(x, y, radius, lineWidth, 2, clockwise=True)
+
+    def curve(self, x1, y1, x2, y2, x3, y3, lineWidth=LINEWIDTH):
+        self.prepare(lineWidth)
+        self.endPath()
+        self.op("curve", x1, y1, x1, y1, x2, y2, x3, y3)
+
+    def showpage(self):
+        """
+        Compresses the content drawn since the last page and writes it out as a page
+        Every page starts with the default graphics state: black lines one point wide and no font
+        """
+        content = zlib.compress(self.pop().encode("latin-1"))
+        contentObject = self.newObjectNumber()
+        self.putObject(contentObject, "<< /Length %d /Filter /FlateDecode >>" % len(content), content)
+        pageObject = self.newObjectNumber()
+        self.putObject(pageObject, "<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources << /Font %d 0 R >> /Contents %d 0 R >>" %
+                       (self.pageTree, psNum(self.context.pageWidth), psNum(self.context.pageHeight), self.fontResources, contentObject))
+        self.pages.append(pageObject)
+        self.invalidate()
+        self.color = BLACK
+        self.lineWidth = 1
+
+    def close(self):
+        # Finishes the last page if it didn't end with a showpage,
+        # then writes the fonts, the page tree, the catalog and the cross-reference table
+        if self.chunks or not self.pages:
+            self.showpage()
+        fontObjects = []
+        for name, resource in self.fonts.items():
+            number = self.newObjectNumber()
+            self.putObject(number, "<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name)
+            fontObjects.append("/%s %d 0 R" % (resource, number))
+        self.putObject(self.fontResources, "<< %s >>" % " ".join(fontObjects))
+        self.putObject(self.pageTree, "<< /Type /Pages /Kids [%s] /Count %d >>" %
+                       (" ".join("%d 0 R" % p for p in self.pages), len(self.pages)))
+        self.putObject(self.catalog, "<< /Type /Catalog /Pages %d 0 R >>" % self.pageTree)
+        xref = self.position
+        lines = ["xref", "0 %d" % self.nextObject, "0000000000 65535 f "]
+        lines += ["%010d 00000 n " % self.offsets[n] for n in range(1, self.nextObject)]
+        self.put(("\n".join(lines) + "\ntrailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" %
+                  (self.nextObject, self.catalog, xref)).encode("latin-1"))
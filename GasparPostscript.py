@@ -44,6 +44,21 @@ def ps(*args): return " ".join([str(x) for x in args])
 def psStr(s): return '(' + str(s) + ')'
 
 
+# Print a number with a fixed precision, without any trailing zeros
+PRECISION = 2
+
+
+def psNum(n):
+    if isinstance(n, int):
+        return str(n)
+    s = ("%.*f" % (PRECISION, n)).rstrip("0").rstrip(".")
+    return "0" if s == "-0" else s
+
+
+# Convert the args into a space delimited string, printing numbers with a fixed precision
+def psc(*args): return " ".join([psNum(x) if isinstance(x, (int, float)) else str(x) for x in args])
+
+
 # Escape the argument with a forward slash
 def psEsc(s): return '/' + str(s)
 
@@ -52,6 +67,23 @@ def psEsc(s): return '/' + str(s)
 def psMapFont(name="Times-Roman"): return psMapTimesRoman.replace("Times-Roman", name)
 
 
+# No line of a DSC conforming document may be longer than this
+DSCLINELENGTH = 255
+
+# The procedures defined in the prolog of compact Postscript
+# The graphics state (line width, colour and font) is set separately by W, K and F, see PSWriter
+psCompactProlog = '''/W /setlinewidth load def
+/K /setrgbcolor load def
+/F { findfont exch scalefont setfont } bind def
+/S { moveto show } bind def
+/P { moveto lineto } bind def
+/C { newpath 0 360 arc stroke } bind def
+/FC { newpath 0 360 arc fill } bind def
+/OS { newpath 0 180 arc stroke } bind def
+/US { newpath 0 180 arcn stroke } bind def
+/CV { newpath 5 index 5 index moveto curveto stroke } bind def'''
+
+
 # Postscript graphics primitives
 def psRGBColor(r=0, g=0, b=0): return ps(r, g, b, setrgbcolor)
 
@@ -141,11 +173,11 @@ def psDrawTails(x, y, height, numberOfTails, lineWidth=LINEWIDTH):
     return " ".join([psTail(x, y, height, tailNum, lineWidth) for tailNum in range(1, numberOfTails)])
 
 
-def psTickBody(x, y, radius=GC.tickBodyRadius, lineWidth=LINEWIDTH):
+def psTickBody(x, y, radius=TICKBODYRADIUS, lineWidth=LINEWIDTH):
     return psCircle(x - radius, y, radius, lineWidth)
 
 
-def psTickBodyFilled(x, y, radius=GC.tickBodyRadius, lineWidth=LINEWIDTH):
+def psTickBodyFilled(x, y, radius=TICKBODYRADIUS, lineWidth=LINEWIDTH):
     return psFilledCircle(x - radius, y, radius, lineWidth)
 
 
@@ -157,5 +189,267 @@ def psText(text="Hello world", x=100, y=100, size=12.5, face="Times-Roman-ISOLat
     return ps(psEsc(face), findfont, size, scalefont, setfont, newpath, x, y, moveto, psStr(text), show)
 
 
+# How a PSWriter that tracks the graphics state writes each operation, as normal and compact Postscript
+verboseOps = {"width": "{0} setlinewidth",
+              "color": "{0} {1} {2} setrgbcolor",
+              "font": "/{1} findfont {0} scalefont setfont",
+              "text": "{1} {2} moveto ({0}) show",
+              "firstSegment": "newpath {0} {1} moveto {2} {3} lineto",
+              "segment": "{0} {1} moveto {2} {3} lineto",
+              "circle": "newpath {0} {1} {2} 0 360 arc stroke",
+              "filledCircle": "newpath {0} {1} {2} 0 360 arc fill",
+              "overSemicircle": "newpath {0} {1} {2} 0 180 arc stroke",
+              "underSemicircle": "newpath {0} {1} {2} 0 180 arcn stroke",
+              "curve": "newpath {0} {1} moveto {0} {1} {2} {3} {4} {5} curveto stroke",
+              "stroke": "stroke"}
+
+# Every compact operation ends with stroke, fill or show, so a path never needs a newpath first
+# The end of a segment is pushed first so that P doesn't need to roll the stack
+compactOps = {"width": "{0} W",
+              "color": "{0} {1} {2} K",
+              "font": "{0} /{1} F",
+              "text": "({0}) {1} {2} S",
+              "firstSegment": "{2} {3} {0} {1} P",
+              "segment": "{2} {3} {0} {1} P",
+              "circle": "{0} {1} {2} C",
+              "filledCircle": "{0} {1} {2} FC",
+              "overSemicircle": "{0} {1} {2} OS",
+              "underSemicircle": "{0} {1} {2} US",
+              "curve": "{0} {1} {2} {3} {4} {5} CV",
+              "stroke": "stroke"}
+
+BLACK = (0, 0, 0)
+
+
+class PSWriter:
+    """
+    Collects Postscript in a chunked buffer and writes it out in large writes.
+    Without a file, the Postscript is kept and returned by getvalue() e.g. for caching fragments.
+
+    The glyphs draw through a PSWriter rather than printing to a file. Unless context.trackGraphicsState is off,
+    it tracks the line width, colour and font it has set, and only sets them when they change.
+    Consecutive lines with the same width and colour are stroked together as one path.
+    Colours are set lazily, so a colour that nothing is drawn in is never set at all.
+    """
+    def __init__(self, file=None, context=None, chunkSize=1 << 16):
+        """
+        :param context: the GlobalContext of the compilation, which chooses compact output and state tracking
+        """
+        if context is None:
+            context = GlobalContext()
+        self.file = file
+        self.chunkSize = chunkSize
+        self.chunks = []
+        self.size = 0
+        # The number of bytes in the chunks before self.counted, and in everything flushed, see tell()
+        self.position = 0
+        self.counted = 0
+        self.compact = context.compactPostscript
+        self.trackState = context.trackGraphicsState or self.compact
+        # Repeated glyphs such as ticks call the procedures in the compact prolog rather than drawing themselves
+        self.useProcedures = self.compact
+        # Verbose Postscript writes numbers as str() does, which is what format() does anyway,
+        # so only compact Postscript needs its numbers converted
+        self.useOps(compactOps, psNum) if self.compact else self.useOps(verboseOps, None)
+        self.path = []
+        self.wantColor = BLACK
+        self.invalidate()
+
+    def useOps(self, ops, num):
+        """
+        :param ops: how each operation is written, see verboseOps
+        :param num: converts each number for writing, or None to write it as str() does
+        """
+        self.ops = ops
+        self.num = num
+        # The operations drawn most often are looked up once
+        self.firstSegment = ops["firstSegment"]
+        self.segment = ops["segment"]
+        self.textOp = ops["text"]
+
+    def out(self, line):
+        self.chunks.append(line + "\n")
+        self.size += len(line) + 1
+        if self.size >= self.chunkSize and self.file is not None:
+            self.flush()
+
+    def op(self, name, *args):
+        num = self.num
+        if num is not None:
+            args = [num(a) if isinstance(a, (int, float)) else a for a in args]
+        self.out(self.ops[name].format(*args))
+
+    def emit(self, line):
+        # Emit a line of Postscript that doesn't change the graphics state
+        self.endPath()
+        self.out(line)
+
+    def write(self, s):
+        # Write some Postscript as it is e.g. a cached fragment - we no longer know the graphics state
+        self.invalidate()
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.chunkSize and self.file is not None:
+            self.flush()
+
+    def invalidate(self):
+        # Forget the graphics state, so that it is set again before it is next used
+        self.endPath()
+        self.lineWidth = None
+        self.color = None
+        self.font = None
+
+    def endPath(self):
+        if self.path:
+            path, self.path = self.path, []
+            path.append(self.ops["stroke"])
+            self.out("\n".join(path))
+
+    def prepare(self, lineWidth=None):
+        # Bring the graphics state up to date before drawing
+        if self.wantColor != self.color:
+            self.endPath()
+            self.op("color", *self.wantColor)
+            self.color = self.wantColor
+        if lineWidth is not None and lineWidth != self.lineWidth:
+            self.endPath()
+            self.op("width", lineWidth)
+            self.lineWidth = lineWidth
+
+    def setFont(self, face, size):
+        if (face, size) != self.font:
+            self.op("font", size, face)
+            self.font = (face, size)
+
+    def flush(self):
+        self.endPath()
+        if self.file is not None:
+            self.tell()
+            self.file.write("".join(self.chunks))
+            self.chunks = []
+            self.counted = 0
+            self.size = 0
+
+    def tell(self):
+        """
+        :return: the number of bytes of Postscript written so far, once encoded as UTF-8, which every .ps file is opened with
+        """
+        self.endPath()
+        self.position += len("".join(self.chunks[self.counted:]).encode("utf-8"))
+        self.counted = len(self.chunks)
+        return self.position
+
+    def getvalue(self):
+        self.endPath()
+        return "".join(self.chunks)
+
+    def pop(self):
+        # Returns the Postscript collected so far and empties the buffer
+        value = self.getvalue()
+        self.chunks = []
+        self.counted = 0
+        self.size = 0
+        return value
+
+    # Drawing
+    def setColor(self, r=0, g=0, b=0):
+        if not self.trackState: return self.out(psRGBColor(r, g, b))
+        self.wantColor = (r, g, b)
+
+    def line(self, x1, y1, x2, y2, lineWidth=LINEWIDTH):
+        if not self.trackState: return self.out(psLine(x1, y1, x2, y2, lineWidth))
+        if lineWidth != self.lineWidth or self.wantColor != self.color:
+            self.prepare(lineWidth)
+        num = self.num
+        if num is not None:
+            x1, y1, x2, y2 = num(x1), num(y1), num(x2), num(y2)
+        self.path.append((self.segment if self.path else self.firstSegment).format(x1, y1, x2, y2))
+
+    def horizontalLine(self, x, y, length, lineWidth=LINEWIDTH): self.line(x, y, x + length, y, lineWidth)
+
+    def verticalLine(self, x, y, height, lineWidth=LINEWIDTH): self.line(x, y, x, y + height, lineWidth)
+
+    def tails(self, x, y, height, numberOfTails, lineWidth=LINEWIDTH):
+        if not self.trackState: return self.out(psDrawTails(x, y, height, numberOfTails, lineWidth))
+        for tailNum in range(1, numberOfTails):
+            self.line(x, y + height - (tailNum - 1) * TAILVERTICALSPACING,
+                      x + TAILENDOFFSET, y + height - TAILENDOFFSET - (tailNum - 1) * TAILVERTICALSPACING, lineWidth)
+
+    def circle(self, x, y, radius, lineWidth=LINEWIDTH):
+        if not self.trackState: return self.out(psCircle(x, y, radius, lineWidth))
+        self.prepare(lineWidth)
+        self.endPath()
+        self.op("circle", x, y, radius)
+
+    def filledCircle(self, x, y, radius, lineWidth=LINEWIDTH):
+        if not self.trackState: return self.out(psFilledCircle(x, y, radius, lineWidth))
+        self.prepare()
+        self.endPath()
+        self.op("filledCircle", x, y, radius)
+
+    def overSemicircle(self, x, y, radius, lineWidth=1):
+        if not self.trackState: return self.out(psOverSemicircle(x, y, radius, lineWidth))
+        self.prepare(lineWidth)
+        self.endPath()
+        self.op("overSemicircle", x, y, radius)
+
+    def underSemicircle(self, x, y, radius, lineWidth=1):
+        if not self.trackState: return self.out(psUnderSemicircle(x, y, radius, lineWidth))
+        self.prepare(lineWidth)
+        self.endPath()
+        self.op("underSemicircle", x, y, radius)
+
+    def curve(self, x1, y1, x2, y2, x3, y3, lineWidth=LINEWIDTH):
+        if not self.trackState: return self.out(psCurveTo(x1, y1, x2, y2, x3, y3, lineWidth))
+        self.prepare(lineWidth)
+        self.endPath()
+        self.op("curve", x1, y1, x2, y2, x3, y3)
+
+    def text(self, text="Hello world", x=100, y=100, size=12.5, face="Times-Roman-ISOLatin1"):
+        if not self.trackState: return self.out(psText(text, x, y, size, face))
+        if self.wantColor != self.color:
+            self.prepare()
+        if self.path:
+            self.endPath()
+        if (face, size) != self.font:
+            self.setFont(face, size)
+        if self.num is not None:
+            x, y = self.num(x), self.num(y)
+        self.out(self.textOp.format(text, x, y))
+
+    def centeredText(self, text="Hello world", pageWidth=595, y=742, size=28, face="Times-Roman"):
+        if not self.trackState: return self.out(psCenteredText(text, pageWidth, y, size, face))
+        self.prepare()
+        self.endPath()
+        self.setFont(toMappedFontName(face), size)
+        self.out(ps(pageWidth, "2", div, y, moveto, psStr(text), dup, stringwidth, pop, "2", div, neg, "0", rmoveto, show))
+
+    def rightJustifiedText(self, text="Hello world", pageWidth=595, y=720, size=14, face="Times-Roman"):
+        if not self.trackState: return self.out(psRightJustifiedText(text, pageWidth, y, size, face))
+        self.prepare()
+        self.endPath()
+        self.setFont(toMappedFontName(face), size)
+        self.out(ps(pageWidth, psStr(text), stringwidth, pop, sub, y, moveto, psStr(text), show))
+
+    def procedure(self, name, x, y):
+        # Call a glyph procedure defined in the prolog, which draws in the current colour
+        if not self.trackState: return self.out(psc(x, y, name))
+        self.prepare()
+        self.endPath()
+        self.out(psc(x, y, name))
+
+    def showpage(self):
+        self.endPath()
+        self.out("showpage ")
+        self.newPageState()
+
+    def newPageState(self):
+        # showpage resets the graphics state to black lines one point wide, the same as a fresh interpreter
+        self.invalidate()
+        if self.trackState:
+            self.color = BLACK
+            self.lineWidth = 1
+
+
 if __name__ == "__main__":
     print(psDrawTails(100, 100, 10, 3))
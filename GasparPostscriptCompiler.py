@@ -2,30 +2,108 @@ __author__ = 'jimarlow'
 import re
 
 from GasparTablature import *
+from GasparScore import *
 from GasparMIDICompiler import *
 from GasparLilyCompiler import *
+from GasparCache import ArtifactCache, defaultCache, hashBytes, contextHash
+from GasparPDF import PDFWriter
+from GasparSVG import SVGWriter
+from GasparAudio import GasparAudioCompiler
 from os.path import *
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 DEBUG=False
 
-
-# Note - fonts and sizes and other globals are collected from the top of the .sanz file in GC
+# The pages rendered by each worker process in a pool and the compiler they belong to,
+# see GasparPostscriptCompiler.renderInParallel
+workerPages = []
+workerCompiler = None
+
+
+def startWorker(pages, compiler):
+    # Each worker gets the pages and the compiler, with its final settings and its cache, once, when it starts
+    global workerPages, workerCompiler
+    workerPages = pages
+    workerCompiler = compiler
+
+
+def renderPages(start, end):
+    """
+    Renders pages start to end in a worker process. With a cache, the worker reuses and stores the Postscript
+    of unchanged staves just as renderPageIncrementally does when rendering one by one.
+    :return: the Postscript for each page, and the number of pages and staves rendered rather than reused
+    """
+    compiler = workerCompiler
+    renderedPages, renderedStaves = compiler.renderedPages, compiler.renderedStaves
+    f = PSWriter(context=compiler.context)
+    if start > 0:
+        # Rendering one by one, we would be just after the showpage of the page before
+        f.newPageState()
+    pages = []
+    for page in workerPages[start:end]:
+        compiler.renderPage(page, f)
+        pages.append(f.pop())
+    return pages, compiler.renderedPages - renderedPages, compiler.renderedStaves - renderedStaves
+
+
+def parsePageRange(pages):
+    """
+    :param pages: e.g. "1-3,5" - the pages are counted from 1 in the order they appear in the file
+    :return: the page numbers e.g. [1, 2, 3, 5]
+    """
+    numbers = []
+    for part in pages.split(","):
+        first, _, last = part.partition("-")
+        numbers.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(numbers))
+
+
+# The page offsets in the trailer are split into lines so that no line is longer than DSC allows
+OFFSETSPERLINE = 16
+
+
+# Note - fonts and sizes and other globals are collected from the settings in the score into self.context,
+# which belongs to this compilation alone
 class GasparPostscriptCompiler:
-    def __init__(self, filename):
-        GC.reset()
+    # Bump this whenever the output changes so that cached artifacts are not reused
+    version = 3
+
+    def __init__(self, filename, cache=None, compact=False, jobs=1, pages=None, split=False):
+        """
+        :param pages: the pages to render, counted from 1 in file order e.g. [2, 3], or None for every page
+        :param split: write each page to a file of its own, Espanoletas-1.ps, Espanoletas-2.ps etc.
+        """
+        self.context = GlobalContext()
+        if compact:
+            self.context.compactPostscript = True
         self.filename = filename
         self.outputFilename = splitext(self.filename)[0] + ".ps"
         self.currentStave = None
         self.currentPage = None
         self.pages=[]
+        self.pageCount = 0
+        # With a cache, the Postscript of unchanged pages and staves is reused rather than rendered again
+        self.cache = cache
+        self.renderedStaves = 0
+        self.renderedPages = 0
+        # The pages of a large piece, or those missing from the cache, may be rendered by a pool of jobs processes
+        self.jobs = jobs
+        self.selection = pages
+        self.split = split
+        if split:
+            # The first page - its age tells us whether the pages are up to date
+            self.outputFilename = "%s-%d.ps" % (splitext(self.filename)[0], pages[0] if pages else 1)
+        # The byte offset of each %%Page: comment in the output, for the index in the trailer
+        self.pageOffsets = []
 
     def isFirstPage(self):
-        return len(self.pages)==0
+        return self.pageCount==0
 
     def isFirstStave(self):
         # The first stave in the piece is the first stave on the first page
-        return (len(self.currentPage.staves)==0) & (len(self.pages)==1)
+        return (len(self.currentPage.staves)==0) & (self.pageCount==1)
 
     def getCurrentSlot(self):
         return self.currentStave.currentSlot
@@ -35,286 +113,527 @@ class GasparPostscriptCompiler:
         if self.currentStave != None:
             self.currentStave.currentSlot +=n
 
-    def parsePage(self, line):
-        items = line.split()
-        pageNumber = items[0].split('-')[1]
-        self.currentPage = Page(pageNumber)
+    def compilePage(self, page):
+        self.currentPage = Page(self.context, page.number)
         self.currentPage.firstPage = self.isFirstPage()
+        self.currentPage.sourceHash = page.sourceHash
         self.pages.append(self.currentPage)
-
-    def parseStave(self, line):
-        self.currentStave = Stave()
+        self.pageCount += 1
+        self.compileEvents(page.events)
+        self.currentPage.title = page.title
+        self.currentPage.composer = page.composer
+        for s in page.staves:
+            self.compileStave(s)
+
+    def compileStave(self, stave):
+        self.currentStave = Stave(self.context)
         self.currentStave.firstStave = self.isFirstStave()
         self.currentPage.append(self.currentStave)
-
-    # def parseTimeSignature(self, line):
-    #     vars = line.split()
-    #     if len(vars) == 1:
-    #         ts = vars[0].split("-")
-    #         if len(ts) == 2:
-    #             self.currentStave.append(TimeSignatureSingle(ts[1]))
-    #         elif len(ts) == 3:
-    #             self.currentStave.append(TimeSignatureDouble(ts[1], ts[2]))
-    #         self.advance(3)
-
-    def parseTimeSignature(self, line):
-        ts = line.split("-")
-        if len(ts) == 2:
-            self.currentStave.append(TimeSignatureSingle(ts[1]))
-        elif len(ts) == 3:
-            self.currentStave.append(TimeSignatureDouble(ts[1], ts[2]))
+        # A stave's glyphs depend on its source, where it is and the settings in force when it starts
+        if self.cache:
+            self.currentStave.sourceHash = hashBytes(stave.sourceHash, contextHash(self.context), self.currentStave.firstStave,
+                                                     self.currentStave.x, self.currentStave.y, self.currentStave.l)
+        self.compileEvents(stave.events)
+
+    def compileTimeSignature(self, ts):
+        if ts.bottom is None:
+            self.currentStave.append(TimeSignatureSingle(ts.top))
+        else:
+            self.currentStave.append(TimeSignatureDouble(ts.top, ts.bottom))
         self.advance(3)
 
-    def parseBarline(self,line):
-        self.currentStave.append(Barline(number=toS(line), slot=self.getCurrentSlot()))
-        self.advance()
-
-    def parseShortBarline(self,line):
-        self.currentStave.append(ShortBarline(slot=self.getCurrentSlot()))
-        self.advance()
-
-    def parseTripleBarline(self,line):
-        self.currentStave.append(TripleBarline(slot=self.getCurrentSlot()))
-        self.advance()
-
-    def parseDoubleBarline(self,line):
-        self.currentStave.append(DoubleBarline(number=toS(line), slot=self.getCurrentSlot()))
-        self.advance()
-
-    def parseLongShortBarline(self,line):
-        self.currentStave.append(LongShortBarline(slot=self.getCurrentSlot()))
-        self.advance()
-
-    def parseEndBarline(self, line):
-        self.currentStave.append(EndBarline(slot=self.getCurrentSlot()))
-
-    def parseBarberpole(self, line, isHollow=False):
+    def compileBarline(self, barline):
+        if barline.kind == "BP":
+            self.compileBarberpole(barline)
+        elif barline.kind == "EB":
+            self.currentStave.append(EndBarline(slot=self.getCurrentSlot()))
+        else:
+            if barline.kind == "B":
+                self.currentStave.append(Barline(number=barline.number, slot=self.getCurrentSlot()))
+            elif barline.kind == "DB":
+                self.currentStave.append(DoubleBarline(number=barline.number, slot=self.getCurrentSlot()))
+            elif barline.kind == "SB":
+                self.currentStave.append(ShortBarline(slot=self.getCurrentSlot()))
+            elif barline.kind == "TB":
+                self.currentStave.append(TripleBarline(slot=self.getCurrentSlot()))
+            elif barline.kind == "LSB":
+                self.currentStave.append(LongShortBarline(slot=self.getCurrentSlot()))
+            self.advance()
+
+    def compileBarberpole(self, barline, isHollow=False):
         """
         Draws a barberpole
-        :param line: BP- or e.g. BP-2-3
+        :param barline: BP- or e.g. BP-2-3
         :return:
         BP-         the default barberpole that extends across all the courses
         BP-2-4      a short barberpole from course 2 to course 4
         Barberpoles are not numbered
         """
-        tokens=line.split("-")
-        numTokens = len(tokens)
-        if numTokens == 3:
-            self.currentStave.append(Barberpole(slot=self.getCurrentSlot(), startCourse=int(tokens[1]), endCourse=int(tokens[2]),isHollow=isHollow))
+        if len(barline.args) == 2:
+            self.currentStave.append(Barberpole(slot=self.getCurrentSlot(), startCourse=int(barline.args[0]), endCourse=int(barline.args[1]),isHollow=isHollow))
         else:
             self.currentStave.append(Barberpole(slot=self.getCurrentSlot(), isHollow=isHollow))
 
-    def parseSpace(self, line):
+    def compileSpace(self, space):
         self.advance()
 
-    def parseNotes(self, line):
-        self.debugSlot('parseNotes', line)
-        # If the line does not begin with a number, then it begins with a duration that we must discard
-        if not re.match('^[0-9]', line):
-            notes = line.split()[1:]
-        else:
-            notes = line.split()
-        for n in notes:
-            course, fret = n.split('-')
-            course = int(course)
-            if fret == "{":
+    def compileChord(self, chord):
+        self.debugSlot('compileChord', chord)
+        if chord.duration is not None:
+            self.currentStave.append(Tick(self.getCurrentSlot(), duration=chord.duration, dot=chord.dotted))
+        for n in chord.notes:
+            course = n.course
+            if n.ornament == OVERSEMICIRCLE:
                 self.currentStave.append(OverSemicircle(slot=self.getCurrentSlot(),course=course))
-            elif fret == "}":
+            elif n.ornament == UNDERSEMICIRCLE:
                 self.currentStave.append(UnderSemicircle(slot=self.getCurrentSlot(),course=course))
-            elif fret == "[":
+            elif n.ornament == SLURSTART:
                 self.currentStave.setSlurStart(slot=self.getCurrentSlot(), course=course)
-            elif fret == "]":
+            elif n.ornament == SLUREND:
                 self.currentStave.append(Slur(slot1=self.currentStave.slurStartSlot, course1=self.currentStave.slurStartCourse,
                                               slot2=self.getCurrentSlot(), course2=course))
             else:
-                self.currentStave.append(Note(slot=self.getCurrentSlot(),course=course, glyph=fret))
+                self.currentStave.append(Note(slot=self.getCurrentSlot(),course=course, glyph=n.fret))
 
         # Move to the next slot
         self.advance()
 
-
-    def parseSection(self, slot):
+    def compileSection(self, section):
         self.currentStave.append(Section(self.getCurrentSlot()-1))
 
-    def parseRasgueado(self, line):
-        self.currentStave.append(Strum(slot=self.getCurrentSlot()-1, pattern=toS(line)))
+    def compileRasgueado(self, rasgueado):
+        self.currentStave.append(Strum(slot=self.getCurrentSlot()-1, pattern=rasgueado.pattern))
 
-    def parseAlfabeto(self, chord):
+    def compileAlfabeto(self, alfabeto):
         # Do not automatically advance alfabeto! It is too complex
-        self.currentStave.append(Alfabeto(slot=self.getCurrentSlot(), chord=chord))
+        self.currentStave.append(Alfabeto(slot=self.getCurrentSlot(), chord=alfabeto.chord))
+
+    def compileSetting(self, setting):
+        # Globals - these control the style of the document
+        setattr(self.context, setting.name, setting.value)
+
+    def debugSlot(self, method, event):
+        if DEBUG: print("Method: ", method, " current slot: ", self.getCurrentSlot(), " event: ", vars(event))
+
+    def compileEvents(self, events):
+        for e in events:
+            self.compilers[type(e)](e)
+
+    def compileSettings(self, settings):
+        self.compilers = {ScoreSetting: self.compileSetting,
+                          ScoreTimeSignature: self.compileTimeSignature,
+                          ScoreBarline: self.compileBarline,
+                          ScoreChord: self.compileChord,
+                          ScoreSpace: self.compileSpace,
+                          ScoreRasgueado: self.compileRasgueado,
+                          ScoreAlfabeto: self.compileAlfabeto,
+                          ScoreSection: self.compileSection}
+        self.compileEvents(settings)
+
+    def compile(self, score):
+        self.compileSettings(score.settings)
+        for p in score.pages:
+            self.compilePage(p)
 
-    def debugSlot(self, method, line):
-        if DEBUG: print("Method: ", method, " current slot: ", self.getCurrentSlot(), " line: , line")
+    def parseLines(self):
+        self.compile(parseScore(self.filename))
 
-    # Parse the duration
-    def parseDuration(self, line, duration, dotted=False):
-        self.currentStave.append(Tick(self.getCurrentSlot(), duration=duration, dot=dotted))
-        self.parseNotes(line)
+    def layout(self, **settings):
+        """
+        Lays the compiled score out again with different page settings, without parsing or compiling it again
+        e.g. layout(pageWidth=842, justified=False) then render() or write()
+        Only the staves move - the glyphs only know their slots and courses
+        :param settings: GlobalContext attributes to change e.g. pageWidth, leftMargin, staveSeparation, justified
+        """
+        for name, value in settings.items():
+            setattr(self.context, name, value)
+        for p in self.pages:
+            p.layout()
 
+    def selectedPages(self):
+        """
+        :return: [(number, page)] for the pages to render, counted from 1 in file order
+        """
+        numbered = list(enumerate(self.pages, 1))
+        if self.selection is None:
+            return numbered
+        return [(n, p) for n, p in numbered if n in self.selection]
+
+    def renderComments(self, f, pageCount=None):
+        # The header comments of a DSC conforming document. Without a page count, it is given in the trailer
+        self.pageOffsets = []
+        f.emit("%!PS-Adobe-3.0")
+        f.emit("%%Creator: Gaspar")
+        f.emit("%%Title: " + basename(self.filename))
+        f.emit("%%%%BoundingBox: 0 0 %d %d" % (self.context.pageWidth, self.context.pageHeight))
+        f.emit("%%Pages: " + ("(atend)" if pageCount is None else str(pageCount)))
+        f.emit("%%EndComments")
+
+    def beginPage(self, page, ordinal, f):
+        # The label is the page number from the file, which needn't be unique, the ordinal counts the pages in this document
+        self.pageOffsets.append(f.tell())
+        label = str(page.pageNumber).strip()
+        f.emit("%%%%Page: %s %d" % (label if label and " " not in label else ordinal, ordinal))
+
+    def renderTrailer(self, f, pageCount=None):
+        """
+        Ends the document with the page count, if it wasn't known at the start, and an index of the byte
+        offset of each %%Page: comment, so that a reader can go straight to any page
+        """
+        f.emit("%%Trailer")
+        if pageCount is not None:
+            f.emit("%%%%Pages: %d" % pageCount)
+        offsets = [str(o) for o in self.pageOffsets]
+        for i in range(0, len(offsets), OFFSETSPERLINE):
+            f.emit(("%%PageOffsets: " if i == 0 else "%%+ ") + " ".join(offsets[i:i + OFFSETSPERLINE]))
+        f.emit("%%EOF")
+
+    def renderProlog(self, f):
+        f.emit("%%BeginProlog")
+        # First, map the fonts we are using to ISOLatin1 in order
+        # to access the special characters needed for foreign languages
+        # Always map Times-Roman - it is the default font
+        faces = ["Times-Roman", self.context.composerFace, self.context.titleFace, self.context.fretFace]
+        if f.trackState:
+            # Each font only needs to be mapped once
+            faces = sorted(set(faces), key=faces.index)
+        for face in faces:
+            f.emit(psMapFont(face))
+        # Compact Postscript defines its primitives and repeated glyphs once, up front
+        if self.context.compactPostscript:
+            f.emit(psCompactProlog)
+            f.emit(compactGlyphProlog(self.context))
+        f.emit("%%EndProlog")
+
+    def renderPage(self, page, f):
+        if self.cache:
+            self.renderPageIncrementally(page, contextHash(self.context), f)
+        else:
+            page.render(f)
 
-    def parseCourses(self, line):
-        GC.courses=[c.split("-") for c in toS(line, "COURSES ").split()]
-        GC.numberOfCourses=len(GC.courses)
+    def renderInParallel(self, pages, f):
+        """
+        Renders the pages in a pool of processes and joins their Postscript in page order.
+        Each page ends with a showpage, which resets the graphics state, and the first page starts from
+        the same unknown state as a fresh PSWriter, so the output is identical to rendering the pages one by one.
+        With a cache, the pages that are already cached are copied from it and only the rest go to the pool.
+        """
+        if self.cache:
+            finalContext = contextHash(self.context)
+            fragments = [self.cache.getFragment(self.pageKey(p, finalContext)[1]) for n, p in pages]
+        else:
+            fragments = [None] * len(pages)
+        missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+        if len(missing) > 1:
+            chunks = min(self.jobs * 4, len(missing))
+            bounds = [len(missing) * i // chunks for i in range(chunks + 1)]
+            # Forked workers share the pages with us, otherwise they are sent to each worker once
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            rendered = iter(missing)
+            with ProcessPoolExecutor(self.jobs, context, startWorker, ([pages[i][1] for i in missing], self)) as pool:
+                for chunk, renderedPages, renderedStaves in pool.map(renderPages, bounds[:-1], bounds[1:]):
+                    self.renderedPages += renderedPages
+                    self.renderedStaves += renderedStaves
+                    for fragment in chunk:
+                        fragments[next(rendered)] = fragment
+        elif missing:
+            buffer = PSWriter(context=self.context)
+            self.renderPage(pages[missing[0]][1], buffer)
+            fragments[missing[0]] = buffer.getvalue()
+        for ordinal, ((n, page), fragment) in enumerate(zip(pages, fragments), 1):
+            self.beginPage(page, ordinal, f)
+            f.write(fragment)
+
+    def render(self, f, pages=None):
+        """
+        Renders a DSC conforming document: the header comments, the prolog, each page and the trailer
+        :param pages: [(number, page)] to render, by default the selected pages
+        """
+        pages = self.selectedPages() if pages is None else pages
+        self.renderComments(f, len(pages))
+        self.renderProlog(f)
 
+        if self.jobs > 1 and len(pages) > 1:
+            self.renderInParallel(pages, f)
+        else:
+            # Render the manuscript pages
+            for ordinal, (n, p) in enumerate(pages, 1):
+                self.beginPage(p, ordinal, f)
+                self.renderPage(p, f)
+        self.renderTrailer(f)
 
-    def parseFretmap(self, line):
-        fmap = line.split("FRETMAP ")[1].split()
-        if len(fmap) == 0:
-            return
-        GC.fretMapping = {}
-        for f in fmap:
-            k, v = f.split("-")
-            GC.fretMapping[k]=v
+    def stream(self):
+        """
+        Engraves the file with memory bounded by a single page.
+        The source is read lazily and each page is rendered and written out as soon as the next P- starts,
+        then dropped. The prolog and each page use the settings in force when the page is complete,
+        which is the same as write() whenever the settings are at the top of the file.
+        """
+        parser = GasparScoreParser(self.filename)
+        with open(self.outputFilename, 'w', encoding="utf-8") as out:
+            f = PSWriter(out, self.context)
+            # We don't know how many pages there are until the end
+            rendered = 0
+            for page in parser.streamLines():
+                if self.isFirstPage():
+                    self.compileSettings(parser.score.settings)
+                    self.renderComments(f)
+                    self.renderProlog(f)
+                self.compilePage(page)
+                if self.selection is None or self.pageCount in self.selection:
+                    rendered += 1
+                    self.beginPage(self.currentPage, rendered, f)
+                    self.renderPage(self.currentPage, f)
+                # Free the glyphs of the page straight away
+                for s in self.currentPage.staves:
+                    s.clear()
+                self.pages = []
+            if self.isFirstPage():
+                # A file without any pages still has its prolog
+                self.compileSettings(parser.score.settings)
+                self.renderComments(f)
+                self.renderProlog(f)
+            self.renderTrailer(f, rendered)
+            f.flush()
+
+    def pageKey(self, page, finalContext):
+        """
+        :return: the cache keys of the Postscript of each stave of the page, and of the whole page
+        """
+        staveKeys = [self.cache.fragmentKey("stave", self.version, finalContext, s.sourceHash) for s in page.staves]
+        pageKey = self.cache.fragmentKey("page", self.version, finalContext, page.sourceHash, page.firstPage,
+                                         page.title, page.composer, *staveKeys)
+        return staveKeys, pageKey
 
-    def parseLines(self):
+    def renderPageIncrementally(self, page, finalContext, f):
+        """
+        Copies the Postscript for an unchanged page straight from the cache.
+        Otherwise renders the page header and splices in the cached Postscript of each unchanged stave,
+        rendering only the staves that have been edited.
+        :param finalContext: the hash of the settings in force at render time
+        """
+        staveKeys, pageKey = self.pageKey(page, finalContext)
+        fragment = self.cache.getFragment(pageKey)
+        if fragment is None:
+            self.renderedPages += 1
+            buffer = PSWriter(context=self.context)
+            page.renderHeader(buffer)
+            for s, key in zip(page.staves, staveKeys):
+                staveFragment = self.cache.getFragment(key)
+                if staveFragment is None:
+                    self.renderedStaves += 1
+                    # A fresh writer sets the whole graphics state it uses, so the fragment can be spliced in anywhere
+                    staveBuffer = PSWriter(context=self.context)
+                    page.renderStave(s, staveBuffer)
+                    staveFragment = staveBuffer.getvalue()
+                    self.cache.putFragment(key, staveFragment)
+                buffer.write(staveFragment)
+            buffer.showpage()
+            fragment = buffer.getvalue()
+            self.cache.putFragment(pageKey, fragment)
+        f.write(fragment)
 
-        self.lines = [line.rstrip('\n') for line in open(self.filename)]
-
-        for line in self.lines:
-            line = line.strip()  # Get rid of any indentation
-
-            # The tablature syntax
-            # Page and stave
-            if   line.startswith("P-"):         self.parsePage(line)
-            elif line.startswith("S-"):         self.parseStave(line)
-            # Time signature
-            elif line.startswith("T-"):         self.parseTimeSignature(line)
-            # Barlines
-            elif line.startswith("SB-"):        self.parseShortBarline(line)
-            elif line.startswith("TB-"):        self.parseTripleBarline(line)
-            elif line.startswith("DB-"):        self.parseDoubleBarline(line)
-            elif line.startswith("LSB-"):       self.parseLongShortBarline(line)
-            elif line.startswith("B-"):         self.parseBarline(line)
-            elif line.startswith("BP-"):        self.parseBarberpole(line)
-            elif line.startswith("EB-"):        self.parseEndBarline(line)
-            # Note with duration
-            elif line.startswith("W "):         self.parseDuration(line, BREVE)
-            elif line.startswith("M "):         self.parseDuration(line, MINIM)
-            elif line.startswith("M. "):        self.parseDuration(line, MINIM, DOTTED)
-            elif line.startswith("C "):         self.parseDuration(line, CROTCHET)
-            elif line.startswith("C. "):        self.parseDuration(line, CROTCHET, DOTTED)
-            elif line.startswith("Q "):         self.parseDuration(line, QUAVER)
-            elif line.startswith("Q. "):        self.parseDuration(line, QUAVER,DOTTED)
-            elif line.startswith("SQ "):        self.parseDuration(line, SEMIQUAVER)
-            elif line.startswith("SQ. "):       self.parseDuration(line, SEMIQUAVER, DOTTED)
-            # Rasgueado
-            elif line.startswith("R-"):         self.parseRasgueado(line)
-            # Alphabeto
-            elif line.startswith("AB-"):         self.parseAlfabeto(toS(line, "AB-"))
-            # Section
-            elif line.startswith("SECTION"):    self.parseSection(line)
-            # Title and composer
-            elif line.startswith("TITLE "):     self.currentPage.title = toS(line, "TITLE ")
-            elif line.startswith("COMPOSER "):  self.currentPage.composer = toS(line, "COMPOSER ")
-            # Space
-            elif line=="":                      self.parseSpace(line)
-            # Note without duration
-            elif re.match('^[0-9]', line):      self.parseNotes(line)
-
-            # Globals - these control the style of the document
-            # Page
-            elif line.startswith("PAGEWIDTH "):         GC.pageWidth=toI(line, "PAGEWIDTH ")
-            elif line.startswith("PAGEHEIGHT "):        GC.pageHeight=toI(line, "PAGEHEIGHT")
-            # Margins
-            elif line.startswith("TOPMARGIN "):         GC.topMargin=toI(line, "TOPMARGIN ")
-            elif line.startswith("BOTTOMMARGIN "):      GC.bottomMargin=toI(line, "BOTTOMMARGIN ")
-            elif line.startswith("LEFTMARGIN "):        GC.leftMargin=toI(line, "LEFTMARGIN ")
-            elif line.startswith("RIGHTMARGIN "):       GC.rightMargin=toI(line, "RIGHTMARGIN ")
-            # Stave layout
-            elif line.startswith("STAVESEPARATION "):   GC.staveSeparation=toI(line, "STAVESEPARATION ")
-            elif line.startswith("SLOTS "):             GC.slots=toI(line, "SLOTS ")
-            # Courses
-            elif line.startswith("COURSES "):           self.parseCourses(line)
-            elif line.startswith("NUMBEROFCOURSES "):   GC.numberOfCourses=toI(line, "NUMBEROFCOURSES ")
-            elif line.startswith("SHOWCOURSES"):        GC.showCourses=True
-            elif line.startswith("COURSESPACING "):     GC.courseSpacing=toI(line, "COURSESPACING ")
-            elif line.startswith("JUSTIFIED"):          GC.justified=True
-            # Barline
-            elif line.startswith("BARLINESPACING "):    GC.barlineSpacing=toI(line, "BARLINESPACING ")
-            elif line.startswith("BARBERPOLESPACING "): GC.barberpoleSpacing=toI(line, "BARBERPOLESPACING ")
-            # Text
-            elif line.startswith("TITLEFACE "):         GC.titleFace=toS(line, "TITLEFACE")
-            elif line.startswith("TITLESIZE "):         GC.titleSize=toI(line, "TITLESIZE ")
-            elif line.startswith("TITLEYPOSITION "):    GC.titleYPosition=toI(line, "TITLEYPOSITION ")
-            elif line.startswith("COMPOSERFACE "):      GC.composerFace=toS(line,"COMPOSERFACE ")
-            elif line.startswith("COMPOSERSIZE "):      GC.composerSize=toI(line, "COMPOSERSIZE")
-            elif line.startswith("COMPOSERYPOSITION "): GC.titleYPosition=toI(line, "COMPOSERYPOSITION ")
-            elif line.startswith("FRETFACE "):          GC.fretFace=toS(line, "FRETFACE ")
-            elif line.startswith("FRETSIZE "):          GC.fretSize=toI(line, "FRETSIZE ")
-            # Fret mapping
-            elif line.startswith("FRETMAP "):           self.parseFretmap(line)
-            elif line.startswith("FRETMAPPINGOFF"):     GC.mapFrets=False
-            elif line.startswith("FRENCH"):             GC.french=True
-            # Comment
-            elif line.startswith(";"):                  pass
-
-            else: pass
-
-    def render(self, f):
-        # First, map the fonts we are using to ISOLatin1 in order
-        # to access the special characters needed for foreign languages
-        print(psMapFont("Times-Roman"), file=f)         # Always map Times-Roman - it is the default font
-        print(psMapFont(GC.composerFace), file=f)
-        print(psMapFont(GC.titleFace), file=f)
-        print(psMapFont(GC.fretFace), file=f)
+    def write(self):
+        if self.split:
+            self.writePages()
+            return
+        with open(self.outputFilename, 'w', encoding="utf-8") as out:
+            f = PSWriter(out, self.context)
+            self.render(f)
+            f.flush()
+
+    def writePages(self):
+        # Each page is a document of its own, with its own prolog, so it can be printed or processed on its own
+        for n, page in self.selectedPages():
+            with open("%s-%d.ps" % (splitext(self.filename)[0], n), 'w', encoding="utf-8") as out:
+                f = PSWriter(out, self.context)
+                self.render(f, [(n, page)])
+                f.flush()
+
+
+class GasparPDFCompiler(GasparPostscriptCompiler):
+    """
+    Engraves straight to PDF: the score is compiled to the same pages and glyphs as for Postscript,
+    which are then drawn into a PDFWriter
+    """
+    version = 2
+
+    def __init__(self, filename, pages=None):
+        """
+        :param pages: the pages to draw, counted from 1 in file order e.g. [2, 3], or None for every page
+        """
+        GasparPostscriptCompiler.__init__(self, filename, pages=pages)
+        self.outputFilename = splitext(self.filename)[0] + ".pdf"
 
-        # Render the manuscript pages
-        for p in self.pages:
+    def render(self, f, pages=None):
+        """
+        :param pages: [(number, page)] to draw, by default the selected pages
+        """
+        for n, p in self.selectedPages() if pages is None else pages:
             p.render(f)
-
-    def write(self):
-        f = open(self.outputFilename, 'w')
-        self.render(f)
         f.close()
 
-
-def tabset(filename):
-    p = GasparPostscriptCompiler(filename)
-    p.parseLines()
-    p.write()
-
-
-def midiset(filename):
-    p = GasparMIDICompiler(filename)
-    p.parseLines()
-    p.write()
+    def write(self):
+        with open(self.outputFilename, 'wb') as out:
+            self.render(PDFWriter(out, self.context))
 
 
-def lilyset(filename):
-    p = GasparLilyCompiler(filename)
-    p.parseLines()
-    p.write()
+class GasparSVGCompiler(GasparPostscriptCompiler):
+    """
+    Engraves to SVG, one file per page: Espanoletas-1.svg, Espanoletas-2.svg etc.
+    Each page is written out as soon as it has been drawn
+    :param symbols: draw repeated glyphs once as symbols, otherwise draw every glyph inline
+    """
+    version = 2
 
+    def __init__(self, filename, symbols=True, pages=None):
+        """
+        :param pages: the pages to draw, counted from 1 in file order e.g. [2, 3], or None for every page
+        """
+        GasparPostscriptCompiler.__init__(self, filename, pages=pages)
+        self.symbols = symbols
+        # The first page - its age tells us whether the pages are up to date
+        self.outputFilename = "%s-%d.svg" % (splitext(self.filename)[0], pages[0] if pages else 1)
 
-def engrave(filename):
-    tabset(filename)
-    midiset(filename)
-    lilyset(filename)
+    def render(self, f, pages=None):
+        """
+        :param pages: [(number, page)] to draw, by default the selected pages. Each is written to the file of its number.
+        """
+        for n, p in self.selectedPages() if pages is None else pages:
+            f.number = n
+            p.render(f)
+        f.close()
 
-def main():
-    workingDir = os.getcwd() + "/Instruccion/"
-    testDir = os.getcwd() + "/TestMedia/"
+    def write(self):
+        self.render(SVGWriter(splitext(self.filename)[0], self.context, self.symbols))
 
-    # engrave(workingDir+"Espanoletas.sanz")
-    # engrave(workingDir+"EspanoletasPorOtro.sanz")
-    # engrave(workingDir+"Rujero.sanz")
-    # engrave(workingDir+"Paradetas.sanz")
-    # engrave(workingDir+"Matachin.sanz")
-    # engrave(workingDir+"Zarabanda.sanz")
-    # engrave(workingDir+"Jacaras.sanz")
-    # engrave(workingDir+"Chacona.sanz")
-    # engrave(workingDir+"ChaconaJustified.sanz")
-    # engrave(workingDir+"Pasacalles.sanz")
-    # engrave(workingDir+"Gallardas.sanz")
 
-    engrave(testDir+"CanariosFrench.sanz")
-    engrave(testDir+"CanariosItalian.sanz")
+def streamset(filename, cache=None, compact=False, pages=None):
+    # Engraves very large files to Postscript a page at a time
+    if isinstance(pages, str):
+        pages = parsePageRange(pages)
+    p = GasparPostscriptCompiler(filename, cache=cache, compact=compact, pages=pages)
+    p.stream()
 
-    tabset(testDir+"TestCourses.sanz")
-    tabset(testDir+"FretMappingTest.sanz")
 
-    #midiset(testDir+"TestCourses.sanz")
+class Build:
+    """
+    Builds the outputs of one .sanz file, parsing it at most once.
+    With a cache, an output whose source, settings and backend are unchanged is copied from the cache,
+    and the file is only parsed (or its parsed score fetched from the cache) if some output is out of date.
+    """
+    def __init__(self, filename, score=None, cache=None):
+        self.filename = filename
+        self.score = score
+        self.cache = cache
+        self.sourceHash = cache.sourceHash(filename) if cache else None
+
+    def getScore(self):
+        if self.score is None and self.cache:
+            self.score = self.cache.getScore(self.sourceHash)
+        if self.score is None:
+            self.score = parseScore(self.filename)
+            if self.cache:
+                self.cache.putScore(self.sourceHash, self.score)
+        return self.score
+
+    def build(self, compilerClass, backend, **options):
+        """
+        :return: the compiler that wrote the output, or None when it was copied from the cache
+        """
+        p = compilerClass(self.filename, **options)
+        # Split pages are written to many files, and an artifact is one file, so they are always written
+        cached = self.cache and not options.get("split")
+        if cached:
+            # Options such as compact Postscript change the output, so they are part of the key
+            # The number of jobs doesn't change the output
+            options = {k: v for k, v in options.items() if k not in ("cache", "jobs")}
+            # as are the settings the compilation starts from
+            key = self.cache.artifactKey(self.sourceHash, backend + repr(sorted(options.items())), compilerClass.version,
+                                         getattr(p, "context", None))
+            if self.cache.fetch(key, p.outputFilename):
+                return None
+        p.compile(self.getScore())
+        p.write()
+        if cached:
+            self.cache.store(key, p.outputFilename)
+        return p
+
+
+# Each of the backends accepts an already parsed score so that a file need only be parsed once.
+# Given a cache, e.g. defaultCache(), unchanged outputs are copied from it (see GasparCache) rather than rebuilt.
+def tabset(filename, score=None, cache=None, compact=False, jobs=1, pages=None, split=False):
+    """
+    :param pages: the pages to render e.g. "2-4,7" or [2, 3, 4, 7], counted from 1 in file order, or None for every page
+    :param split: write each page to a file of its own
+    """
+    if isinstance(pages, str):
+        pages = parsePageRange(pages)
+    b = Build(filename, score, cache)
+    b.build(GasparPostscriptCompiler, "ps", cache=b.cache, compact=compact, jobs=jobs,
+            pages=None if pages is None else tuple(pages), split=split)
+
+
+def pdfset(filename, score=None, cache=None, pages=None):
+    # pages selects the pages to draw e.g. "2-4,7", see tabset
+    if isinstance(pages, str):
+        pages = parsePageRange(pages)
+    Build(filename, score, cache).build(GasparPDFCompiler, "pdf", pages=None if pages is None else tuple(pages))
+
+
+def svgset(filename, score=None, symbols=True, pages=None):
+    # The artifact cache holds one file per output, so the pages are always drawn
+    if isinstance(pages, str):
+        pages = parsePageRange(pages)
+    Build(filename, score).build(GasparSVGCompiler, "svg", symbols=symbols, pages=None if pages is None else tuple(pages))
+
+
+def audioset(filename, score=None, cache=None, jobs=1):
+    """
+    Renders the piece to a WAV file with a plucked string model
+    :param jobs: render sections of the piece in this many processes
+    :return: the compiler, whose summary() gives how fast the piece was rendered, or None when it came from the cache
+    """
+    return Build(filename, score, cache).build(GasparAudioCompiler, "wav", jobs=jobs)
+
+
+def midiset(filename, score=None, cache=None, tracks=None, jobs=1):
+    """
+    :param tracks: None for a single track, or COURSETRACKS or STRINGTRACKS for a track for each course or string
+    :param jobs: encode the tracks in this many processes
+    """
+    b = Build(filename, score, cache)
+    if tracks is None:
+        b.build(GasparMIDICompiler, "midi")
+    else:
+        b.build(GasparMIDICompiler, "midi", cache=b.cache, tracks=tracks, jobs=jobs)
+
+
+def lilyset(filename, score=None, cache=None):
+    Build(filename, score, cache).build(GasparLilyCompiler, "ly")
+
+
+def engrave(filename, cache=None, compact=False, jobs=1, backends=("ps", "midi", "ly")):
+    # backends picks the outputs to build e.g. ("ps",) to just engrave the tablature
+    b = Build(filename, cache=cache)
+    if "ps" in backends:
+        b.build(GasparPostscriptCompiler, "ps", cache=b.cache, compact=compact, jobs=jobs)
+    if "midi" in backends:
+        b.build(GasparMIDICompiler, "midi")
+    if "ly" in backends:
+        b.build(GasparLilyCompiler, "ly")
+    if "pdf" in backends:
+        b.build(GasparPDFCompiler, "pdf")
+    if "svg" in backends:
+        Build(filename, b.score).build(GasparSVGCompiler, "svg")
+    if "wav" in backends:
+        b.build(GasparAudioCompiler, "wav", jobs=jobs)
 
+def main():
+    # Builds everything in the Instruccion library and the test media that is out of date
+    from GasparBatch import batch
+    batch([os.path.join(os.getcwd(), "Instruccion"), os.path.join(os.getcwd(), "TestMedia")], jobs=os.cpu_count() or 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+__author__ = 'jimarlow'
+# Writes SVG for the web, one file per page
+#
+# An SVGWriter draws the same glyphs as a PSWriter - Page.render draws into either.
+# Ticks and barberpoles, which repeat hundreds of times in a piece, are each drawn once as a <symbol>, the same
+# glyphs that compact Postscript defines as procedures, and every occurrence is a <use>. Circles, tick bodies
+# and semicircle ornaments are symbols too, and each font and size is a CSS class.
+# Without symbols, everything is drawn inline, which is what a naive SVG writer would do.
+from xml.sax.saxutils import escape
+
+from GasparTablature import *
+from GasparPDF import toWinAnsi
+
+# Postscript faces and the CSS font families that stand in for them on the web
+fontFamilies = {"Times-Roman": "'Times New Roman',Times,serif", "ArialMT": "Arial,Helvetica,sans-serif",
+                "Zapfino": "Zapfino,cursive"}
+
+# Every element strokes in the current colour, so a <use> can set the colour of its symbol
+# SVG 1.1 viewers only follow xlink:href, so the xlink namespace is declared for them
+svgOpen = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{0}" height="{1}" viewBox="0 0 {0} {1}" '
+           'fill="none" stroke="currentColor" stroke-width="' + str(LINEWIDTH) + '" color="#000">')
+svgClose = '</svg>'
+
+
+def svgColor(r, g, b):
+    # Postscript clips each component to 0..1
+    return "rgb(%d,%d,%d)" % tuple(round(min(max(c, 0), 1) * 255) for c in (r, g, b))
+
+
+def svgText(text):
+    # Postscript octal escapes such as \247 become the characters they stand for
+    return escape(toWinAnsi(str(text)).decode("cp1252", "replace"))
+
+
+class SVGWriter(PSWriter):
+    """
+    Writes the pages drawn into it to basename-1.svg, basename-2.svg etc.
+    Each showpage writes out a page and close() writes any page that was left unfinished.
+    SVG's y axis points down the page, so y is flipped as it is written.
+    :param symbols: define repeated glyphs once and place them with <use>, otherwise draw everything inline
+    """
+    def __init__(self, basename=None, context=None, symbols=True, height=None):
+        PSWriter.__init__(self, None, context)
+        self.context = context if context is not None else GlobalContext()
+        self.basename = basename
+        self.symbols = symbols
+        self.useProcedures = symbols
+        self.trackState = True
+        self.height = self.context.pageHeight if height is None else height
+        self.filenames = []
+        # The number of the next page, which names its file
+        self.number = 1
+        # The width and colour of the path being built
+        self.pathKey = None
+        # Symbol id -> its definition, for the symbols used on this page
+        self.defined = {}
+        # (face, size) -> CSS class, for the fonts used on this page
+        self.fontClasses = {}
+        # The procedure glyphs are drawn as symbols the first time they are used
+        self.procedureGlyphs = dict(procedureGlyphs())
+        self.procedureBodies = {}
+
+    def y(self, y):
+        return psNum(self.height - y)
+
+    def widthAttribute(self, lineWidth):
+        return "" if lineWidth == LINEWIDTH else ' stroke-width="%s"' % psNum(lineWidth)
+
+    def colorAttribute(self):
+        return "" if self.wantColor == BLACK else ' color="%s"' % svgColor(*self.wantColor)
+
+    def endPath(self):
+        if self.path:
+            path, self.path = self.path, []
+            lineWidth, color = self.pathKey
+            self.out('<path d="%s"%s%s/>' % ("".join(path), self.widthAttribute(lineWidth),
+                                            "" if color == BLACK else ' color="%s"' % svgColor(*color)))
+
+    def line(self, x1, y1, x2, y2, lineWidth=LINEWIDTH):
+        # Runs of lines with the same width and colour are drawn as one path
+        key = (lineWidth, self.wantColor)
+        if key != self.pathKey:
+            self.endPath()
+            self.pathKey = key
+        self.path.append("M%s %sL%s %s" % (psNum(x1), self.y(y1), psNum(x2), self.y(y2)))
+
+    def use(self, id, body, x, y):
+        self.endPath()
+        self.defined.setdefault(id, body)
+        self.out('<use href="#%s" xlink:href="#%s" x="%s" y="%s"%s/>' % (id, id, psNum(x), self.y(y), self.colorAttribute()))
+
+    def shape(self, id, body, inline, x, y):
+        # A primitive that is placed as a symbol, or drawn inline
+        if self.symbols:
+            self.use(id, body, x, y)
+        else:
+            self.endPath()
+            self.out(inline)
+
+    def circle(self, x, y, radius, lineWidth=LINEWIDTH):
+        width = self.widthAttribute(lineWidth)
+        self.shape("c%s-%s" % (psNum(radius), psNum(lineWidth)), '<circle r="%s"%s/>' % (psNum(radius), width),
+                   '<circle cx="%s" cy="%s" r="%s"%s%s/>' % (psNum(x), self.y(y), psNum(radius), width, self.colorAttribute()), x, y)
+
+    def filledCircle(self, x, y, radius, lineWidth=LINEWIDTH):
+        self.shape("f%s" % psNum(radius), '<circle r="%s" fill="currentColor" stroke="none"/>' % psNum(radius),
+                   '<circle cx="%s" cy="%s" r="%s" fill="currentColor" stroke="none"%s/>' % (psNum(x), self.y(y), psNum(radius), self.colorAttribute()), x, y)
+
+    def semicircle(self, name, x, y, radius, lineWidth, sweep):
+        r, width = psNum(radius), self.widthAttribute(lineWidth)
+        self.shape("%s%s-%s" % (name, r, psNum(lineWidth)), '<path d="M%s 0A%s %s 0 0 %d -%s 0"%s/>' % (r, r, r, sweep, r, width),
+                   '<path d="M%s %sA%s %s 0 0 %d %s %s"%s%s/>' %
+                   (psNum(x + radius), self.y(y), r, r, sweep, psNum(x - radius), self.y(y), width, self.colorAttribute()), x, y)
+
+    def overSemicircle(self, x, y, radius, lineWidth=1): self.semicircle("o", x, y, radius, lineWidth, 0)
+
+    def underSemicircle(self, x, y, radius, lineWidth=1): self.semicircle("u", x, y, radius, lineWidth, 1)
+
+    def curve(self, x1, y1, x2, y2, x3, y3, lineWidth=LINEWIDTH):
+        self.endPath()
+        self.out('<path d="M%s %sC%s %s %s %s %s %s"%s%s/>' % (psNum(x1), self.y(y1), psNum(x1), self.y(y1), psNum(x2), self.y(y2),
+                                                             psNum(x3), self.y(y3), self.widthAttribute(lineWidth), self.colorAttribute()))
+
+    def fontAttributes(self, face, size):
+        face = face.replace("-ISOLatin1", "")
+        if self.symbols:
+            if (face, size) not in self.fontClasses:
+                self.fontClasses[(face, size)] = "t%d" % len(self.fontClasses)
+            return ' class="%s"' % self.fontClasses[(face, size)]
+        return ' font-family="%s" font-size="%s" fill="currentColor" stroke="none"' % (fontFamilies.get(face, face), psNum(size))
+
+    def placeText(self, text, x, y, size, face, anchor=""):
+        self.endPath()
+        self.out('<text x="%s" y="%s"%s%s%s>%s</text>' % (psNum(x), self.y(y), self.fontAttributes(face, size), anchor,
+                                                        self.colorAttribute(), svgText(text)))
+
+    def text(self, text="Hello world", x=100, y=100, size=12.5, face="Times-Roman-ISOLatin1"):
+        self.placeText(text, x, y, size, face)
+
+    def centeredText(self, text="Hello world", pageWidth=595, y=742, size=28, face="Times-Roman"):
+        # SVG measures the text itself
+        self.placeText(text, pageWidth / 2, y, size, face, ' text-anchor="middle"')
+
+    def rightJustifiedText(self, text="Hello world", pageWidth=595, y=720, size=14, face="Times-Roman"):
+        self.placeText(text, pageWidth, y, size, face, ' text-anchor="end"')
+
+    def procedure(self, name, x, y):
+        if name not in self.procedureBodies:
+            # Draw the glyph at the origin, with y flipped about it
+            w = SVGWriter(context=self.context, symbols=False, height=0)
+            self.procedureGlyphs[name].renderInline(w, 0, 0, self.context)
+            self.procedureBodies[name] = w.getvalue().replace("\n", "")
+        self.use(name, self.procedureBodies[name], x, y)
+
+    def showpage(self):
+        # Writes out the page drawn so far, with the symbols and fonts it uses
+        body = self.pop()
+        filename = "%s-%d.svg" % (self.basename, self.number)
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(svgOpen.format(psNum(self.context.pageWidth), psNum(self.context.pageHeight)) + "\n")
+            if self.fontClasses:
+                f.write("<style>%s</style>\n" % "".join(
+                    ".%s{font:%spx %s;fill:currentColor;stroke:none}" % (c, psNum(size), fontFamilies.get(face, face))
+                    for (face, size), c in self.fontClasses.items()))
+            if self.defined:
+                f.write("<defs>\n%s\n</defs>\n" % "\n".join(
+                    '<symbol id="%s" overflow="visible">%s</symbol>' % (id, body) for id, body in self.defined.items()))
+            f.write(body)
+            f.write(svgClose + "\n")
+        self.filenames.append(filename)
+        self.number += 1
+        self.defined = {}
+        self.fontClasses = {}
+        self.wantColor = BLACK
+        self.invalidate()
+
+    def close(self):
+        # The last page normally ends with a showpage, which has already written it
+        if self.chunks or not self.filenames:
+            self.showpage()
@@ -0,0 +1,374 @@
+__author__ = 'jimarlow'
+import hashlib
+from GasparConfig import *
+from GasparLexer import *
+
+# The score intermediate representation (IR)
+# A .sanz file is parsed once into a Score. The Postscript, MIDI and Lilypond compilers
+# all consume the same Score, so the three outputs can never drift apart.
+#
+# Score
+#   settings    - ScoreSetting events that appear before the first page
+#   pages       - ScorePage
+#       events  - events that appear before the first stave on the page (usually settings)
+#       staves  - ScoreStave
+#           events - ScoreChord, ScoreBarline, ScoreTimeSignature etc. in document order
+
+# Bump this whenever the IR changes so that cached scores are not reused
+scoreVersion = 2
+
+# Durations as written in the .sanz file e.g. "Q. 1-3"
+durations = {"W": (BREVE, False),
+             "M": (MINIM, False), "M.": (MINIM, DOTTED),
+             "C": (CROTCHET, False), "C.": (CROTCHET, DOTTED),
+             "Q": (QUAVER, False), "Q.": (QUAVER, DOTTED),
+             "SQ": (SEMIQUAVER, False), "SQ.": (SEMIQUAVER, DOTTED)}
+
+# Ornaments are written in place of a fret e.g. 2-{
+OVERSEMICIRCLE = "{"
+UNDERSEMICIRCLE = "}"
+SLURSTART = "["
+SLUREND = "]"
+ornaments = (OVERSEMICIRCLE, UNDERSEMICIRCLE, SLURSTART, SLUREND)
+
+
+class ScoreSetting:
+    # A global setting - name is the name of the GlobalContext attribute it sets
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class ScoreNote:
+    def __init__(self, course, fret):
+        self.course = course
+        self.fret = fret
+        self.ornament = fret if fret in ornaments else None
+
+
+class ScoreChord:
+    # duration is None for a chord that has no duration prefix (it takes the previous duration)
+    def __init__(self, notes, duration=None, dotted=False):
+        self.notes = notes
+        self.duration = duration
+        self.dotted = dotted
+
+
+class ScoreTimeSignature:
+    def __init__(self, top, bottom=None):
+        self.top = top
+        self.bottom = bottom
+
+
+class ScoreBarline:
+    # kind is the barline directive without its dash e.g. "B", "DB", "BP"
+    # args are the dash separated arguments e.g. BP-2-4 gives ["2", "4"]
+    def __init__(self, kind, args):
+        self.kind = kind
+        self.args = args
+        self.number = args[0].lstrip() if args else ""
+
+
+class ScoreRasgueado:
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+
+class ScoreAlfabeto:
+    def __init__(self, chord):
+        self.chord = chord
+
+
+class ScoreSection:
+    pass
+
+
+class ScoreSpace:
+    pass
+
+
+class ScoreStave:
+    def __init__(self, number=""):
+        self.number = number
+        self.events = []
+        # A hash of the source from S- up to the next stave or page, so we can tell when a stave has been edited
+        self.sourceHash = ""
+
+
+class ScorePage:
+    def __init__(self, number=""):
+        self.number = number
+        self.title = ""
+        self.composer = ""
+        self.events = []
+        self.staves = []
+        # A hash of the source from P- up to the first stave
+        self.sourceHash = ""
+
+
+class Score:
+    def __init__(self, filename=""):
+        self.filename = filename
+        self.settings = []
+        self.pages = []
+
+    def events(self):
+        """
+        Walks the score in document order
+        :return: the settings, then each page followed by its events and staves, each stave followed by its events
+        """
+        for s in self.settings:
+            yield s
+        for p in self.pages:
+            yield p
+            for e in p.events:
+                yield e
+            for s in p.staves:
+                yield s
+                for e in s.events:
+                    yield e
+
+
+# Global settings that simply set a GlobalContext attribute: keyword -> (attribute, conversion)
+settingKeywords = {
+    # Page
+    "PAGEWIDTH": ("pageWidth", int),
+    "PAGEHEIGHT": ("pageHeight", int),
+    # Margins
+    "TOPMARGIN": ("topMargin", int),
+    "BOTTOMMARGIN": ("bottomMargin", int),
+    "LEFTMARGIN": ("leftMargin", int),
+    "RIGHTMARGIN": ("rightMargin", int),
+    # Stave layout
+    "STAVESEPARATION": ("staveSeparation", int),
+    "SLOTS": ("slots", int),
+    # Courses
+    "NUMBEROFCOURSES": ("numberOfCourses", int),
+    "COURSESPACING": ("courseSpacing", int),
+    # Barline
+    "BARLINESPACING": ("barlineSpacing", int),
+    "BARBERPOLESPACING": ("barberpoleSpacing", int),
+    # Text
+    "TITLEFACE": ("titleFace", str),
+    "TITLESIZE": ("titleSize", int),
+    "TITLEYPOSITION": ("titleYPosition", int),
+    "COMPOSERFACE": ("composerFace", str),
+    "COMPOSERSIZE": ("composerSize", int),
+    "COMPOSERYPOSITION": ("titleYPosition", int),
+    "FRETFACE": ("fretFace", str),
+    "FRETSIZE": ("fretSize", int)}
+
+# Global switches: keyword -> (attribute, value)
+switchKeywords = {
+    "SHOWCOURSES": ("showCourses", True),
+    "JUSTIFIED": ("justified", True),
+    "FRETMAPPINGOFF": ("mapFrets", False),
+    "FRENCH": ("french", True),
+    "COMPACTPOSTSCRIPT": ("compactPostscript", True),
+    "GRAPHICSSTATETRACKINGOFF": ("trackGraphicsState", False)}
+
+
+class GasparScoreParser:
+    def __init__(self, filename):
+        self.filename = filename
+        self.score = Score(filename)
+        self.currentPage = None
+        self.currentStave = None
+        # The source spans of the pages and staves: [(container, hash)]
+        self.spans = []
+        self.currentSpan = None
+
+        # The tablature syntax - each directive dispatches straight to its parse method
+        self.parsers = {
+            # Page and stave
+            "P-": self.parsePage,
+            "S-": self.parseStave,
+            # Time signature
+            "T-": self.parseTimeSignature,
+            # Barlines
+            "B-": self.parseBarline,
+            "SB-": self.parseBarline,
+            "TB-": self.parseBarline,
+            "DB-": self.parseBarline,
+            "LSB-": self.parseBarline,
+            "BP-": self.parseBarline,
+            "EB-": self.parseBarline,
+            # Rasgueado
+            "R-": self.parseRasgueado,
+            # Alfabeto
+            "AB-": self.parseAlfabeto,
+            # Notes with and without a duration
+            NOTES: self.parseNotes,
+            # Space
+            BLANK: self.parseSpace,
+            # Comment
+            COMMENT: self.parseComment,
+            # Section
+            "SECTION": self.parseSection,
+            # Title and composer
+            "TITLE": self.parseTitle,
+            "COMPOSER": self.parseComposer,
+            # Globals - these control the style of the document
+            "COURSES": self.parseCourses,
+            "FRETMAP": self.parseFretmap}
+        for k in durations:
+            self.parsers[k] = self.parseDuration
+        for k in settingKeywords:
+            self.parsers[k] = self.parseSetting
+        for k in switchKeywords:
+            self.parsers[k] = self.parseSwitch
+
+    def append(self, event):
+        # Events are appended to the innermost open container
+        if self.currentStave is not None:
+            self.currentStave.events.append(event)
+        elif self.currentPage is not None:
+            self.currentPage.events.append(event)
+        else:
+            self.score.settings.append(event)
+
+    def set(self, name, value):
+        self.append(ScoreSetting(name, value))
+
+    def openSpan(self, container):
+        self.currentSpan = hashlib.sha1()
+        self.spans.append((container, self.currentSpan))
+
+    def parsePage(self, token):
+        self.currentPage = ScorePage(token.value.split()[0] if token.value else "")
+        self.currentStave = None
+        self.score.pages.append(self.currentPage)
+        self.openSpan(self.currentPage)
+
+    def parseStave(self, token):
+        self.currentStave = ScoreStave(token.value.split("-")[0].strip())
+        self.currentPage.staves.append(self.currentStave)
+        self.openSpan(self.currentStave)
+
+    def parseTimeSignature(self, token):
+        ts = token.value.split("-")
+        if len(ts) == 1:
+            self.append(ScoreTimeSignature(ts[0]))
+        elif len(ts) == 2:
+            self.append(ScoreTimeSignature(ts[0], ts[1]))
+
+    def parseBarline(self, token):
+        self.append(ScoreBarline(token.directive[:-1], token.value.split("-")))
+
+    def parseRasgueado(self, token):
+        self.append(ScoreRasgueado(token.value.split("-")[0].lstrip()))
+
+    def parseAlfabeto(self, token):
+        self.append(ScoreAlfabeto(token.value.lstrip()))
+
+    def parseChord(self, notes, duration=None, dotted=False):
+        chord = []
+        for n in notes:
+            course, fret = n.split('-')
+            chord.append(ScoreNote(int(course), fret))
+        self.append(ScoreChord(chord, duration, dotted))
+
+    def parseNotes(self, token):
+        self.parseChord(token.value.split())
+
+    def parseDuration(self, token):
+        # A duration on its own e.g. "C" is not a chord
+        if token.kind != DURATION:
+            return
+        duration, dotted = durations[token.directive]
+        self.parseChord(token.value.split(), duration, dotted)
+
+    def parseSpace(self, token):
+        self.append(ScoreSpace())
+
+    def parseComment(self, token):
+        pass
+
+    def parseSection(self, token):
+        self.append(ScoreSection())
+
+    def parseTitle(self, token):
+        self.currentPage.title = token.value
+
+    def parseComposer(self, token):
+        self.currentPage.composer = token.value
+
+    def parseSetting(self, token):
+        name, conversion = settingKeywords[token.directive]
+        self.set(name, conversion(token.value))
+
+    def parseSwitch(self, token):
+        name, value = switchKeywords[token.directive]
+        self.set(name, value)
+
+    def parseCourses(self, token):
+        courses = [c.split("-") for c in token.value.split()]
+        self.set("courses", courses)
+        self.set("numberOfCourses", len(courses))
+
+    def parseFretmap(self, token):
+        fmap = token.value.split()
+        if len(fmap) == 0:
+            return
+        fretMapping = {}
+        for f in fmap:
+            k, v = f.split("-")
+            fretMapping[k] = v
+        self.set("fretMapping", fretMapping)
+
+    def parseToken(self, token):
+        parser = self.parsers.get(token.directive)
+        # Unknown directives are ignored
+        if parser is not None:
+            parser(token)
+            # Comments and indentation don't change the output, so they are not part of the span
+            if self.currentSpan is not None and token.kind != COMMENT:
+                self.currentSpan.update(("%s\0%s\n" % (token.directive, token.value)).encode("utf-8"))
+
+    def closeSpans(self):
+        for container, span in self.spans:
+            container.sourceHash = span.hexdigest()
+        self.spans = []
+
+    def parseTokens(self, tokens):
+        for token in tokens:
+            self.parseToken(token)
+        self.closeSpans()
+        return self.score
+
+    def streamPages(self, tokens):
+        """
+        Parses the tokens a page at a time. Each page is yielded as soon as the next P- starts,
+        and is then dropped from the score, so only one page is ever held in memory.
+        The settings before the first page are in self.score.settings by the time the first page is yielded.
+        """
+        for token in tokens:
+            if token.directive == "P-" and self.currentPage is not None:
+                self.closeSpans()
+                yield self.currentPage
+                self.score.pages = []
+            self.parseToken(token)
+        self.closeSpans()
+        if self.currentPage is not None:
+            yield self.currentPage
+            self.score.pages = []
+
+    def parseLines(self):
+        with open(self.filename) as f:
+            return self.parseTokens(tokenize(f))
+
+    def streamLines(self):
+        # The file is read lazily, a line at a time
+        with open(self.filename) as f:
+            for page in self.streamPages(tokenize(f)):
+                yield page
+
+
+def parseScore(filename):
+    return GasparScoreParser(filename).parseLines()
+
+
+if __name__ == "__main__":
+    import sys
+    for e in parseScore(sys.argv[1]).events():
+        print(type(e).__name__, vars(e) if hasattr(e, "__dict__") else "")
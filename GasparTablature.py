@@ -8,386 +8,432 @@ import re
 # import sys
 # sys.stdout = open('gaspar.ps', 'w')
 
-def mapFret(fret):
+# A fret number followed by its adornments e.g. 10:.
+fretPattern = re.compile("([0-9]+)([a-zA-Z:.]+)")
+
+
+def mapFret(fret, context):
     """Splits a fret into the fret number and any adornments (e.g. T)
-    Maps the fret number according to the CG.fretMapping dictionary.
+    Maps the fret number according to the context.fretMapping dictionary.
     Note: the first parameter of Dictionary.get is the key, the second,
     the value to return if the key is missing.
     :param fret: 10:.
     :return: X:.
     """
-    m = re.match("([0-9]+)([a-zA-Z:.]+)", fret)
+    m = fretPattern.match(fret)
     if m:
-        return GC.fretMapping.get(m.group(1), m.group(1)) + m.group(2)
+        return context.fretMapping.get(m.group(1), m.group(1)) + m.group(2)
     else:
-        return GC.fretMapping.get(fret, fret)
+        return context.fretMapping.get(fret, fret)
 
 
-def italianOrFrench(c):
-    if GC.french:
-        return GC.numberOfCourses + 1 - c
+def italianOrFrench(c, context):
+    if context.french:
+        return context.numberOfCourses + 1 - c
     else:
         return c
 
 
+# Glyphs only know their logical position on the stave: a slot and a course
+# The stave turns slots and courses into page coordinates as it is rendered, see Stave.layout,
+# so a stave can be moved, resized or justified without touching any of its glyphs
+# Glyphs declare __slots__ as there are thousands of them in a piece
 class TimeSignatureDouble:
+    __slots__ = ("top", "bottom")
+
     def __init__(self, top, bottom):
         self.top = top
         self.bottom = bottom
 
-    def placeOnStave(self, stave):
-        self.stave = stave
-        self.fontSize = stave.height / 2
-        self.bottomX = stave.x
-        self.bottomY = stave.y + self.fontSize / 5
-        self.topX = stave.x
-        self.topY = stave.y + stave.height / 2 + self.fontSize / 5
-
-    def pad(self, padding):
-        pass
-
-    def render(self, f):
-        print(psText(self.top, self.topX, self.topY, self.fontSize), file=f)
-        print(psText(self.bottom, self.bottomX, self.bottomY, self.fontSize), file=f)
+    def render(self, f, stave):
+        fontSize = stave.height / 2
+        f.text(self.top, stave.x, stave.y + stave.height / 2 + fontSize / 5, fontSize)
+        f.text(self.bottom, stave.x, stave.y + fontSize / 5, fontSize)
 
 
 class TimeSignatureSingle:
+    __slots__ = ("glyph",)
+
     def __init__(self, glyph):
         self.glyph = glyph
 
-    def placeOnStave(self, stave):
-        self.fontSize = stave.height / 2
-        self.bottomX = stave.x
-        self.bottomY = stave.y + stave.height / 2 - self.fontSize / 3
+    def position(self, stave):
+        """
+        :return: x, y, fontSize
+        """
+        fontSize = stave.height / 2
+        return stave.x, stave.y + stave.height / 2 - fontSize / 3, fontSize
 
-    def pad(self, padding):
-        pass
-
-    def render(self, f):
-        print(psText(self.glyph, self.bottomX, self.bottomY, self.fontSize), file=f)
+    def render(self, f, stave):
+        x, y, fontSize = self.position(stave)
+        f.text(self.glyph, x, y, fontSize)
 
 
 class CommonTime(TimeSignatureSingle):
+    __slots__ = ()
+
     def __init__(self):
         TimeSignatureSingle.__init__(self, "C")
 
-    def pad(self, padding):
-        pass
-
-    def render(self, f):
-        print(psText(self.glyph, self.bottomX, self.bottomY, self.fontSize), file=f)
-
 
 class SplitCommonTime(TimeSignatureSingle):
+    __slots__ = ()
+
     def __init__(self):
         TimeSignatureSingle.__init__(self, "C")
 
-    def placeOnStave(self, stave):
-        super().placeOnStave(stave)
-        self.lineBottomX = self.bottomX + self.fontSize / 3
-        self.lineBottomY = self.bottomY - self.fontSize / 4
-        self.lineHeight = self.fontSize + self.fontSize / 4
-
-    def pad(self, padding):
-        pass
-
-    def render(self, f):
-        print(psText(self.glyph, self.bottomX, self.bottomY, self.fontSize), file=f)
-        print(psVerticalLine(self.lineBottomX, self.lineBottomY, self.lineHeight, lineWidth=1), file=f)
+    def render(self, f, stave):
+        x, y, fontSize = self.position(stave)
+        f.text(self.glyph, x, y, fontSize)
+        f.verticalLine(x + fontSize / 3, y - fontSize / 4, fontSize + fontSize / 4, lineWidth=1)
 
 
 class Alfabeto:
+    __slots__ = ("slot", "chord")
+
     def __init__(self, slot, chord):
         self.slot = slot
         self.chord = chord
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.y + getStaveHeight()/2 - GC.alfabetoSize/3
-
-    def pad(self, padding):
-        self.x += self.slot * padding
-
-    def render(self, f):
-        print(psText(text=self.chord, x=self.x, y=self.y, size=GC.alfabetoSize, face=GC.alfabetoFace), file=f)
+    def render(self, f, stave):
+        context = stave.context
+        f.text(text=self.chord, x=stave.slotXs[self.slot], y=stave.y + getStaveHeight(context)/2 - context.alfabetoSize/3, size=context.alfabetoSize, face=context.alfabetoFace)
 
 
 
 class Strum:
+    __slots__ = ("slot", "pattern")
+
     def __init__(self, slot, pattern):
         self.slot = slot
         self.pattern = pattern
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.y
-
-    def pad(self, padding):
-        self.x += self.slot * padding
-
-    def render(self, f):
-        offset = GC.fretSize/2
-        print(psRGBColor(255, 0, 0), file=f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        offset = context.fretSize/2
+        f.setColor(255, 0, 0)
         for s in self.pattern:
-            offset += GC.fretSize/2
+            offset += context.fretSize/2
             if s == 'U':
-                print(psVerticalLine(self.x+offset, self.y, GC.fretSize*3/4, 1), file=f)
+                f.verticalLine(x+offset, stave.y, context.fretSize*3/4, 1)
             elif s =='D':
-                print(psVerticalLine(self.x+offset, self.y, - GC.fretSize*3/4, 1), file=f)
-        print(psRGBColor(), file=f)
+                f.verticalLine(x+offset, stave.y, - context.fretSize*3/4, 1)
+        f.setColor()
 
 
 class OverSemicircle:
+    __slots__ = ("slot", "course")
+
     def __init__(self, slot=0, course=1):
         self.slot = slot
         self.course = course
-        self.radius = GC.semicircleRadius
-
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot) + self.radius / 2
-        self.y = stave.getSlotY(self.course) * stave.courseSpacing + stave.courseSpacing * 0.8 - self.radius
-
-    def pad(self, padding):
-        self.x += self.slot * padding
 
-    def render(self, f):
-        print(psOverSemicircle(self.x, self.y, self.radius), file=f)
+    def render(self, f, stave):
+        radius = stave.context.semicircleRadius
+        x = stave.getSlotX(self.slot, radius / 2)
+        y = stave.courseYs[self.course] * stave.courseSpacing + stave.courseSpacing * 0.8 - radius
+        f.overSemicircle(x, y, radius)
 
 
 class UnderSemicircle:
+    __slots__ = ("slot", "course")
+
     def __init__(self, slot=0, course=1):
         self.slot = slot
         self.course = course
-        self.radius = GC.semicircleRadius
-
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot) + self.radius / 2
-        self.y = stave.getSlotY(self.course) - (stave.courseSpacing * 0.8 - self.radius)
 
-    def pad(self, padding):
-        self.x += self.slot * padding
-
-    def render(self, f):
-        print(psUnderSemicircle(self.x, self.y, self.radius), file=f)
+    def render(self, f, stave):
+        radius = stave.context.semicircleRadius
+        x = stave.getSlotX(self.slot, radius / 2)
+        y = stave.courseYs[self.course] - (stave.courseSpacing * 0.8 - radius)
+        f.underSemicircle(x, y, radius)
 
 
 class Slur:
+    __slots__ = ("slot1", "course1", "slot", "slot2", "course2")
+
     def __init__(self, slot1=0, course1=1, slot2=0, course2=1):
         self.slot1 = slot1
         self.course1 = course1
         self.slot = self.slot2 = slot2
         self.course2 = course2
-        self.x = 0
 
-    def placeOnStave(self, stave):
-        c1 = italianOrFrench(self.course1)
-        c2 = italianOrFrench(self.course2)
-        print(self.course1, c1)
+    def render(self, f, stave):
+        context = stave.context
+        c1 = italianOrFrench(self.course1, context)
+        c2 = italianOrFrench(self.course2, context)
         # Start of slur
-        self.x1 = stave.getSlotX(self.slot1)
-        self.y1 = stave.y + (c1 - 1) * stave.courseSpacing + stave.courseSpacing*3/4
+        x1 = stave.getSlotX(self.slot1)
+        y1 = stave.y + (c1 - 1) * stave.courseSpacing + stave.courseSpacing*3/4
         # End of slur
-        self.x3 = stave.getSlotX(self.slot2)
-        self.y3 = stave.y + (c2 - 1) * stave.courseSpacing + stave.courseSpacing*3/4
+        x3 = stave.slotXs[self.slot2]
+        y3 = stave.y + (c2 - 1) * stave.courseSpacing + stave.courseSpacing*3/4
         # Middle of slur
-        self.x2 = (self.x1 + self.x3)/2
-        if GC.french:
-            self.y1 -= 1.5*stave.courseSpacing
-            self.y2 = min(self.y1, self.y3) - 2*stave.courseSpacing - stave.courseSpacing
-            self.y3 -= 1.5*stave.courseSpacing
+        x2 = (x1 + x3)/2
+        if context.french:
+            y1 -= 1.5*stave.courseSpacing
+            y2 = min(y1, y3) - 2*stave.courseSpacing - stave.courseSpacing
+            y3 -= 1.5*stave.courseSpacing
         else:
-            self.y2 = max(self.y1, self.y3) + 2*stave.courseSpacing
-
-    def pad(self, padding):
-        self.x1 += self.slot1 * padding
-        self.x3 += self.slot2 * padding
-        self.x2 = (self.x1 + self.x3)/2
-
-    def render(self, f):
-        print(psCurveTo(self.x1, self.y1, self.x2, self.y2, self.x3, self.y3,), file=f)
+            y2 = max(y1, y3) + 2*stave.courseSpacing
+        f.curve(x1, y1, x2, y2, x3, y3,)
 
 
 class Section:
+    __slots__ = ("slot",)
+
     def __init__(self, slot=0):
         self.slot = slot
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.y + stave.height*3/2
-
-    def pad(self, padding):
-        self.x += self.slot * padding
-
-    def render(self, f):
-        print(psText("\\247", self.x, self.y, GC.sectionSymbolSize), file=f)
+    def render(self, f, stave):
+        context = stave.context
+        f.text("\\247", stave.slotXs[self.slot], stave.y + stave.height*3/2, context.sectionSymbolSize)
 
 
 def renderBox(x, y, width, height, lw, f):
-    print(psVerticalLine(x, y, height, lw), file=f)
-    print(psVerticalLine(x + width, y, height, lw), file=f)
-    print(psHorizontalLine( x, y, width, lw), file=f)
-    print(psHorizontalLine( x, y+height, width, lw), file=f)
+    f.verticalLine(x, y, height, lw)
+    f.verticalLine(x + width, y, height, lw)
+    f.horizontalLine( x, y, width, lw)
+    f.horizontalLine( x, y+height, width, lw)
 
 def renderCrossBox(x, y, width, height, lw, f):
     renderBox( x, y, width, height, lw, f)
-    print(psLine( x, y, x+width, y+height, lw), file=f)
-    print(psLine( x, y+height, x+width, y, lw), file=f)
+    f.line( x, y, x+width, y+height, lw)
+    f.line( x, y+height, x+width, y, lw)
 
 def renderTriangle(x, y, width, height, lw, f):
     apexX = x + width/2
     apexY = y + height
-    print(psHorizontalLine( x, y, width, lw), file=f)
-    print(psLine(x, y, apexX, apexY, lw), file=f)
-    print(psLine(x+width, y, apexX, apexY, lw), file=f)
-
-def renderBarberpole(x, y, file, startCourse=1, endCourse=GC.numberOfCourses, isHollow=False):
-    triangleHeight = GC.courseSpacing * 0.75
-    bottomTriangleY = y + getCourseYOffset(startCourse)
-    bottomTriangleHeight = -getCourseYOffset(startCourse) - GC.courseSpacing * 0.75
-
-    topTriangleY = y + getCourseYOffset(endCourse)
-    topTriangleHeight = getStaveHeight() - getCourseYOffset(endCourse) + GC.courseSpacing * 0.75
-
-    circleR = GC.barberpoleSpacing/2.5
-    circleX = x + GC.barberpoleSpacing/2
+    f.horizontalLine( x, y, width, lw)
+    f.line(x, y, apexX, apexY, lw)
+    f.line(x+width, y, apexX, apexY, lw)
+
+def renderBarberpole(x, y, file, context, startCourse=1, endCourse=None, isHollow=False):
+    # By default a barberpole spans every course of the stave
+    if endCourse is None:
+        endCourse = context.numberOfCourses
+    triangleHeight = context.courseSpacing * 0.75
+    bottomTriangleY = y + getCourseYOffset(context, startCourse)
+    bottomTriangleHeight = -getCourseYOffset(context, startCourse) - context.courseSpacing * 0.75
+
+    topTriangleY = y + getCourseYOffset(context, endCourse)
+    topTriangleHeight = getStaveHeight(context) - getCourseYOffset(context, endCourse) + context.courseSpacing * 0.75
+
+    circleR = context.barberpoleSpacing/2.5
+    circleX = x + context.barberpoleSpacing/2
     circleYBottom = y - triangleHeight - circleR
-    circleYTop = y + getStaveHeight() + triangleHeight + circleR
-    renderTriangle(x, topTriangleY, GC.barberpoleSpacing, topTriangleHeight, LINEWIDTH, file)
-    renderTriangle(x, bottomTriangleY, GC.barberpoleSpacing, bottomTriangleHeight, LINEWIDTH, file)
-    print(psCircle(circleX, circleYBottom, circleR, LINEWIDTH), file=file)
-    print(psCircle(circleX, circleYTop, circleR, LINEWIDTH), file=file)
+    circleYTop = y + getStaveHeight(context) + triangleHeight + circleR
+    renderTriangle(x, topTriangleY, context.barberpoleSpacing, topTriangleHeight, LINEWIDTH, file)
+    renderTriangle(x, bottomTriangleY, context.barberpoleSpacing, bottomTriangleHeight, LINEWIDTH, file)
+    file.circle(circleX, circleYBottom, circleR, LINEWIDTH)
+    file.circle(circleX, circleYTop, circleR, LINEWIDTH)
     if isHollow:
-        renderBox(x , y + getCourseYOffset(startCourse), GC.barberpoleSpacing, getCourseYOffset(endCourse) - getCourseYOffset(startCourse), LINEWIDTH, file)
+        renderBox(x , y + getCourseYOffset(context, startCourse), context.barberpoleSpacing, getCourseYOffset(context, endCourse) - getCourseYOffset(context, startCourse), LINEWIDTH, file)
     else:
-        [renderCrossBox(x, y + getCourseYOffset(c), GC.barberpoleSpacing, GC.courseSpacing, LINEWIDTH, file) for c in range(startCourse,  endCourse)]
+        [renderCrossBox(x, y + getCourseYOffset(context, c), context.barberpoleSpacing, context.courseSpacing, LINEWIDTH, file) for c in range(startCourse,  endCourse)]
 
 
 # Barlines
 class Barline:
+    __slots__ = ("slot", "number")
+
     def __init__(self, number=0, slot=0):
         self.slot = slot
         self.number = number
 
-    def placeOnStave(self, stave):
-        self.stave = stave
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.y
-
-    def pad(self, padding):
-        self.x += self.slot * padding
+    def renderBarlineText(self, textX, textY, f, context):
+        f.setColor(0, 0, 255)
+        f.text(text=str(self.number), x=textX, y=textY, size=context.barlineSize, face=context.barlineFace)
+        f.setColor()
 
-    def renderBarlineText(self, textX, textY, f):
-        print(psRGBColor(0, 0, 255), file=f)
-        print(psText(text=str(self.number), x=textX, y=textY, size=GC.barlineSize, face=GC.barlineFace), file=f)
-        print(psRGBColor(), file=f)
-
-    def render(self, f):
-        print(psVerticalLine(self.x, self.y, self.stave.height), file=f)
-        self.renderBarlineText(self.x - GC.barlineSize / 2, self.y + self.stave.height + GC.barlineSize / 2, f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        f.verticalLine(x, stave.y, stave.height)
+        self.renderBarlineText(x - context.barlineSize / 2, stave.y + stave.height + context.barlineSize / 2, f, context)
 
 class Barberpole(Barline):
-    def __init__(self, slot, startCourse=1, endCourse=GC.numberOfCourses, isHollow=False):
+    __slots__ = ("startCourse", "endCourse", "isHollow")
+
+    def __init__(self, slot, startCourse=1, endCourse=None, isHollow=False):
         Barline.__init__(self, 1, slot)
         self.startCourse = startCourse
         self.endCourse = endCourse
         self.isHollow = isHollow
 
-    def render(self, f):
-        renderBarberpole(self.x, self.y, startCourse=self.startCourse, endCourse=self.endCourse, file=f, isHollow=self.isHollow)
+    def isDefault(self):
+        # The default barberpole spans every course, and is defined once as the procedure BP in compact Postscript
+        # and as a symbol in SVG
+        return self.startCourse == 1 and self.endCourse is None and not self.isHollow
+
+    def render(self, f, stave):
+        context = stave.context
+        if f.useProcedures and self.isDefault():
+            f.procedure("BP", stave.slotXs[self.slot], stave.y)
+        else:
+            self.renderInline(f, stave.slotXs[self.slot], stave.y, context)
+
+    def renderInline(self, f, x, y, context):
+        renderBarberpole(x, y, startCourse=self.startCourse, endCourse=self.endCourse, file=f, context=context, isHollow=self.isHollow)
 
 
 class DoubleBarline(Barline):
+    __slots__ = ()
+
     def __init__(self, number, slot):
         Barline.__init__(self, number, slot)
 
-    def render(self, f):
-        print(psVerticalLine(self.x - GC.barlineSpacing, self.y, self.stave.height), file=f)
-        print(psVerticalLine(self.x, self.y, self.stave.height), file=f)
-        self.renderBarlineText(self.x - GC.barlineSize / 2,self.y + self.stave.height + GC.barlineSize / 2,f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        f.verticalLine(x - context.barlineSpacing, stave.y, stave.height)
+        f.verticalLine(x, stave.y, stave.height)
+        self.renderBarlineText(x - context.barlineSize / 2,stave.y + stave.height + context.barlineSize / 2, f, context)
 
 
 class ShortBarline(Barline):
+    __slots__ = ()
+
     def __init__(self, slot):
         Barline.__init__(self, 1, slot)
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.y + stave.courseSpacing
-        self.height = (stave.numberOfCourses - 3) * stave.courseSpacing
-
-    def render(self, f):
-        print(psVerticalLine(self.x - GC.barlineSpacing, self.y, self.height), file=f)
-        print(psVerticalLine(self.x, self.y, self.height), file=f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        y = stave.y + stave.courseSpacing
+        height = (stave.numberOfCourses - 3) * stave.courseSpacing
+        f.verticalLine(x - context.barlineSpacing, y, height)
+        f.verticalLine(x, y, height)
 
 
 class LongShortBarline(Barline):
+    __slots__ = ()
+
     def __init__(self, slot):
         Barline.__init__(self, 1, slot)
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.longY = stave.y
-        self.shortY = stave.y + stave.courseSpacing
-        self.longHeight = stave.height
-        self.shortHeight = (stave.numberOfCourses - 3) * stave.courseSpacing
-
-    def render(self, f):
-        print(psVerticalLine(self.x - GC.barlineSpacing, self.longY, self.longHeight), file=f)
-        print(psVerticalLine(self.x, self.shortY, self.shortHeight), file=f)
-        self.renderBarlineText(self.x - GC.barlineSize / 2,self.longY + self.longHeight + GC.barlineSize / 2,f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        f.verticalLine(x - context.barlineSpacing, stave.y, stave.height)
+        f.verticalLine(x, stave.y + stave.courseSpacing, (stave.numberOfCourses - 3) * stave.courseSpacing)
+        self.renderBarlineText(x - context.barlineSize / 2,stave.y + stave.height + context.barlineSize / 2, f, context)
 
 
 class TripleBarline(LongShortBarline):
+    __slots__ = ()
+
     def __init__(self, slot):
         LongShortBarline.__init__(self, slot)
 
-    def render(self, f):
-        print(psVerticalLine(self.x, self.longY, self.longHeight), file=f)
-        print(psVerticalLine(self.x + GC.barlineSpacing, self.shortY, self.shortHeight), file=f)
-        print(psVerticalLine(self.x - GC.barlineSpacing, self.shortY, self.shortHeight), file=f)
-        self.renderBarlineText(self.x - GC.barlineSize / 2,self.longY + self.longHeight + GC.barlineSize / 2,f)
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.slotXs[self.slot]
+        shortY = stave.y + stave.courseSpacing
+        shortHeight = (stave.numberOfCourses - 3) * stave.courseSpacing
+        f.verticalLine(x, stave.y, stave.height)
+        f.verticalLine(x + context.barlineSpacing, shortY, shortHeight)
+        f.verticalLine(x - context.barlineSpacing, shortY, shortHeight)
+        self.renderBarlineText(x - context.barlineSize / 2,stave.y + stave.height + context.barlineSize / 2, f, context)
 
 
 class EndBarline(Barline):
+    __slots__ = ()
+
     def __init__(self, slot):
         Barline.__init__(self, 1, slot)
 
-    def render(self, f):
+    def render(self, f, stave):
+        context = stave.context
         # TO DO - SHOULD THIS ALWAYS BE AT THE END OF THE STAVE???
-        self.x = self.stave.getSlotX(self.stave.slots)
-        print(psVerticalLine(self.x - GC.barlineSpacing, self.y, self.stave.height), file=f)
-        print(psVerticalLine(self.x, self.y, self.stave.height, 2), file=f)
+        x = stave.endX
+        f.verticalLine(x - context.barlineSpacing, stave.y, stave.height)
+        f.verticalLine(x, stave.y, stave.height, 2)
+
+
+TICKHEIGHT = 14
 
 
 class Tick:
-    def __init__(self, slot, duration=1, dot=False, body=True, height=14):
+    __slots__ = ("slot", "duration", "height", "body", "dot")
+
+    def __init__(self, slot, duration=1, dot=False, body=True, height=TICKHEIGHT):
         self.slot = slot
         self.duration = duration
         self.height = height
         self.body = body
         self.dot = dot
 
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot) + 2 * GC.tickBodyRadius
-        self.y = stave.y + stave.height + stave.courseSpacing
-
-    def pad(self, padding):
-        self.x += self.slot * padding
+    def procedureName(self):
+        # e.g. TK3 for a semiquaver, TK2d for a dotted quaver, TK1n for a crotchet without a body
+        return "TK%d%s%s" % (self.duration - BREVE, "d" if self.dot else "", "" if self.body else "n")
+
+    def render(self, f, stave):
+        context = stave.context
+        x = stave.getSlotX(self.slot, 2 * context.tickBodyRadius)
+        y = stave.y + stave.height + stave.courseSpacing
+        # In compact Postscript each kind of tick is defined once as a procedure, and in SVG as a symbol
+        if f.useProcedures and self.height == TICKHEIGHT:
+            f.procedure(self.procedureName(), x, y)
+        else:
+            self.renderInline(f, x, y, context)
 
-    def render(self, f):
+    def renderInline(self, f, x, y, context):
         # Print the stem
         if self.duration >= 0:
-            print(psStem(self.x, self.y, self.height), file=f)
+            f.verticalLine(x, y, self.height)
         # Print the tails
-        print(psDrawTails(self.x, self.y, self.height, self.duration), file=f)
+        f.tails(x, y, self.height, self.duration)
         if self.body:
             if self.duration <= 0:
-                print(psTickBody(self.x, self.y), file=f)
+                f.circle(x - context.tickBodyRadius, y, context.tickBodyRadius)
             else:
-                print(psTickBodyFilled(self.x, self.y), file=f)
+                f.filledCircle(x - context.tickBodyRadius, y, context.tickBodyRadius)
         # Print the dot if there is one
         if self.dot:
-            print(psTickDot(self.x, self.y), file=f)
+            f.filledCircle(x + 3, y, 1)
+
+
+def procedureGlyphs():
+    """
+    The composite glyphs that are repeated throughout a piece, each drawn at the origin by its renderInline
+    :return: [(procedure name, glyph)] e.g. ("TK3", Tick(...)), ("BP", Barberpole(0))
+    """
+    procedures = []
+    for duration in range(BREVE, SEMIQUAVER + 1):
+        for dot in (False, True):
+            for body in (True, False):
+                t = Tick(0, duration=duration, dot=dot, body=body)
+                procedures.append((t.procedureName(), t))
+    procedures.append(("BP", Barberpole(0)))
+    return procedures
+
+
+def compactGlyphProlog(context):
+    """
+    Defines a procedure for each composite glyph that is repeated throughout a piece: x y TK3, x y BP etc.
+    Each procedure draws the glyph at the origin, translated to x y
+    :return: the Postscript for the prolog
+    """
+    def define(name, glyph):
+        w = PSWriter(context=context)
+        # The procedure draws in the colour of its caller
+        w.color = w.wantColor
+        glyph.renderInline(w, 0, 0, context)
+        # Pack the operations onto as few lines as DSC allows
+        lines = ["/%s { gsave translate" % name]
+        for op in w.getvalue().split("\n") + ["grestore } bind def"]:
+            op = " ".join(op.split())
+            if not op:
+                continue
+            if len(lines[-1]) + 1 + len(op) > DSCLINELENGTH:
+                lines.append(op)
+            else:
+                lines[-1] += " " + op
+        return "\n".join(lines)
+
+    return "\n".join(define(name, glyph) for name, glyph in procedureGlyphs())
 
 
 class Note:
@@ -395,42 +441,47 @@ class Note:
     # 0 = open string
     # 1 = fret 1
     # etc.
-    def __init__(self, slot, course, glyph=""):
+    # The fret is always drawn in context.fretFace at context.fretSize, so they are not copied into every note
+    # between is True for a note drawn between its course and the one above it
+    __slots__ = ("slot", "course", "glyph", "between")
+
+    def __init__(self, slot, course, glyph="", between=False):
         self.slot = slot
         self.course = course
         self.glyph = glyph
-        self.size = GC.fretSize
-        self.face = GC.fretFace
-
-    def placeOnStave(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.getSlotY(self.course) - math.floor(self.size / 3)
+        self.between = between
 
-    def placeOnStaveBetween(self, stave):
-        self.x = stave.getSlotX(self.slot)
-        self.y = stave.getSlotY(self.course) - math.floor(self.size / 3) - math.floor(stave.courseSpacing / 2)
-
-    def pad(self, padding):
-        self.x += self.slot * padding
-
-    def render(self, f):
+    def render(self, f, stave):
+        context = stave.context
         t = self.glyph
-        if GC.mapFrets:
-            t = mapFret(self.glyph)
-        print(psText(text=t, x=self.x, y=self.y, size=GC.fretSize, face=GC.fretFace), file=f)
+        if context.mapFrets:
+            t = mapFret(self.glyph, context)
+        y = stave.noteYs[self.course]
+        if self.between:
+            y -= math.floor(stave.courseSpacing / 2)
+        f.text(text=t, x=stave.slotXs[self.slot], y=y, size=context.fretSize, face=context.fretFace)
 
 
 class Stave:
 
-    def __init__(self, x=100, y=100, l=400):
-        self.numberOfCourses = GC.numberOfCourses
-        self.courseSpacing = GC.courseSpacing
+    def __init__(self, context, x=100, y=100, l=400):
+        # The settings of the compilation the stave belongs to
+        self.context = context
+        self.numberOfCourses = context.numberOfCourses
+        self.courseSpacing = context.courseSpacing
         self.height = (self.numberOfCourses - 1) * self.courseSpacing
         self.x = x
         self.y = y
         self.l = l
-        self.slots = GC.slots
+        self.slots = context.slots
+        # The glyphs of the stave. Their slots and courses are read from the glyphs themselves by layout()
         self.glyphs = []
+        # The layout of the stave on the page, see layout()
+        self.padding = 0
+        self.slotXs = {}
+        self.courseYs = {}
+        self.noteYs = {}
+        self.endX = x + l
         self.currentSlot = 0
         self.slurStartSlot = None
         self.slurStartCourse = None
@@ -444,7 +495,30 @@ class Stave:
         padding = spareSlots*self.getSlotSpacing()/(self.currentSlot-1)
         # If we are over 3/4 full on the stave, then pad it to be full
         if spareSlots < self.slots/4:
-            for g in self.glyphs: g.pad(padding)
+            self.padding = padding
+
+    def layout(self, justified=False):
+        """
+        Works out where the slots and courses of the stave are on the page, just before the stave is rendered.
+        Glyphs only know their slots and courses, so this is the only place page coordinates are computed,
+        and the stave can be moved, resized or justified again without touching any of its glyphs.
+        The x of every slot in use (with any justification padding) and the y of every course in use
+        are each computed once for the whole stave, rather than once for every glyph.
+        :param justified: if True, pad the slots out to fill the stave when it is over 3/4 full
+        """
+        self.padding = 0
+        if justified: self.justify()
+        x, l, slots, padding = self.x, self.l, self.slots, self.padding
+        slotsUsed = {getattr(g, "slot", 0) for g in self.glyphs}
+        coursesUsed = {getattr(g, "course", 1) for g in self.glyphs}
+        if padding:
+            self.slotXs = {slot: x + slot * l / slots + slot * padding for slot in slotsUsed}
+        else:
+            self.slotXs = {slot: x + slot * l / slots for slot in slotsUsed}
+        self.courseYs = {course: self.getSlotY(course) for course in coursesUsed}
+        noteOffset = math.floor(self.context.fretSize / 3)
+        self.noteYs = {course: y - noteOffset for course, y in self.courseYs.items()}
+        self.endX = x + slots * l / slots
 
     def setSlurStart(self, slot, course):
         self.slurStartSlot = int(slot)
@@ -458,15 +532,19 @@ class Stave:
         self.y = y
         self.l = l
 
-    def getSlotX(self, slot):
-        return self.x + slot * self.l / self.slots
+    def getSlotX(self, slot, offset=0):
+        # offset moves the x to the right before any justification padding is added
+        x = self.x + slot * self.l / self.slots
+        if offset: x += offset
+        if self.padding: x += slot * self.padding
+        return x
 
     def getSlotY(self, course):
         return self.y + self.getCourseY(course)
         #return self.y + self.getCourseY(course)
 
     def getCourseY(self, course):
-        course = italianOrFrench(course)
+        course = italianOrFrench(course, self.context)
         return (course - 1) * self.courseSpacing
 
     def appendSpace(self, n):
@@ -474,53 +552,58 @@ class Stave:
 
     # N.B. The ticks appear above the stave and do NOT advance the slot
     def append(self, glyph):
-        glyph.placeOnStave(self)
         self.glyphs.append(glyph)
 
-    def appendBetween(self, glyph):
-        glyph.placeOnStaveBetween(self)
-        self.glyphs.append(glyph)
+    def appendBetween(self, note):
+        note.between = True
+        self.glyphs.append(note)
+
+    def clear(self):
+        # Drop the glyphs once the stave has been rendered
+        self.glyphs = []
+        self.slotXs, self.courseYs, self.noteYs = {}, {}, {}
 
     def advance(self, n=1):
         self.currentSlot += n
 
     def getStringingY(self, course=0):
-        course=italianOrFrench(course)
-        return self.y - 0.3*GC.courseSize + (course-1)*GC.courseSpacing
+        course=italianOrFrench(course, self.context)
+        return self.y - 0.3*self.context.courseSize + (course-1)*self.context.courseSpacing
 
 
     def render(self, f):
+        context = self.context
         # Print out the stringing only on the 1st stave on the 1st page
-        if self.firstStave & GC.showCourses:
+        if self.firstStave & context.showCourses:
             # There are one or more courses
             c = 0
-            for course in GC.courses:
+            for course in context.courses:
                 c += 1
                 # Each course is an array that may have 1 or more strings
                 for string in range(len(course)):
-                    print(psText(text=course[string], x=self.x - (4-2*string)*GC.courseSize, y=self.getStringingY(c), size=GC.courseSize, face=GC.courseFace), file=f)
+                    f.text(text=course[string], x=self.x - (4-2*string)*context.courseSize, y=self.getStringingY(c), size=context.courseSize, face=context.courseFace)
 
         # Print out the stave
         for course in range(self.numberOfCourses):
-            print(psHorizontalLine(self.x, self.y + self.getCourseY(course + 1), self.l), file=f)
+            f.horizontalLine(self.x, self.y + self.getCourseY(course + 1), self.l)
         # Print out the notes
-        for n in self.glyphs:
-            n.render(f)
+        for g in self.glyphs:
+            g.render(f, self)
 
     # def render(self, f):
     #     # Print out the stringing only on the 1st stave on the 1st page
-    #     if self.firstStave & GC.showCourses:
-    #         stringingY = self.y - 0.3*GC.courseSize
+    #     if self.firstStave & context.showCourses:
+    #         stringingY = self.y - 0.3*context.courseSize
     #         # There are one or more courses
-    #         for course in GC.courses:
+    #         for course in context.courses:
     #             # Each course is an array that may have 1 or more strings
     #             for string in range(len(course)):
-    #                 print(psText(text=course[string], x=self.x - (4-2*string)*GC.courseSize, y=stringingY, size=GC.courseSize, face=GC.courseFace), file=f)
-    #             stringingY += GC.courseSpacing
+    #                 f.text(text=course[string], x=self.x - (4-2*string)*context.courseSize, y=stringingY, size=context.courseSize, face=context.courseFace)
+    #             stringingY += context.courseSpacing
     #
     #     # Print out the stave
     #     for course in range(self.numberOfCourses):
-    #         print(psHorizontalLine(self.x, self.y + self.getCourseY(course + 1), self.l), file=f)
+    #         f.horizontalLine(self.x, self.y + self.getCourseY(course + 1), self.l)
     #     # Print out the notes
     #     for n in self.glyphs:
     #         n.render(f)
@@ -528,27 +611,49 @@ class Stave:
 
 class Page:
 
-    def __init__(self, pageNumber=1):
+    def __init__(self, context, pageNumber=1):
+        # The settings of the compilation the page belongs to
+        self.context = context
         self.pageNumber = pageNumber
         self.firstPage=True
-        self.topMargin = GC.topMargin
-        self.bottomMargin = GC.bottomMargin
-        self.leftMargin = GC.leftMargin
-        self.rightMargin = GC.rightMargin
-        self.pageWidth = GC.pageWidth
-        self.pageHeight = GC.pageHeight
-        self.staveSeparation = GC.staveSeparation
+        self.topMargin = context.topMargin
+        self.bottomMargin = context.bottomMargin
+        self.leftMargin = context.leftMargin
+        self.rightMargin = context.rightMargin
+        self.pageWidth = context.pageWidth
+        self.pageHeight = context.pageHeight
+        self.staveSeparation = context.staveSeparation
         self.staves = []
         self.courses = []
         self.title = ""
         self.composer = ""
 
     def append(self, stave):
+        self.position(len(self.staves), stave)
+        self.staves.append(stave)
+
+    def position(self, i, stave):
+        # Put the ith stave on the page
         x = self.leftMargin
-        y = self.pageHeight - self.topMargin - len(self.staves) * (stave.height + self.staveSeparation)
+        y = self.pageHeight - self.topMargin - i * (stave.height + self.staveSeparation)
         l = self.pageWidth - self.leftMargin - self.rightMargin
         stave.setPosition(x, y, l)
-        self.staves.append(stave)
+
+    def layout(self):
+        """
+        Takes the page size, margins and stave separation from the settings and moves the staves to match.
+        Nothing else needs to change - the staves work out where their glyphs are as they are rendered.
+        """
+        context = self.context
+        self.topMargin = context.topMargin
+        self.bottomMargin = context.bottomMargin
+        self.leftMargin = context.leftMargin
+        self.rightMargin = context.rightMargin
+        self.pageWidth = context.pageWidth
+        self.pageHeight = context.pageHeight
+        self.staveSeparation = context.staveSeparation
+        for i, s in enumerate(self.staves):
+            self.position(i, s)
 
     def extend(self, staves):
         for s in staves:
@@ -557,28 +662,34 @@ class Page:
     def getMaxNumberOfStaves(self, stave):
         return math.floor((self.pageHeight - self.topMargin) / (stave.height + self.staveSeparation))
 
-    def render(self, f):
-        if not self.firstPage:
-            # In a document, pages may start at any number,
-            # so page 1 is not always the first page, sometimes it is page 2 etc.
-            print("showpage ", file=f)
+    def renderHeader(self, f):
+        context = self.context
         if self.title:
-            print(psCenteredText(text=self.title, pageWidth=GC.pageWidth, y=GC.titleYPosition, size=GC.titleSize, face=GC.titleFace), file=f)
+            f.centeredText(text=self.title, pageWidth=context.pageWidth, y=context.titleYPosition, size=context.titleSize, face=context.titleFace)
         if self.composer:
-            print(psRightJustifiedText(text=self.composer, pageWidth=GC.pageWidth - GC.leftMargin, y=GC.composerYPosition, size=GC.composerSize, face=GC.composerFace), file=f)
+            f.rightJustifiedText(text=self.composer, pageWidth=context.pageWidth - context.leftMargin, y=context.composerYPosition, size=context.composerSize, face=context.composerFace)
+
+    def renderStave(self, s, f):
+        s.layout(self.context.justified)
+        s.render(f)
+
+    def render(self, f):
+        # Each page is complete in itself and ends with its showpage, so pages can be picked out of a document
+        self.renderHeader(f)
         for s in self.staves:
-            if GC.justified: s.justify()
-            s.render(f)
+            self.renderStave(s, f)
+        f.showpage()
 
 
 if __name__ == "__main__":
-    mp = Page()
-    s1 = Stave()
+    context = GlobalContext()
+    mp = Page(context)
+    s1 = Stave(context)
 
     numStaves = mp.getMaxNumberOfStaves(s1)
 
     for i in range(numStaves):
-        mp.append(Stave())
+        mp.append(Stave(context))
 
     mp.staves[1].append(Note(slot=1, course=1, glyph="1T"))
     mp.staves[1].append(Note(slot=2, course=2, glyph="2V"))
@@ -603,9 +714,9 @@ if __name__ == "__main__":
 
     mp.staves[3].append(Barline(number=25, slot=5))
     mp.staves[3].append(DoubleBarline(number=26, slot=6))
-    mp.staves[3].append(EndBarline(number=27, slot=7))
-    mp.staves[3].append(ShortBarline(number=28, slot=8))
-    mp.staves[3].append(Barberpole(number=30, slot=9))
+    mp.staves[3].append(EndBarline(slot=7))
+    mp.staves[3].append(ShortBarline(slot=8))
+    mp.staves[3].append(Barberpole(slot=9))
 
     mp.staves[1].append(Tick(slot=2, duration=0))
     mp.staves[1].append(Tick(slot=3, duration=1))
@@ -626,9 +737,9 @@ if __name__ == "__main__":
     mp.staves[3].append(CommonTime())
     mp.staves[4].append(SplitCommonTime())
 
-    mp.staves[5].append(OverSemicircle(slot=3, course=4, radius=3))
+    mp.staves[5].append(OverSemicircle(slot=3, course=4))
     mp.staves[5].append(Note(slot=3, course=4, glyph="1"))
-    mp.staves[5].append(UnderSemicircle(slot=4, course=2, radius=3))
+    mp.staves[5].append(UnderSemicircle(slot=4, course=2))
     mp.staves[5].append(Note(slot=4, course=2, glyph="7"))
 
     mp.staves[4].append(Slur(slot1=4, course1=3, slot2=6, course2=1))
@@ -636,7 +747,9 @@ if __name__ == "__main__":
     mp.staves[5].append(Strum(slot=5, pattern="UDUD"))
 
 
-    f = open('test4.ps', 'w')
-    print(psMapTimesRoman, file=f)
+    out = open('test4.ps', 'w')
+    f = PSWriter(out)
+    f.emit(psMapTimesRoman)
     mp.render(f)
-    f.close()
+    f.flush()
+    out.close()
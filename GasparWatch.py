@@ -0,0 +1,223 @@
+__author__ = 'jimarlow'
+# Watches directory trees and re-engraves each .sanz file as soon as it is saved
+#
+# On Linux the watcher is told about saves by inotify (through ctypes, so nothing needs installing),
+# elsewhere it polls the modification times of the .sanz files.
+# A burst of saves to the same file is debounced into one rebuild, only the outputs that are older than the
+# file are rebuilt, and the rebuilds run in a pool of worker processes.
+#
+# Watch with: python gasparps.py Instruccion --watch
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from GasparBatch import *
+
+# inotify events, see man 7 inotify
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+# Editors either write the file in place or write a temporary file and move it over the old one
+WATCHMASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+eventHeader = struct.Struct("iIII")
+
+
+def sanzFiles(roots):
+    for root in roots:
+        for directory, subdirectories, files in os.walk(root):
+            for f in files:
+                if f.endswith(".sanz"):
+                    yield os.path.join(directory, f)
+
+
+class PollingWatcher:
+    """
+    Finds saved .sanz files by scanning the trees for new modification times
+    """
+    def __init__(self, roots, interval=0.5):
+        self.roots = roots
+        self.interval = interval
+        self.mtimes = self.scan()
+
+    def scan(self):
+        mtimes = {}
+        for f in sanzFiles(self.roots):
+            try:
+                mtimes[f] = os.path.getmtime(f)
+            except OSError:
+                pass
+        return mtimes
+
+    def changes(self, timeout):
+        """
+        :return: the .sanz files saved since the last call, waiting up to timeout seconds
+        """
+        time.sleep(min(timeout, self.interval))
+        mtimes = self.scan()
+        changed = [f for f, mtime in mtimes.items() if self.mtimes.get(f) != mtime]
+        self.mtimes = mtimes
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Finds saved .sanz files with inotify, which tells us about each save as it happens
+    Raises OSError if inotify isn't available
+    """
+    def __init__(self, roots):
+        self.roots = roots
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptor -> directory
+        self.directories = {}
+        for root in roots:
+            for directory, subdirectories, files in os.walk(root):
+                self.addWatch(directory)
+
+    def addWatch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCHMASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self.directories[wd] = directory
+
+    def changes(self, timeout):
+        """
+        :return: the .sanz files saved since the last call, waiting up to timeout seconds
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # We missed some events, so treat every file as saved - only the out of date ones are rebuilt
+                changed.extend(sanzFiles(self.roots))
+            elif wd in self.directories:
+                path = os.path.join(self.directories[wd], name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.addWatch(path)
+                        changed.extend(sanzFiles([path]))
+                elif name.endswith(".sanz") and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def makeWatcher(roots):
+    # inotify if we can, otherwise polling
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError):
+        return PollingWatcher(roots)
+
+
+def rebuild(filename, backends, compact=False):
+    """
+    Engraves the outputs of filename that are older than it. Runs in a worker process.
+    :return: the backends that were built, the seconds it took and any error
+    """
+    start = time.perf_counter()
+    stale = [b for b in backends if not isUpToDate(filename, outputFilename(filename, b))]
+    try:
+        if stale:
+            engrave(filename, cache=defaultCache(), compact=compact, backends=stale)
+    except Exception as e:
+        return stale, time.perf_counter() - start, "%s: %s" % (type(e).__name__, e)
+    return stale, time.perf_counter() - start, None
+
+
+class GasparWatcher:
+    """
+    Rebuilds each .sanz file under roots once its saves have settled for debounce seconds
+    """
+    def __init__(self, roots, backends=BACKENDS, jobs=1, debounce=0.2, compact=False):
+        self.roots = roots
+        self.backends = tuple(backends)
+        self.debounce = debounce
+        self.compact = compact
+        self.watcher = makeWatcher(roots)
+        self.pool = ProcessPoolExecutor(jobs)
+        # File -> time of its last save, for files waiting for their saves to settle
+        self.pending = {}
+        # File -> future, for files being rebuilt
+        self.running = {}
+        self.rebuilds = 0
+
+    def step(self, timeout=None):
+        """
+        Waits for saves, then starts the rebuilds that are due and reports those that have finished
+        """
+        for f in self.watcher.changes(self.debounce / 2 if timeout is None else timeout):
+            self.pending[f] = time.monotonic()
+        now = time.monotonic()
+        for f, saved in list(self.pending.items()):
+            # A file that is still being rebuilt waits, so that its outputs are written by one worker at a time
+            if now - saved >= self.debounce and f not in self.running:
+                del self.pending[f]
+                self.running[f] = self.pool.submit(rebuild, f, self.backends, self.compact)
+        for f, future in list(self.running.items()):
+            if future.done():
+                del self.running[f]
+                self.report(f, *future.result())
+
+    def report(self, filename, built, seconds, error):
+        name = os.path.relpath(filename)
+        if error:
+            print("%-40s FAILED %s" % (name, error))
+        elif built:
+            self.rebuilds += 1
+            # The latency from the save, by the file's modification time, to its outputs being written
+            latency = time.time() - os.path.getmtime(filename)
+            print("%-40s %s in %.3fs, %.3fs after the save" % (name, " ".join(built), seconds, latency), flush=True)
+
+    def run(self):
+        print("Watching", ", ".join(self.roots), "with", type(self.watcher).__name__, flush=True)
+        try:
+            while True:
+                self.step()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.watcher.close()
+        self.pool.shutdown()
+
+
+def watch(paths, backends=BACKENDS, jobs=1, debounce=0.2, compact=False):
+    """
+    Re-engraves .sanz files as they are saved, until interrupted
+    :param paths: directories to watch, or files, whose directories are watched
+    """
+    roots = []
+    for path in paths:
+        root = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+        if root not in roots:
+            roots.append(root)
+    GasparWatcher(roots, backends, jobs, debounce, compact).run()
@@ -1,16 +1,28 @@
 __author__ = 'jimarlow'
 import re
 
+noteNames = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+noteOffsets = {name: offset for offset, name in enumerate(noteNames)}
+notePattern = re.compile('([A-G]#?)([0-9]+)')
+
+# The Lilypond name of every MIDI number for \absolute mode, where c is the C below middle C
+lilyNotes = ["c", "cis", "d", "dis", "e", "f", "fis", "g", "gis", "a", "ais", "b"]
+lilyOctaves = [",,,,", ",,,", ",,", ",", "", "'", "''", "'''", "''''", "'''''", "''''''"]
+lilyNames = [lilyNotes[num % 12] + lilyOctaves[num // 12] for num in range(128)]
+
+# The frets in a tuning table
+MAXFRET = 24
+
+
 def MIDINumberToNote(num):
     """
     Converts a MIDI number to a note string
     :param midiNumber: 60
     :return: "C4"
     """
-    notes = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
     octave, note = divmod(num, 12)
     octave = octave - 1
-    return notes[note] + str(octave)
+    return noteNames[note] + str(octave)
 
 
 def noteToMIDINumber(noteString):
@@ -19,10 +31,17 @@ def noteToMIDINumber(noteString):
     :param noteString: e.g. "C4"
     :return: the MIDI number for a note e.g. "C4" (middle C) to 60
     """
-    offsets = {"C":0, "C#":1, "D":2, "D#":3, "E":4, "F":5, "F#":6, "G":7, "G#":8, "A":9, "A#":10, "B":11}
-    note, octave, tmp = re.split('([0-9]*)', noteString.strip())
+    note, octave = notePattern.match(noteString.strip()).groups()
     octave = int(octave) + 1
-    return octave * 12 + offsets[note]
+    return octave * 12 + noteOffsets[note]
+
+
+def MIDINumberToLily(num):
+    """
+    :param num: 60
+    :return: the Lilypond note "c'"
+    """
+    return lilyNames[int(num)]
 
 
 def coursesToMIDINumbers(courses):
@@ -34,6 +53,55 @@ def coursesToMIDINumbers(courses):
     return [[noteToMIDINumber(s) for s in c] for c in courses]
 
 
+class Tuning:
+    """
+    The pitch of every string of every course at every fret, worked out once for a set of courses.
+    pitches[course][fret] are the MIDI numbers of the strings of the course, and lily[course][fret] their
+    Lilypond notes. Courses are numbered from 1, as in the tablature, so pitches[0] is empty.
+    :param courses: [['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D4', 'D4'], ['A4', 'A4']]
+    """
+    def __init__(self, courses, frets=MAXFRET):
+        self.courses = courses
+        self.openStrings = coursesToMIDINumbers(courses)
+        self.pitches = [[]] + [[tuple(s + fret for s in strings) for fret in range(frets + 1)] for strings in self.openStrings]
+        self.lily = [[tuple(lilyNames[k] for k in keys) for keys in course] for course in self.pitches]
+
+    def keys(self, course, fret):
+        """
+        :return: the MIDI numbers of the strings of a course at a fret e.g. (61, 61)
+        """
+        try:
+            return self.pitches[course][fret]
+        except IndexError:
+            # Beyond the frets in the table
+            return tuple(s + fret for s in self.openStrings[course - 1])
+
+    def lilyNotes(self, course, fret):
+        """
+        :return: the Lilypond notes of the strings of a course at a fret e.g. ("cis'", "cis'")
+        """
+        try:
+            return self.lily[course][fret]
+        except IndexError:
+            return tuple(lilyNames[k] for k in self.keys(course, fret))
+
+
+# Tunings by their courses, so each set of courses is worked out once however often it is used
+tunings = {}
+
+
+def getTuning(courses):
+    """
+    :param courses: [['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D4', 'D4'], ['A4', 'A4']]
+    :return: the Tuning for the courses
+    """
+    key = tuple(tuple(c) for c in courses)
+    tuning = tunings.get(key)
+    if tuning is None:
+        tuning = tunings[key] = Tuning(courses)
+    return tuning
+
+
 def courseFretToMIDINumbers(courses, course, fret):
     """
     Returns the MIDI numbers for a course/fret on a set of courses
@@ -42,9 +110,7 @@ def courseFretToMIDINumbers(courses, course, fret):
     :param fret: 3
     :return: [55,55]
     """
-    midiCourses= coursesToMIDINumbers(courses)
-    # Remember that courses are numbered 1,2,3 etc. whereas Python arrays are numbered 0,1,2 etc.
-    return [s + fret for s in midiCourses[course-1]]
+    return list(getTuning(courses).keys(course, fret))
 
 
 if __name__ == "__main__":
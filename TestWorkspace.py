@@ -2,6 +2,8 @@ __author__ = 'jimarlow'
 from GasparConfig import *
 import re
 
+GC = GlobalContext()
+
 def mapFret(fret):
     """Splits a fret into the fret number and any adornments (e.g. T)
     Maps the fret number according to the CG.fretMapping dictionary.
@@ -1,15 +1,29 @@
 __author__ = 'jimarlow'
 
-from GasparPostscriptCompiler import *
-import os.path
+from GasparWatch import *
 import argparse
 
-parser = argparse.ArgumentParser(description='Compile a .sanz file to Postscript.')
-parser.add_argument('sanzFileName', help='The name of the .sanz file to convert to Postscript')
+parser = argparse.ArgumentParser(description='Compile .sanz files to Postscript, MIDI and Lilypond.')
+parser.add_argument('sanzFileNames', nargs='+', help='The .sanz files to compile: files, directories of .sanz files or glob patterns e.g. "Instruccion/C*.sanz"')
+parser.add_argument('--backend', action='append', choices=list(backendSuffixes), help='An output to build: ps, midi, ly, pdf, svg or wav. Repeat for more than one (default ps)')
+parser.add_argument('--jobs', type=int, default=1, help='Build this many files at once, in separate processes')
+parser.add_argument('--force', action='store_true', help='Build every output, even if it is newer than its .sanz file')
+parser.add_argument('--watch', action='store_true', help='Keep running and build each .sanz file again as soon as it is saved')
+parser.add_argument('--debounce', type=float, default=0.2, help='With --watch, wait until a file has not been saved for this many seconds')
+parser.add_argument('--stream', action='store_true', help='Engrave a page at a time to keep memory use flat for very large files')
+
+parser.add_argument('--compact', action='store_true', help='Write compact Postscript that defines its primitives and glyphs once in a prolog')
+parser.add_argument('--page-jobs', type=int, default=1, help='Render the pages of a large piece that are not in the cache, or the sections of its audio, in this many processes')
+parser.add_argument('--pages', help='Only engrave these Postscript pages, counted from 1 in the order they appear e.g. 1-3,5')
+parser.add_argument('--split', action='store_true', help='Write each Postscript page to a file of its own e.g. Rujero-1.ps, Rujero-2.ps')
+parser.add_argument('--no-cache', action='store_true', help='Always engrave, without the artifact cache')
 
 args = parser.parse_args()
 
-if os.path.isfile(args.sanzFileName):
-    tabset(args.sanzFileName)
-else:
-    print("File ", args.sanzFileName, " does not exist")
+results = batch(args.sanzFileNames, backends=args.backend or ["ps"], jobs=args.jobs, force=args.force,
+                useCache=not args.no_cache, compact=args.compact, stream=args.stream, pageJobs=args.page_jobs,
+                pages=args.pages, split=args.split)
+if args.watch:
+    watch(args.sanzFileNames, backends=args.backend or ["ps"], jobs=args.jobs, debounce=args.debounce, compact=args.compact)
+elif any(r.error for r in results):
+    exit(1)
@@ -0,0 +1,123 @@
+__author__ = 'jimarlow'
+# Tests of the plucked string audio renderer
+# Run with: python -m pytest tests
+import array
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+from unittest import mock
+
+import GasparAudio
+from GasparAudio import *
+from GasparCache import ArtifactCache
+from GasparPostscriptCompiler import audioset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A low rate keeps the tests quick
+RATE = 8000
+
+
+def energy(samples):
+    return sum(s * s for s in samples)
+
+
+class TestPluck(unittest.TestCase):
+    def test_length_and_fade(self):
+        y = pluck(57, 0, 4000, RATE)
+        self.assertEqual(len(y), 4000)
+        self.assertGreater(max(abs(s) for s in y[:100]), PLUCKLEVEL / 4)
+        self.assertLessEqual(max(abs(s) for s in y), PLUCKLEVEL)
+        self.assertEqual(y[-1], 0)
+
+    def test_the_string_dies_away(self):
+        y = pluck(64, 0, 8000, RATE)
+        self.assertLess(energy(y[6000:7000]), energy(y[:1000]) / 2)
+
+    def test_strings_of_a_course_are_plucked_differently(self):
+        self.assertEqual(list(pluck(52, 1, 500, RATE)), list(pluck(52, 1, 500, RATE)))
+        self.assertNotEqual(list(pluck(52, 0, 500, RATE)), list(pluck(52, 1, 500, RATE)))
+
+    def test_pitch(self):
+        # The delay line repeats the burst, slightly damped, once a period
+        y = pluck(69, 0, 1000, RATE)
+        period = int(RATE / frequency(69))
+        correlation = sum(y[i] * y[i + period] for i in range(500)) / energy(y[:500])
+        self.assertGreater(correlation, 0.8)
+
+
+class TestMixing(unittest.TestCase):
+    def test_sections_join_up_exactly(self):
+        notes = [(0, 3000, 60, 0), (1000, 5000, 64, 0), (1000, 5000, 64, 1), (4500, 2000, 67, 0)]
+        whole = renderSection(notes, 0, 6500, RATE)
+        self.assertEqual(len(whole), 6500 * 2)
+        for cut in (BLOCKSIZE, 2500, 5000):
+            self.assertEqual(renderSection(notes, 0, cut, RATE) + renderSection(notes, cut, 6500, RATE), whole)
+
+    def test_silence(self):
+        self.assertEqual(renderSection([], 0, 100, RATE), bytes(200))
+
+    def test_clipping(self):
+        pcm = array.array("h", toPCM([2.0, -2.0, 0.5, 0.0]))
+        if sys.byteorder == "big":
+            pcm.byteswap()
+        self.assertEqual(list(pcm), [MAXSAMPLE, -MAXSAMPLE, MAXSAMPLE // 2, 0])
+
+
+class TestAudioCompiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, **options):
+        p = GasparAudioCompiler(self.sanz, rate=RATE, **options)
+        p.parseLines()
+        p.write()
+        with wave.open(p.outputFilename, "rb") as w:
+            return p, w.getparams(), w.readframes(w.getnframes())
+
+    def test_wav(self):
+        p, params, frames = self.render()
+        notes, length = p.sampleNotes()
+        self.assertEqual((params.nchannels, params.sampwidth, params.framerate, params.nframes), (1, 2, RATE, length))
+        self.assertEqual(len(frames), length * 2)
+        # The piece lasts as long as its chords, then the last notes are damped
+        self.assertEqual(length, round(p.now * RATE * 60 / (p.tempo * TICKSPERCROTCHET)) + int(RELEASETIME * RATE))
+        self.assertAlmostEqual(p.duration, length / RATE)
+        self.assertGreater(p.realtimeFactor(), 0)
+        # Whether NumPy rendered it is always reported with the speed
+        self.assertTrue(p.summary().endswith("real time with " + RENDERER))
+        self.assertEqual(RENDERER == "NumPy", GasparAudio.numpy is not None)
+
+    def test_audioset(self):
+        cache = ArtifactCache(os.path.join(self.directory, "cache"))
+        p = audioset(self.sanz, cache=cache)
+        self.assertTrue(os.path.getsize(p.outputFilename))
+        self.assertGreater(p.realtimeFactor(), 0)
+        # Copied from the cache, so nothing was rendered
+        self.assertIsNone(audioset(self.sanz, cache=cache))
+
+    def test_every_string_is_played(self):
+        p = GasparAudioCompiler(self.sanz, courses=[['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D3', 'D4'], ['A2', 'A3']], rate=RATE)
+        p.parseLines()
+        notes, length = p.sampleNotes()
+        self.assertEqual(len(notes), len(p.notes))
+        self.assertIn(45, [key for start, samples, key, string in notes])
+        self.assertIn(57, [key for start, samples, key, string in notes])
+
+    def test_sections_in_processes(self):
+        frames = self.render()[2]
+        # Short sections, so that there are plenty of them
+        with mock.patch.object(GasparAudio, "SECTIONBLOCKS", 4):
+            p, params, parallel = self.render(jobs=2)
+        self.assertGreater(params.nframes, BLOCKSIZE * 4 * 10)
+        self.assertEqual(parallel, frames)
+
+
+if __name__ == "__main__":
+    unittest.main()
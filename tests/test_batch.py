@@ -0,0 +1,107 @@
+__author__ = 'jimarlow'
+# Tests of building many files at once
+# Run with: python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from GasparBatch import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+names = ("Chacona.sanz", "Espanoletas.sanz", "Rujero.sanz")
+
+
+def quietly(fn, *args, **options):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        result = fn(*args, **options)
+    return result, out.getvalue()
+
+
+class TestSources(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in names:
+            shutil.copy(os.path.join(rootDir, "Instruccion", name), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files_directories_and_globs(self):
+        rujero = os.path.join(self.directory, "Rujero.sanz")
+        found, missing = sources([rujero, self.directory, os.path.join(self.directory, "Esp*.sanz"), "Nothing*.sanz"])
+        self.assertEqual(found, [rujero] + [os.path.join(self.directory, n) for n in ("Chacona.sanz", "Espanoletas.sanz")])
+        self.assertEqual(missing, ["Nothing*.sanz"])
+
+    def test_output_names(self):
+        self.assertEqual([outputFilename("a/Rujero.sanz", b) for b in ("ps", "midi", "ly", "svg")],
+                         ["a/Rujero.ps", "a/Rujero.midi", "a/RujeroLilypond.ly", "a/Rujero-1.svg"])
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = [shutil.copy(os.path.join(rootDir, "Instruccion", n), self.directory) for n in names]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_builds_every_backend(self):
+        for jobs in (1, 2):
+            results, out = quietly(batch, [self.directory], jobs=jobs, force=True, useCache=False)
+            self.assertEqual([r.filename for r in results], sorted(self.files))
+            for r in results:
+                self.assertIsNone(r.error)
+                self.assertEqual(r.built, list(BACKENDS))
+                for backend in BACKENDS:
+                    self.assertTrue(os.path.getsize(outputFilename(r.filename, backend)))
+            self.assertIn("3 files: 3 built, 0 up to date, 0 failed", out)
+
+    def test_the_same_as_engraving_each_file(self):
+        quietly(batch, [self.directory], useCache=False)
+        for f in self.files:
+            with open(outputFilename(f, "ps")) as ps:
+                batched = ps.read()
+            tabset(f)
+            with open(outputFilename(f, "ps")) as ps:
+                self.assertEqual(batched, ps.read())
+
+    def test_up_to_date_outputs_are_skipped(self):
+        quietly(batch, [self.directory], useCache=False)
+        results, out = quietly(batch, [self.directory], useCache=False)
+        self.assertEqual([r.built for r in results], [[], [], []])
+        self.assertIn("3 files: 0 built, 3 up to date", out)
+        # Save one file, and lose one output of another
+        later = time.time() + 10
+        os.utime(self.files[0], (later, later))
+        os.remove(outputFilename(self.files[1], "midi"))
+        results, out = quietly(batch, [self.directory], useCache=False)
+        built = {os.path.basename(r.filename): r.built for r in results}
+        self.assertEqual(built, {"Chacona.sanz": list(BACKENDS), "Espanoletas.sanz": ["midi"], "Rujero.sanz": []})
+        results, out = quietly(batch, [self.directory], useCache=False, force=True)
+        self.assertEqual([r.built for r in results], [list(BACKENDS)] * 3)
+
+    def test_audio_reports_how_fast_it_was_rendered(self):
+        rujero = os.path.join(self.directory, "Rujero.sanz")
+        results, out = quietly(batch, [rujero], backends=("wav",), useCache=False)
+        self.assertEqual(results[0].built, ["wav"])
+        self.assertEqual(len(results[0].notes), 1)
+        self.assertRegex(results[0].notes[0], r"^wav: [0-9.]+s of audio in [0-9.]+s, [0-9.]+x real time with ")
+        self.assertIn(results[0].notes[0], out)
+
+    def test_a_failure_does_not_stop_the_batch(self):
+        broken = os.path.join(self.directory, "Broken.sanz")
+        with open(broken, "w") as f:
+            f.write("FRETSIZE big\nP-1\n")
+        results, out = quietly(batch, [self.directory], useCache=False, backends=("ps",))
+        self.assertEqual(len(results), 4)
+        self.assertEqual([os.path.basename(r.filename) for r in results if r.error], ["Broken.sanz"])
+        self.assertEqual(sum(r.built == ["ps"] for r in results), 3)
+        self.assertIn("FAILED", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+__author__ = 'jimarlow'
+# Tests of the content-hash artifact cache
+# Run with: python -m pytest tests
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from GasparCache import *
+from GasparScore import parseScore
+from GasparPostscriptCompiler import GasparPostscriptCompiler, tabset, midiset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.directory, "cache"))
+        self.sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), self.directory)
+        self.ps = os.path.splitext(self.sanz)[0] + ".ps"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_a_rebuild_is_a_hit(self):
+        tabset(self.sanz, cache=self.cache)
+        built = open(self.ps).read()
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        os.remove(self.ps)
+        tabset(self.sanz, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(open(self.ps).read(), built)
+
+    def test_an_edit_is_a_miss(self):
+        tabset(self.sanz, cache=self.cache)
+        with open(self.sanz, "a") as f:
+            f.write("\n; edited\n")
+        tabset(self.sanz, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_options_are_part_of_the_key(self):
+        tabset(self.sanz, cache=self.cache)
+        tabset(self.sanz, cache=self.cache, compact=True)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        midiset(self.sanz, cache=self.cache)
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_the_context_is_part_of_the_key(self):
+        sourceHash = self.cache.sourceHash(self.sanz)
+        plain = GasparPostscriptCompiler(self.sanz)
+        compact = GasparPostscriptCompiler(self.sanz, compact=True)
+        self.assertNotEqual(self.cache.artifactKey(sourceHash, "ps", 1, plain.context),
+                            self.cache.artifactKey(sourceHash, "ps", 1, compact.context))
+        self.assertEqual(self.cache.artifactKey(sourceHash, "ps", 1, plain.context),
+                         self.cache.artifactKey(sourceHash, "ps", 1, GasparPostscriptCompiler(self.sanz).context))
+        self.assertNotEqual(self.cache.artifactKey(sourceHash, "ps", 1), self.cache.artifactKey(sourceHash, "ps", 2))
+
+    def test_parsed_scores(self):
+        sourceHash = self.cache.sourceHash(self.sanz)
+        self.assertIsNone(self.cache.getScore(sourceHash))
+        tabset(self.sanz, cache=self.cache)
+        score = self.cache.getScore(sourceHash)
+        self.assertEqual(len(score.pages), len(parseScore(self.sanz).pages))
+
+    def test_fragments(self):
+        key = self.cache.fragmentKey("page", 1)
+        self.assertIsNone(self.cache.getFragment(key))
+        self.cache.putFragment(key, "0 0 moveto\n")
+        self.assertEqual(self.cache.getFragment(key), "0 0 moveto\n")
+        self.cache.putFragment(self.cache.fragmentKey("track"), b"MTrk")
+        self.assertEqual(self.cache.getFragment(self.cache.fragmentKey("track"), binary=True), b"MTrk")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        small = ArtifactCache(os.path.join(self.directory, "small"), maxBytes=250)
+        for i in range(3):
+            small.putFragment(small.fragmentKey(i), "x" * 100)
+            os.utime(small.entryDir(small.fragmentKey(i)), (i, i))
+        small.putFragment(small.fragmentKey(3), "x" * 100)
+        self.assertIsNone(small.getFragment(small.fragmentKey(0)))
+        self.assertEqual(small.getFragment(small.fragmentKey(3)), "x" * 100)
+        self.assertLessEqual(small.size(), 250)
+
+    def test_library_calls_only_use_a_cache_they_are_given(self):
+        with mock.patch.object(ArtifactCache, "put", side_effect=AssertionError("wrote to a cache")):
+            tabset(self.sanz)
+            midiset(self.sanz)
+        self.assertTrue(os.path.exists(self.ps))
+
+
+if __name__ == "__main__":
+    unittest.main()
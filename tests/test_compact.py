@@ -0,0 +1,80 @@
+__author__ = 'jimarlow'
+# Tests of compact Postscript
+# Run with: python -m pytest tests
+import glob
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from GasparPostscript import *
+from GasparPostscriptCompiler import tabset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def compact():
+    context = GlobalContext()
+    context.compactPostscript = True
+    return context
+
+
+def splitProlog(postscript):
+    prolog = postscript[postscript.index("%%BeginProlog"):postscript.index("%%EndProlog")]
+    return prolog, postscript[postscript.index("%%EndProlog"):]
+
+
+def names(postscript):
+    # The upper case names used outside strings and comments - Postscript's own operators are all lower case
+    code = re.sub(r"\((?:\\.|[^\\)])*\)", "", re.sub(r"(?m)^%.*$", "", postscript))
+    return set(re.findall(r"(?<![/\w])([A-Z][A-Z0-9]*)\b", code))
+
+
+class TestNumbers(unittest.TestCase):
+    def test_psNum(self):
+        for n, s in ((3, "3"), (2.5, "2.5"), (1 / 3, "0.33"), (100.0, "100"), (-0.0001, "0"), (12.3456, "12.35")):
+            self.assertEqual(psNum(n), s)
+
+
+class TestCompactWriter(unittest.TestCase):
+    def test_operations(self):
+        w = PSWriter(context=compact())
+        w.line(1, 2, 3.25, 4)
+        w.circle(5, 6, 1.5)
+        w.text("Sanz", 7, 8, 11, "ArialMT")
+        self.assertEqual(w.getvalue().split("\n")[:6],
+                         ["0 0 0 K", "0.5 W", "3.25 4 1 2 P", "stroke", "5 6 1.5 C", "11 /ArialMT F"])
+
+    def test_runs_of_lines_are_one_path(self):
+        w = PSWriter(context=compact())
+        for i in range(5):
+            w.line(i, 0, i, 10)
+        self.assertEqual(w.getvalue().count("stroke"), 1)
+
+
+class TestCompactPostscript(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_every_procedure_used_is_defined(self):
+        for f in sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*.sanz"))):
+            sanz = shutil.copy(f, self.directory)
+            ps = os.path.splitext(sanz)[0] + ".ps"
+            tabset(sanz)
+            verbose = open(ps).read()
+            tabset(sanz, compact=True)
+            postscript = open(ps).read()
+            prolog, body = splitProlog(postscript)
+            defined = set(re.findall(r"^/([A-Z][A-Z0-9]*) ", prolog, re.M))
+            self.assertTrue({"W", "K", "F", "S", "P", "C", "TK1", "BP"} <= defined)
+            self.assertLessEqual(names(body), defined, os.path.basename(f))
+            # The prolog is longer, so a tiny piece may be longer overall, but its pages are always shorter
+            self.assertLess(len(body), len(splitProlog(verbose)[1]), os.path.basename(f))
+
+
+if __name__ == "__main__":
+    unittest.main()
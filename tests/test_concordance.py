@@ -0,0 +1,117 @@
+__author__ = 'jimarlow'
+# Tests of the concordance index
+# Run with: python -m pytest tests
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from GasparConcordance import *
+from GasparIndex import CorpusIndex, splitPitches, summarize
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+corpus = sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*.sanz")))
+chacona = os.path.join(rootDir, "Instruccion", "Chacona.sanz")
+
+
+def transpose(chords, semitones):
+    return [tuple(k + semitones for k in chord) for chord in chords]
+
+
+class TestNGrams(unittest.TestCase):
+    def test_line(self):
+        chords = [(52, 59), (), (55, 62, 67)]
+        self.assertEqual(line(chords), [59, 67])
+        self.assertEqual(line(chords, BASS), [52, 55])
+
+    def test_intervals(self):
+        self.assertEqual(list(intervals([60, 62, 59, 59])), [2, -3, 0])
+        self.assertEqual(list(intervals([0, 127, 0])), [MAXINTERVAL, -MAXINTERVAL])
+        self.assertEqual(list(intervals([60])), [])
+
+    def test_ngrams(self):
+        self.assertEqual(ngrams([1, 2, 3], 2), [129 << 8 | 130, 130 << 8 | 131])
+        self.assertEqual(len(ngrams(intervals(range(40, 60)))), 19 - NGRAM + 1)
+        self.assertEqual(ngrams([1, 2], 4), [])
+        # The same intervals in any key
+        self.assertEqual(ngrams(intervals([60, 64, 67, 72, 71])), ngrams(intervals([53, 57, 60, 65, 64])))
+
+
+class TestSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.index = ConcordanceIndex()
+        cls.index.addFiles(corpus)
+        cls.chords = splitPitches(summarize(chacona)["pitches"])
+
+    def test_every_piece_is_indexed(self):
+        self.assertEqual(self.index.paths, corpus)
+        self.assertEqual(self.index.size(), sum(max(0, len(s) - NGRAM + 1) for s in self.index.steps))
+
+    def test_a_transposed_snippet(self):
+        for semitones in (0, 5, -7):
+            matches = self.index.search(transpose(self.chords[40:52], semitones))
+            self.assertEqual(matches[0].score, 1)
+            found = {(m.path, m.position) for m in matches if m.score == 1}
+            self.assertIn((chacona, 40), found)
+            self.assertEqual(matches[0].votes, 11 - NGRAM + 1)
+
+    def test_a_varied_snippet(self):
+        # Change one note: the n-grams that avoid it still vote, and the passage is verified as a close match
+        snippet = [(k,) for k in line(self.chords[40:56])]
+        snippet[8] = (snippet[8][0] + 1,)
+        match = [m for m in self.index.search(snippet) if m.path == chacona and m.position == 40][0]
+        self.assertEqual(match.score, 13 / 15)
+        self.assertLess(match.votes, 15 - NGRAM + 1)
+
+    def test_no_match(self):
+        self.assertEqual(self.index.search([(60,), (61,), (90,), (30,), (91,), (31,), (92,)]), [])
+        self.assertEqual(self.index.search([(60,), (62,)]), [])
+
+    def test_melodies_as_numbers(self):
+        melody = line(self.chords[40:52])
+        self.assertEqual([(m.path, m.position) for m in self.index.search(melody)],
+                         [(m.path, m.position) for m in self.index.search(self.chords[40:52])])
+
+    def test_the_bass(self):
+        index = ConcordanceIndex(BASS)
+        index.addFiles([chacona])
+        self.assertEqual(index.search(transpose(self.chords[10:22], 3))[0].position, 10)
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_from_the_corpus_index(self):
+        library = os.path.join(self.directory, "library")
+        os.mkdir(library)
+        files = [shutil.copy(f, library) for f in corpus[:5]]
+        db = CorpusIndex(os.path.join(self.directory, "index.sqlite"))
+        db.update([library])
+        fromIndex = ConcordanceIndex()
+        fromIndex.addCorpus(db)
+        db.close()
+        fromFiles = ConcordanceIndex()
+        fromFiles.addFiles(files)
+        self.assertEqual((fromIndex.paths, fromIndex.steps, fromIndex.postings),
+                         (fromFiles.paths, fromFiles.steps, fromFiles.postings))
+
+    def test_save_and_load(self):
+        index = ConcordanceIndex()
+        index.addFiles(corpus)
+        filename = os.path.join(self.directory, "concordance.pickle")
+        index.save(filename)
+        loaded = ConcordanceIndex.load(filename)
+        self.assertEqual((loaded.voice, loaded.n, loaded.paths, loaded.steps, loaded.postings),
+                         (index.voice, index.n, index.paths, index.steps, index.postings))
+        snippet = transpose(splitPitches(summarize(chacona)["pitches"])[60:72], 2)
+        self.assertEqual(repr(loaded.search(snippet)), repr(index.search(snippet)))
+
+
+if __name__ == "__main__":
+    unittest.main()
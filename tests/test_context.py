@@ -0,0 +1,62 @@
+__author__ = 'jimarlow'
+# Tests of the per-compilation context
+# Run with: python -m pytest tests
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import GasparConfig
+from GasparPostscript import PSWriter
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+from GasparScore import parseScore
+from GasparTablature import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+pieces = [os.path.join(rootDir, "TestMedia", f) for f in ("CanariosFrench.sanz", "CanariosItalian.sanz")]
+
+
+def engrave(filename, score=None):
+    p = GasparPostscriptCompiler(filename)
+    p.compile(parseScore(filename) if score is None else score)
+    w = PSWriter(context=p.context)
+    p.render(w)
+    return p, w.getvalue()
+
+
+class TestContext(unittest.TestCase):
+    def test_no_shared_context(self):
+        self.assertFalse(hasattr(GasparConfig, "GC"))
+
+    def test_each_compilation_has_its_own_context(self):
+        french, frenchPostscript = engrave(pieces[0])
+        italian, italianPostscript = engrave(pieces[1])
+        self.assertIsNot(french.context, italian.context)
+        self.assertTrue(french.context.french)
+        self.assertFalse(italian.context.french)
+        # Compiling the Italian piece left the French one as it was
+        self.assertEqual(engrave(pieces[0])[1], frenchPostscript)
+        self.assertNotEqual(frenchPostscript, italianPostscript)
+
+    def test_concurrent_compilations(self):
+        scores = [parseScore(f) for f in pieces]
+        expected = [engrave(f)[1] for f in pieces]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda i: engrave(pieces[i % 2], scores[i % 2])[1], range(16)))
+        for i, postscript in enumerate(results):
+            self.assertEqual(postscript, expected[i % 2], i)
+
+    def test_default_barberpole_spans_every_course(self):
+        for courses in (4, 5, 6):
+            context = GlobalContext()
+            context.numberOfCourses = courses
+            stave = Stave(context)
+            stave.append(Barberpole(slot=1))
+            stave.layout()
+            default, explicit = PSWriter(context=context), PSWriter(context=context)
+            Barberpole(slot=1).render(default, stave)
+            Barberpole(slot=1, endCourse=courses).render(explicit, stave)
+            self.assertEqual(default.getvalue(), explicit.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
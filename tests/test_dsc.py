@@ -0,0 +1,146 @@
+__author__ = 'jimarlow'
+# Tests of DSC structured Postscript, its page index and rendering a selection of pages
+# Run with: python -m pytest tests
+import builtins
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from GasparBenchmark import syntheticScore
+from GasparCache import ArtifactCache
+from GasparPostscriptCompiler import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def pageOffsets(postscript):
+    # The offsets follow %%PageOffsets: and carry on over %%+ lines
+    trailer = postscript[postscript.rindex(b"%%Trailer"):].decode("utf-8").splitlines()
+    start = [i for i, line in enumerate(trailer) if line.startswith("%%PageOffsets:")][0]
+    offsets = trailer[start].split()[1:]
+    for line in trailer[start + 1:]:
+        if not line.startswith("%%+ "):
+            break
+        offsets.extend(line.split()[1:])
+    return [int(o) for o in offsets]
+
+
+def pageBodies(postscript):
+    # What each page draws, without its %%Page: comment, which numbers it within the document
+    body = postscript[postscript.index(b"%%EndProlog"):postscript.rindex(b"%%Trailer")]
+    return [page.split(b"\n", 1)[1] for page in body.split(b"%%Page: ")[1:]]
+
+
+class TestStructure(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertConforms(self, postscript, pages, name=None):
+        lines = postscript.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "%!PS-Adobe-3.0", name)
+        self.assertEqual(lines[-1], "%%EOF", name)
+        order = [lines.index(c) for c in ("%%EndComments", "%%BeginProlog", "%%EndProlog", "%%Trailer")]
+        self.assertEqual(order, sorted(order), name)
+        self.assertIn("%%%%Pages: %d" % pages, lines, name)
+        ordinals = [int(line.split()[-1]) for line in lines if line.startswith("%%Page: ")]
+        self.assertEqual(ordinals, list(range(1, pages + 1)), name)
+        self.assertEqual(sum(line.strip() == "showpage" for line in lines), pages, name)
+        offsets = pageOffsets(postscript)
+        self.assertEqual(len(offsets), pages, name)
+        for o in offsets:
+            self.assertTrue(postscript[o:].startswith(b"%%Page: "), name)
+        self.assertTrue(all(len(line) <= 255 for line in lines), name)
+
+    def test_the_corpus(self):
+        for f in sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*.sanz"))):
+            sanz = shutil.copy(f, self.directory)
+            ps = os.path.splitext(sanz)[0] + ".ps"
+            pages = len(parseScore(sanz).pages)
+            for options in ({}, {"compact": True}):
+                tabset(sanz, **options)
+                self.assertConforms(read(ps), pages, os.path.basename(f))
+
+    def test_many_pages(self):
+        sanz = syntheticScore(40, self.directory)
+        ps = os.path.splitext(sanz)[0] + ".ps"
+        tabset(sanz)
+        self.assertConforms(read(ps), 40)
+        self.assertIn(b"\n%%+ ", read(ps))
+        streamset(sanz)
+        self.assertConforms(read(ps), 40)
+        tabset(sanz, cache=ArtifactCache(os.path.join(self.directory, "cache")), jobs=2)
+        self.assertConforms(read(ps), 40)
+
+    def test_a_title_that_is_not_ascii(self):
+        # Files opened without an encoding would be Latin-1, so the offsets, counted in UTF-8, would miss their pages
+        def latin1(filename, mode="r", encoding=None, **options):
+            return builtins.open(filename, mode, encoding=encoding or "latin-1", **options)
+        sanz = syntheticScore(3, self.directory)
+        with open(sanz) as f:
+            source = f.read()
+        with open(sanz, "w") as f:
+            f.write(source.replace("TITLE ", "TITLE Pasacalles espa\u00f1oles ", 1))
+        ps = os.path.splitext(sanz)[0] + ".ps"
+        with mock.patch("GasparPostscriptCompiler.open", latin1, create=True):
+            for engrave in (tabset, streamset):
+                engrave(sanz)
+                postscript = read(ps)
+                self.assertIn("espa\u00f1oles".encode("utf-8"), postscript)
+                self.assertConforms(postscript, 3)
+            tabset(sanz, split=True)
+        for n in range(1, 4):
+            self.assertConforms(read("%s-%d.ps" % (os.path.splitext(sanz)[0], n)), 1)
+
+
+class TestPages(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sanz = syntheticScore(6, self.directory)
+        # Without tracking every page sets its own graphics state, so a page is the same wherever it is in a document
+        with open(self.sanz) as f:
+            source = f.read()
+        with open(self.sanz, "w") as f:
+            f.write("GRAPHICSSTATETRACKINGOFF\n" + source)
+        self.ps = os.path.splitext(self.sanz)[0] + ".ps"
+        tabset(self.sanz)
+        self.pages = pageBodies(read(self.ps))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parsePageRange(self):
+        self.assertEqual(parsePageRange("1-3,5"), [1, 2, 3, 5])
+        self.assertEqual(parsePageRange("4,2,2-3"), [2, 3, 4])
+
+    def test_selected_pages(self):
+        self.assertEqual(len(self.pages), 6)
+        tabset(self.sanz, pages="2-3,6")
+        postscript = read(self.ps)
+        TestStructure.assertConforms(self, postscript, 3)
+        self.assertEqual(pageBodies(postscript), [self.pages[1], self.pages[2], self.pages[5]])
+
+    def test_split_pages(self):
+        os.remove(self.ps)
+        tabset(self.sanz, split=True)
+        self.assertFalse(os.path.exists(self.ps))
+        base = os.path.splitext(self.sanz)[0]
+        for n, page in enumerate(self.pages, 1):
+            postscript = read("%s-%d.ps" % (base, n))
+            TestStructure.assertConforms(self, postscript, 1)
+            self.assertEqual(pageBodies(postscript), [page])
+        self.assertFalse(os.path.exists("%s-7.ps" % base))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+__author__ = 'jimarlow'
+# Tests of glyph storage and stave layout
+# Run with: python -m pytest tests
+import io
+import math
+import os
+import unittest
+from unittest import mock
+
+from GasparPostscript import PSWriter
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+from GasparTablature import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def compileFile(name):
+    p = GasparPostscriptCompiler(os.path.join(rootDir, "Instruccion", name))
+    p.parseLines()
+    return p
+
+
+def staves(p):
+    return [s for page in p.pages for s in page.staves]
+
+
+class TestGlyphStorage(unittest.TestCase):
+    def setUp(self):
+        self.p = compileFile("Espanoletas.sanz")
+
+    def test_glyphs_have_no_dict(self):
+        glyphs = [g for s in staves(self.p) for g in s.glyphs]
+        self.assertGreater(len({type(g) for g in glyphs}), 3)
+        for g in glyphs:
+            self.assertFalse(hasattr(g, "__dict__"), type(g).__name__)
+
+    def test_notes_between_courses(self):
+        s = Stave(self.p.context)
+        s.firstStave = False
+        s.append(Note(slot=1, course=2, glyph="1"))
+        s.appendBetween(Note(slot=2, course=2, glyph="2"))
+        self.assertEqual([g.between for g in s.glyphs], [False, True])
+        s.layout()
+        drawn = {}
+        f = mock.Mock()
+        f.text.side_effect = lambda text, x, y, size, face: drawn.__setitem__(text, y)
+        s.render(f)
+        self.assertEqual(drawn["2"], drawn["1"] - math.floor(s.courseSpacing / 2))
+
+    def test_clear(self):
+        s = staves(self.p)[0]
+        s.clear()
+        self.assertEqual((len(s.glyphs), s.slotXs), (0, {}))
+
+
+class TestStaveLayout(unittest.TestCase):
+    def setUp(self):
+        self.p = compileFile("ChaconaJustified.sanz")
+
+    def test_every_slot_and_course_in_use_is_placed(self):
+        for justified in (False, True):
+            for s in staves(self.p):
+                s.layout(justified)
+                for g in s.glyphs:
+                    slot = getattr(g, "slot", 0)
+                    self.assertAlmostEqual(s.slotXs[slot], s.getSlotX(slot))
+                    course = getattr(g, "course", 1)
+                    self.assertAlmostEqual(s.courseYs[course], s.getSlotY(course))
+
+    def test_justified_staves_fill_the_line(self):
+        padded = 0
+        for s in staves(self.p):
+            s.layout(True)
+            if s.padding:
+                padded += 1
+                # The last slot in use is moved out to the end of the stave
+                self.assertAlmostEqual(s.getSlotX(s.currentSlot - 1), s.x + s.l)
+        self.assertGreater(padded, 0)
+
+    def test_layout_is_idempotent(self):
+        def render():
+            out = io.StringIO()
+            w = PSWriter(out, self.p.context)
+            self.p.render(w)
+            w.flush()
+            return out.getvalue()
+        self.assertEqual(render(), render())
+
+
+if __name__ == "__main__":
+    unittest.main()
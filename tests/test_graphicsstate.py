@@ -0,0 +1,98 @@
+__author__ = 'jimarlow'
+# Tests of the graphics state tracker
+# Run with: python -m pytest tests
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from GasparPostscript import *
+from GasparPostscriptCompiler import tabset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestTracking(unittest.TestCase):
+    def test_unchanged_state_is_not_set_again(self):
+        w = PSWriter()
+        w.line(0, 0, 1, 1)
+        w.line(1, 1, 2, 2)
+        w.text("a", 0, 0, 11, "ArialMT")
+        w.text("b", 5, 0, 11, "ArialMT")
+        w.line(2, 2, 3, 3)
+        postscript = w.getvalue()
+        self.assertEqual(postscript.count("setlinewidth"), 1)
+        self.assertEqual(postscript.count("setrgbcolor"), 1)
+        self.assertEqual(postscript.count("findfont"), 1)
+
+    def test_changes_are_set(self):
+        w = PSWriter()
+        w.line(0, 0, 1, 1)
+        w.line(0, 0, 1, 1, lineWidth=2)
+        w.text("a", 0, 0, 11, "ArialMT")
+        w.text("b", 0, 0, 12, "ArialMT")
+        postscript = w.getvalue()
+        self.assertEqual(re.findall(r"(\S+) setlinewidth", postscript), ["0.5", "2"])
+        self.assertEqual(postscript.count("findfont"), 2)
+
+    def test_colours_are_set_lazily(self):
+        w = PSWriter()
+        w.line(0, 0, 1, 1)
+        # Nothing is drawn in red, so red is never set
+        w.setColor(1, 0, 0)
+        w.setColor()
+        w.line(1, 1, 2, 2)
+        w.setColor(0, 0, 1)
+        w.line(2, 2, 3, 3)
+        self.assertEqual(re.findall(r"(\S+ \S+ \S+) setrgbcolor", w.getvalue()), ["0 0 0", "0 0 1"])
+
+    def test_runs_of_lines_are_stroked_once(self):
+        w = PSWriter()
+        for i in range(4):
+            w.line(i, 0, i, 10)
+        self.assertEqual(w.getvalue().count("stroke"), 1)
+        self.assertEqual(w.getvalue().count("newpath"), 1)
+        self.assertEqual(w.getvalue().count("lineto"), 4)
+
+    def test_showpage_resets_the_state(self):
+        w = PSWriter()
+        w.line(0, 0, 1, 1)
+        w.showpage()
+        w.line(0, 0, 1, 1)
+        self.assertEqual(w.getvalue().count("setlinewidth"), 2)
+
+    def test_switched_off(self):
+        context = GlobalContext()
+        context.trackGraphicsState = False
+        w = PSWriter(context=context)
+        w.line(0, 0, 1, 1)
+        w.line(1, 1, 2, 2)
+        self.assertEqual(w.getvalue().count("setlinewidth"), 2)
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_the_switch_turns_tracking_off(self):
+        source = open(os.path.join(rootDir, "Instruccion", "Espanoletas.sanz")).read()
+        sizes = []
+        for text in ("GRAPHICSSTATETRACKINGOFF\n" + source, source):
+            sanz = os.path.join(self.directory, "Espanoletas.sanz")
+            with open(sanz, "w") as f:
+                f.write(text)
+            tabset(sanz)
+            postscript = open(os.path.splitext(sanz)[0] + ".ps").read()
+            sizes.append((len(postscript), postscript.count("setlinewidth"), postscript.count("stroke")))
+        untracked, tracked = sizes
+        self.assertLess(tracked[0], untracked[0])
+        self.assertLess(tracked[1], untracked[1])
+        self.assertLess(tracked[2], untracked[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+__author__ = 'jimarlow'
+# Tests of importing MIDI files as .sanz tablature
+# Run with: python -m pytest tests
+import glob
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from GasparImport import *
+from GasparMIDICompiler import GasparMIDICompiler, STRINGTRACKS
+from GasparScore import parseScore
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+baroque = (('E4',), ('B3', 'B3'), ('G3', 'G3'), ('D4', 'D4'), ('A4', 'A4'))
+guitar = (('E4',), ('B3',), ('G3',), ('D3',), ('A2',), ('E2',))
+
+
+def compileMIDI(sanz, **options):
+    p = GasparMIDICompiler(sanz, **options)
+    p.parseLines()
+    p.write()
+    return p
+
+
+def playingCost(fingerings):
+    return sum(f.cost for f in fingerings) + sum(shiftCost(a, b) for a, b in zip(fingerings, fingerings[1:]))
+
+
+def slotsUsed(lines):
+    # The slots each stave takes: a slot for each chord and barline, and three for the time signature
+    used = []
+    for line in lines:
+        if line.startswith("    S-"):
+            used.append(0)
+        elif line.startswith("            T-"):
+            used[-1] += 3
+        elif line.startswith(("            ", "        B-")):
+            used[-1] += 1
+    return used
+
+
+def played(midi):
+    # The keys of each chord, with its start counted from the first chord
+    ticks, notes, timeSignature = readMIDI(midi)
+    grouped = chords(notes, 0)
+    return [(start - grouped[0][0], keys) for start, keys, length in grouped]
+
+
+class TestReading(unittest.TestCase):
+    def test_chords(self):
+        notes = [(0, 60, 8), (1, 64, 16), (16, 62, 8), (40, 67, 4)]
+        self.assertEqual(chords(notes, 2), [(0, frozenset({60, 64}), 16), (16, frozenset({62}), 8), (40, frozenset({67}), 4)])
+        self.assertEqual(len(chords(notes, 0)), 4)
+
+    def test_duration_prefixes(self):
+        for ticks, prefix in ((16, "C"), (8, "Q"), (4, "SQ"), (24, "C."), (32, "M"), (48, "M."), (64, "W"), (15, "C"), (0, "SQ")):
+            self.assertEqual(durationPrefix(ticks, 16), prefix)
+
+    def test_every_format(self):
+        directory = tempfile.mkdtemp()
+        try:
+            sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), directory)
+            single = played(compileMIDI(sanz).outputFilename)
+            self.assertEqual(played(compileMIDI(sanz, tracks=STRINGTRACKS).outputFilename), single)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestFingering(unittest.TestCase):
+    def test_positions(self):
+        self.assertEqual(keyPositions(guitar, 64), ((1, 0), (2, 5), (3, 9)))
+        # Out of range, so an octave down
+        self.assertEqual(keyPositions(guitar, 88), keyPositions(guitar, 76))
+
+    def test_chord_fingerings(self):
+        fingerings = chordFingerings(guitar, frozenset({48, 52, 55, 60, 64}))
+        self.assertLessEqual(len(fingerings), BEAM)
+        self.assertEqual([f.cost for f in fingerings], sorted(f.cost for f in fingerings))
+        # The open C chord
+        self.assertEqual(fingerings[0].notes, ((1, 0), (2, 1), (3, 0), (4, 2), (5, 3)))
+        tuning = getTuning(guitar)
+        for f in fingerings:
+            self.assertEqual(len({course for course, fret in f.notes}), len(f.notes))
+            self.assertEqual({k for course, fret in f.notes for k in tuning.keys(course, fret)}, {48, 52, 55, 60, 64})
+
+    def test_octave_strings_are_covered_once(self):
+        # d' on the fourth course also sounds its octave string, so d needn't be fingered again
+        f = chordFingerings(baroque, frozenset({62}))[0]
+        self.assertEqual(f.notes, ((4, 0),))
+
+    def test_the_hand_stays_where_it_is(self):
+        # E twice then a high B: the Es are easiest at the second fret, but then the hand must jump to the seventh
+        keys = [frozenset({52}), frozenset({52}), frozenset({71})]
+        fingerings = fingerChords(guitar, keys)
+        self.assertEqual([f.notes for f in fingerings], [((5, 7),), ((5, 7),), ((1, 7),)])
+        self.assertLess(playingCost(fingerings), playingCost([chordFingerings(guitar, k)[0] for k in keys]))
+
+    def test_the_cheapest_way_to_play(self):
+        for keys in ([frozenset({48, 55, 64}), frozenset({53, 57, 65}), frozenset({55, 59, 62, 67})],
+                     [frozenset({69}), frozenset({74}), frozenset({57, 64}), frozenset({76})]):
+            every = itertools.product(*[chordFingerings(guitar, k) for k in keys])
+            self.assertAlmostEqual(playingCost(fingerChords(guitar, keys)), min(playingCost(f) for f in every))
+
+    def test_no_chords(self):
+        self.assertEqual(fingerChords(guitar, []), [])
+
+
+class TestRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_the_corpus(self):
+        for f in sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*.sanz"))):
+            # Espanoletas2 has ornamented notes that aren't played, leaving gaps that no single duration fills
+            if os.path.basename(f) == "Espanoletas2.sanz":
+                continue
+            sanz = shutil.copy(f, self.directory)
+            source = compileMIDI(sanz)
+            imported = importMIDI(source.outputFilename, courses=source.tuning.courses)
+            self.assertTrue(imported.endswith("Imported.sanz"))
+            score = parseScore(imported)
+            self.assertTrue(score.pages)
+            self.assertEqual(played(compileMIDI(imported).outputFilename), played(source.outputFilename), os.path.basename(f))
+
+    def test_layout(self):
+        sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Espanoletas.sanz"), self.directory)
+        source = compileMIDI(sanz)
+        importer = GasparMIDIImporter(source.outputFilename, courses=source.tuning.courses, title="Espanoletas")
+        importer.write()
+        lines = importer.lines
+        self.assertTrue(lines[0].startswith("COURSES "))
+        self.assertEqual(lines[1:3], ["P-1", "    TITLE Espanoletas"])
+        self.assertEqual(lines[-1], "        EB-1")
+        self.assertTrue(any(line.startswith("        B-") for line in lines))
+        self.assertGreater(sum(line.startswith("    S-") for line in lines), 1)
+        # Every stave has room for its chords and barlines, and the time signature on the first
+        used = slotsUsed(lines)
+        self.assertLessEqual(max(used), importer.slots)
+        self.assertEqual(len(used), sum(len(p.staves) for p in parseScore(importer.outputFilename).pages))
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        self.importer = GasparMIDIImporter("Test.midi", courses=guitar, title="Test")
+        # Sixteen ticks to the crotchet, so 64 to a bar of 4/4
+        self.importer.ticks = 16
+
+    def chord(self, start):
+        return (start, "SQ", Fingering(((1, 0),), 0, None))
+
+    def test_a_bar_longer_than_a_stave(self):
+        slots = self.importer.slots
+        chords = [self.chord(0)] * (slots * 2 + 5) + [self.chord(64)] * 2
+        lines = self.importer.layout(chords, (4, 4))
+        used = slotsUsed(lines)
+        self.assertEqual(len(used), 3)
+        self.assertLessEqual(max(used), slots)
+        self.assertEqual(sum(line.endswith("1-0") for line in lines), len(chords))
+        # The second bar fits after the end of the first
+        self.assertEqual([line for line in lines if line.startswith("        B-")], ["        B-2"])
+
+    def test_bars_keep_their_numbers(self):
+        # Nothing starts in the second bar, as a chord is held through it
+        chords = [self.chord(0), self.chord(130), self.chord(200)]
+        self.assertEqual(self.importer.bars(chords, (4, 4)), [(1, chords[:1]), (3, chords[1:2]), (4, chords[2:])])
+        lines = self.importer.layout(chords, (4, 4))
+        self.assertEqual([line for line in lines if line.startswith("        B-")], ["        B-3", "        B-4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
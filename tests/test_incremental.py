@@ -0,0 +1,76 @@
+__author__ = 'jimarlow'
+# Tests of re-rendering only the staves that changed
+# Run with: python -m pytest tests
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from GasparCache import ArtifactCache
+from GasparScore import parseScore
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def editStave(source, stave):
+    """
+    Raises the first fretted note of a stave by a fret
+    :param stave: the stave to edit, counted from 0 across the whole file
+    """
+    start = [m.start() for m in re.finditer(r"^\s*S-", source, re.M)][stave]
+    m = re.compile(r"^(\s*\d+-)(\d+)", re.M).search(source, start)
+    return source[:m.start()] + m.group(1) + str(int(m.group(2)) + 1) + source[m.end():]
+
+
+class TestIncrementalRendering(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.directory, "cache"))
+        self.sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Espanoletas.sanz"), self.directory)
+        self.source = open(self.sanz).read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def engrave(self, source, cache):
+        with open(self.sanz, "w") as f:
+            f.write(source)
+        p = GasparPostscriptCompiler(self.sanz, cache=cache)
+        p.compile(parseScore(self.sanz))
+        p.write()
+        return p, open(p.outputFilename).read()
+
+    def test_an_unchanged_piece_renders_nothing(self):
+        first, built = self.engrave(self.source, self.cache)
+        self.assertEqual(first.renderedPages, len(first.pages))
+        self.assertEqual(first.renderedStaves, sum(len(p.staves) for p in first.pages))
+        again, rebuilt = self.engrave(self.source, self.cache)
+        self.assertEqual((again.renderedPages, again.renderedStaves), (0, 0))
+        self.assertEqual(rebuilt, built)
+
+    def test_only_the_edited_stave_renders(self):
+        self.engrave(self.source, self.cache)
+        edited = editStave(self.source, 3)
+        p, incremental = self.engrave(edited, self.cache)
+        self.assertEqual((p.renderedPages, p.renderedStaves), (1, 1))
+        # The same as rendering the edited piece from nothing
+        fresh, full = self.engrave(edited, ArtifactCache(os.path.join(self.directory, "fresh")))
+        self.assertEqual(incremental, full)
+        self.assertEqual(fresh.renderedStaves, sum(len(page.staves) for page in fresh.pages))
+
+    def test_comments_render_nothing(self):
+        self.engrave(self.source, self.cache)
+        p, built = self.engrave(self.source.replace("S-2", "; a comment\nS-2", 1), self.cache)
+        self.assertEqual((p.renderedPages, p.renderedStaves), (0, 0))
+
+    def test_a_setting_renders_everything_again(self):
+        first, built = self.engrave(self.source, self.cache)
+        p, rebuilt = self.engrave(self.source.replace("FRETSIZE 11", "FRETSIZE 13"), self.cache)
+        self.assertEqual(p.renderedPages, len(p.pages))
+        self.assertNotEqual(rebuilt, built)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+__author__ = 'jimarlow'
+# Tests of the corpus index
+# Run with: python -m pytest tests
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import GasparIndex
+from GasparIndex import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+names = ("Chacona.sanz", "Pasacalles.sanz", "Rujero.sanz", "RujeroModern.sanz", "Espanoletas.sanz")
+
+folia = """COURSES E4 B3-B3 G3-G3 D4-D4 A4-A4
+P-1
+    TITLE Folias
+    COMPOSER Anon
+    S-1
+            T-3-4
+            C 1-0 2-0
+            AB-B
+        B-1
+            AB-B
+            AB-E
+            R-DU
+        B-2
+            Q 1-3
+"""
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = os.path.join(self.directory, "library")
+        os.makedirs(os.path.join(self.library, "more"))
+        self.files = [shutil.copy(os.path.join(rootDir, "Instruccion", n), self.library) for n in names]
+        self.folia = os.path.join(self.library, "more", "Folias.sanz")
+        with open(self.folia, "w") as f:
+            f.write(folia)
+        self.index = CorpusIndex(os.path.join(self.directory, "index", "gaspar.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def found(self, **conditions):
+        return [os.path.basename(row["path"]) for row in self.index.find(**conditions)]
+
+    def test_a_piece(self):
+        self.index.update([self.library])
+        piece = self.index.piece(self.folia)
+        self.assertEqual((piece["title"], piece["composer"]), ("Folias", "Anon"))
+        self.assertEqual(piece["courses"], "E4 B3-B3 G3-G3 D4-D4 A4-A4")
+        self.assertEqual(piece["timeSignatures"], ["3-4"])
+        self.assertEqual(piece["alfabeto"], {"B": 2, "E": 1})
+        self.assertEqual(piece["rasgueado"], {"DU": 1})
+        self.assertEqual((piece["pages"], piece["bars"], piece["chords"]), (1, 2, 2))
+        # The distinct pitches of each chord, lowest first
+        self.assertEqual(splitPitches(piece["pitches"]), [(59, 64), (67,)])
+        self.assertIsNone(self.index.piece(os.path.join(self.library, "Missing.sanz")))
+
+    def test_queries(self):
+        self.assertEqual(self.index.update([self.library]), (6, 0, 0))
+        self.assertEqual(self.index.count(), 6)
+        self.assertEqual(self.found(), sorted(names) + ["Folias.sanz"])
+        self.assertEqual(self.found(title="chacona"), ["Chacona.sanz"])
+        self.assertEqual(self.found(title="rujero", courses="E4 B3 G3 D3 A2"), ["RujeroModern.sanz"])
+        self.assertEqual(self.found(composer="Sans"), ["Chacona.sanz"])
+        self.assertEqual(self.found(time="3"), ["Chacona.sanz", "Espanoletas.sanz", "Folias.sanz"])
+        self.assertEqual(self.found(time="3-4"), ["Folias.sanz"])
+        self.assertEqual(self.found(time="3", alfabeto="B"), ["Folias.sanz"])
+        self.assertEqual(self.found(alfabeto="A"), [])
+        self.assertEqual(self.found(rasgueado="DU"), ["Pasacalles.sanz", "Folias.sanz"])
+        for keys in ([67], [59, 64], [57, 62, 67]):
+            expected = [os.path.basename(f) for f in indexedFiles([self.library]) if keysText(keys) in summarize(f)["chords"]]
+            self.assertEqual(sorted(self.found(keys=keys)), sorted(expected))
+        self.assertIn("Folias.sanz", self.found(keys=[64, 59, 59]))
+        self.assertEqual(self.found(keys=[1]), [])
+        self.assertEqual(self.found(minBars=30), ["Chacona.sanz", "Espanoletas.sanz"])
+        self.assertEqual(self.found(maxBars=2), ["Folias.sanz"])
+
+    def test_only_changed_files_are_indexed(self):
+        self.index.update([self.library])
+        with mock.patch.object(GasparIndex, "summarize", side_effect=AssertionError("parsed")):
+            self.assertEqual(self.index.update([self.library]), (0, 6, 0))
+            # Touched but not edited, so recognised by its hash
+            later = time.time() + 10
+            os.utime(self.files[0], (later, later))
+            self.assertEqual(self.index.update([self.library]), (0, 6, 0))
+            self.assertEqual(self.index.update([self.library]), (0, 6, 0))
+        with open(self.folia, "a") as f:
+            f.write("            AB-A\n")
+        self.assertEqual(self.index.update([self.library]), (1, 5, 0))
+        self.assertEqual(self.found(alfabeto="A"), ["Folias.sanz"])
+        os.remove(self.files[1])
+        self.assertEqual(self.index.update([self.library]), (0, 5, 1))
+        self.assertEqual(self.found(rasgueado="DU"), ["Folias.sanz"])
+        self.assertEqual(self.index.update([self.library], force=True), (5, 0, 0))
+
+    def test_the_index_is_kept(self):
+        self.index.update([self.library], jobs=2)
+        self.index.close()
+        self.index = CorpusIndex(self.index.filename)
+        self.assertEqual(self.index.count(), 6)
+        self.assertEqual(self.found(alfabeto="B"), ["Folias.sanz"])
+
+    def test_a_new_version_indexes_everything_again(self):
+        self.index.update([self.library])
+        self.index.close()
+        with mock.patch.object(GasparIndex, "indexVersion", indexVersion + 1):
+            self.index = CorpusIndex(self.index.filename)
+            self.assertEqual(self.index.update([self.library]), (6, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
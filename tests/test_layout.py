@@ -0,0 +1,66 @@
+__author__ = 'jimarlow'
+# Tests of laying a compiled score out again
+# Run with: python -m pytest tests
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from GasparPostscript import PSWriter
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def render(p):
+    out = io.StringIO()
+    w = PSWriter(out, p.context)
+    p.render(w)
+    w.flush()
+    return out.getvalue()
+
+
+class TestRelayout(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compileText(self, name, text):
+        sanz = os.path.join(self.directory, name)
+        with open(sanz, "w") as f:
+            f.write(text)
+        p = GasparPostscriptCompiler(sanz)
+        p.parseLines()
+        return p
+
+    def source(self, name):
+        with open(os.path.join(rootDir, "Instruccion", name)) as f:
+            return f.read()
+
+    def test_the_same_as_compiling_with_the_settings(self):
+        source = self.source("Espanoletas.sanz")
+        p = self.compileText("Espanoletas.sanz", source)
+        before = render(p)
+        p.layout(pageWidth=842, leftMargin=60, staveSeparation=40)
+        relaid = render(p)
+        self.assertNotEqual(relaid, before)
+        fresh = self.compileText("Espanoletas.sanz", "PAGEWIDTH 842\nLEFTMARGIN 60\nSTAVESEPARATION 40\n" + source)
+        self.assertEqual(relaid, render(fresh))
+
+    def test_justification_can_be_turned_off(self):
+        source = self.source("ChaconaJustified.sanz")
+        self.assertTrue(source.startswith("JUSTIFIED\n"))
+        p = self.compileText("ChaconaJustified.sanz", source)
+        justified = render(p)
+        p.layout(justified=False)
+        self.assertNotEqual(render(p), justified)
+        self.assertEqual(render(p), render(self.compileText("ChaconaJustified.sanz", source[len("JUSTIFIED\n"):])))
+        p.layout(justified=True)
+        self.assertEqual(render(p), justified)
+
+
+if __name__ == "__main__":
+    unittest.main()
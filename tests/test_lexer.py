@@ -0,0 +1,90 @@
+__author__ = 'jimarlow'
+# Tests of the table driven lexer
+# Run with: python -m pytest tests
+import glob
+import os
+import unittest
+
+from GasparLexer import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The prefixes parseLines used to test with startswith, in the order it tested them
+chainPrefixes = ["P-", "S-", "T-", "SB-", "TB-", "DB-", "LSB-", "B-", "BP-", "EB-",
+                 "W ", "M ", "M. ", "C ", "C. ", "Q ", "Q. ", "SQ ", "SQ. ", "R-", "AB-", "SECTION", "TITLE ", "COMPOSER "]
+chainKeywords = ["PAGEWIDTH ", "PAGEHEIGHT ", "TOPMARGIN ", "BOTTOMMARGIN ", "LEFTMARGIN ", "RIGHTMARGIN ",
+                 "STAVESEPARATION ", "SLOTS ", "COURSES ", "NUMBEROFCOURSES ", "SHOWCOURSES", "COURSESPACING ",
+                 "JUSTIFIED", "BARLINESPACING ", "BARBERPOLESPACING ", "TITLEFACE ", "TITLESIZE ", "TITLEYPOSITION ",
+                 "COMPOSERFACE ", "COMPOSERSIZE ", "COMPOSERYPOSITION ", "FRETFACE ", "FRETSIZE ", "FRETMAP ",
+                 "FRETMAPPINGOFF", "FRENCH"]
+
+
+def chainDirective(line):
+    """
+    Dispatches a line the way the startswith chain did
+    :return: the directive it would have dispatched on e.g. "B-", "Q.", "TITLE", NOTES, BLANK or COMMENT, or None
+    """
+    line = line.strip()
+    for prefix in chainPrefixes:
+        if line.startswith(prefix):
+            return prefix.strip()
+    if line == "":
+        return BLANK
+    if line[0].isdigit():
+        return NOTES
+    for prefix in chainKeywords:
+        if line.startswith(prefix):
+            return prefix.strip()
+    if line.startswith(";"):
+        return COMMENT
+    return None
+
+
+def sourceLines():
+    for f in sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*.sanz")) +
+                    glob.glob(os.path.join(rootDir, "TestMedia", "*.sanz"))):
+        with open(f) as source:
+            for lineNumber, line in enumerate(source, 1):
+                yield os.path.basename(f), lineNumber, line
+
+
+class TestTokenizeLine(unittest.TestCase):
+    def test_kinds(self):
+        for line, kind, directive, value in (("  1-3 2-0\n", NOTES, NOTES, "1-3 2-0"),
+                                             ("Q. 1-3 2-0", DURATION, "Q.", "1-3 2-0"),
+                                             ("SQ 1-0", DURATION, "SQ", "1-0"),
+                                             ("BP-2-4", DIRECTIVE, "BP-", "2-4"),
+                                             ("P-1", DIRECTIVE, "P-", "1"),
+                                             ("TITLE Canarios ", KEYWORD, "TITLE", "Canarios"),
+                                             ("FRENCH", KEYWORD, "FRENCH", ""),
+                                             ("; a comment", COMMENT, COMMENT, "; a comment"),
+                                             ("   \n", BLANK, BLANK, "")):
+            token = tokenizeLine(line)
+            self.assertEqual((token.kind, token.directive, token.value), (kind, directive, value), line)
+
+    def test_columns(self):
+        self.assertEqual(tokenizeLine("    B-2", 7).column, 5)
+        self.assertEqual(tokenizeLine("    B-2", 7).lineNumber, 7)
+        self.assertEqual(tokenizeLine("\tQ 1-0").column, 2)
+
+    def test_unrecognised_lines_are_ignored(self):
+        self.assertIsNone(tokenizeLine("lower case text"))
+        self.assertEqual([t.lineNumber for t in tokenize(["P-1", "nonsense", "B-1"])], [1, 3])
+
+
+class TestChainEquivalence(unittest.TestCase):
+    def test_corpus_dispatches_as_the_chain_did(self):
+        lines = 0
+        for name, lineNumber, line in sourceLines():
+            expected = chainDirective(line)
+            if expected is None:
+                continue
+            token = tokenizeLine(line, lineNumber)
+            self.assertIsNotNone(token, "%s:%d %r" % (name, lineNumber, line))
+            self.assertEqual(token.directive, expected, "%s:%d %r" % (name, lineNumber, line))
+            lines += 1
+        self.assertGreater(lines, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
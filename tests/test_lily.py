@@ -0,0 +1,105 @@
+__author__ = 'jimarlow'
+# Tests of the Lilypond compiler
+# Run with: python -m pytest tests
+import glob
+import io
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from GasparBenchmark import syntheticScore
+from GasparLilyCompiler import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CountingFile(io.StringIO):
+    # Counts the writes made to it
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return io.StringIO.write(self, s)
+
+
+def compileFile(filename, courses=None):
+    p = GasparLilyCompiler(filename, courses)
+    p.parseLines()
+    return p
+
+
+class TestLilypond(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def source(self, text):
+        sanz = os.path.join(self.directory, "Test.sanz")
+        with open(sanz, "w") as f:
+            f.write(text)
+        return sanz
+
+    def test_a_small_piece(self):
+        p = compileFile(self.source("P-1\n    TITLE Test\n    COMPOSER Sanz\n    S-1\n            C 1-0 2-2\n"
+                                    "            Q 3-0\n        B-1\n            1-1\n"))
+        self.assertEqual(p.getvalue(), '\\header{  title = "Test"  composer = "Sanz" }\n' + lpOpenBody +
+                         " <  e' cis' >4 <  g >8" + lpSingleBar + " <  f' >8  \\omit Score.BarLine}\n")
+
+    def test_the_corpus(self):
+        # The Lilypond files in the corpus were made by the compiler before it streamed
+        for ly in sorted(glob.glob(os.path.join(rootDir, "Instruccion", "*Lilypond.ly"))):
+            sanz = ly[:-len("Lilypond.ly")] + ".sanz"
+            if not os.path.exists(sanz):
+                continue
+            with open(ly) as f:
+                self.assertEqual(compileFile(sanz).getvalue(), f.read(), os.path.basename(ly))
+
+    def test_write_is_getvalue(self):
+        p = compileFile(shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), self.directory))
+        value = p.getvalue()
+        self.assertEqual(p.getvalue(), value)
+        p.write()
+        with open(p.outputFilename) as f:
+            self.assertEqual(f.read(), value)
+
+    def test_writing_before_parsing(self):
+        sanz = os.path.join(rootDir, "Instruccion", "Chacona.sanz")
+        out = io.StringIO()
+        GasparLilyCompiler(sanz).write(out)
+        self.assertEqual(out.getvalue(), compileFile(sanz).getvalue())
+
+    def test_the_body_is_streamed(self):
+        p = compileFile(shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), self.directory))
+        out = CountingFile()
+        p.write(out)
+        # A write for each chord, and nothing kept
+        self.assertGreater(out.writes, 50)
+        self.assertEqual(p.body, [lpOpenBody])
+        self.assertTrue(out.getvalue().startswith("".join(p.header) + "\n"))
+
+    def peakMemory(self, pages):
+        p = compileFile(syntheticScore(pages, self.directory))
+        with open(os.devnull, "w") as f:
+            tracemalloc.start()
+            try:
+                p.write(f)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return peak, len(p.getvalue())
+
+    def test_memory_does_not_grow_with_the_piece(self):
+        smallPeak = self.peakMemory(5)[0]
+        largePeak, largeLength = self.peakMemory(40)
+        self.assertLess(largePeak, smallPeak * 1.5)
+        self.assertLess(largePeak, largeLength / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
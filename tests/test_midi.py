@@ -0,0 +1,209 @@
+__author__ = 'jimarlow'
+# Tests of the in-memory MIDI encoder
+# Run with: python -m pytest tests
+import os
+import shutil
+import tempfile
+import unittest
+
+from GasparCache import ArtifactCache
+from GasparMIDICompiler import *
+
+corpusDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Instruccion")
+
+
+def readQuantity(data, i):
+    # Decodes the variable length quantity at data[i] - returns its value and the index after it
+    value = 0
+    while True:
+        value = value << 7 | data[i] & 0x7F
+        i += 1
+        if not data[i - 1] & 0x80:
+            return value, i
+
+
+def readEvents(chunk):
+    """
+    Decodes the events of a track chunk written by MIDITrack
+    :return: [(tick, status, data)] - the status a running status leaves out is filled in
+    """
+    assert chunk[:4] == b"MTrk"
+    data = chunk[8:8 + int.from_bytes(chunk[4:8], byteorder='big')]
+    events = []
+    tick = 0
+    status = None
+    i = 0
+    while i < len(data):
+        delta, i = readQuantity(data, i)
+        tick += delta
+        if data[i] == META:
+            length, j = readQuantity(data, i + 2)
+            events.append((tick, META, data[i + 1:j + length]))
+            i = j + length
+            status = None
+            continue
+        if data[i] & 0x80:
+            status = data[i]
+            i += 1
+        events.append((tick, status, data[i:i + 2]))
+        i += 2
+    return events
+
+
+def trackChunks(data):
+    # Splits a MIDI file into its track chunks
+    chunks = []
+    i = 14
+    while i < len(data):
+        length = int.from_bytes(data[i + 4:i + 8], byteorder='big')
+        chunks.append(data[i:i + 8 + length])
+        i += 8 + length
+    return chunks
+
+
+def noteEvents(events):
+    # The note ons and offs, as (tick, key, on), whatever their channel
+    return [(tick, data[0], bool(data[1])) for tick, status, data in events if status != META]
+
+
+def sounding(events):
+    # The keys still sounding at the end of a track
+    keys = {}
+    for tick, status, data in events:
+        if status != META and status & 0xF0 == NOTEON:
+            keys[data[0]] = keys.get(data[0], 0) + (1 if data[1] else -1)
+    return {k for k, n in keys.items() if n}
+
+
+class TestVariableLengthQuantity(unittest.TestCase):
+    def test_encodings(self):
+        for value, encoded in ((0, b"\x00"), (0x40, b"\x40"), (0x7F, b"\x7F"), (0x80, b"\x81\x00"),
+                               (200, b"\x81\x48"), (0x3FFF, b"\xFF\x7F"), (0x4000, b"\x81\x80\x00"),
+                               (0x0FFFFFFF, b"\xFF\xFF\xFF\x7F")):
+            self.assertEqual(variableLengthQuantity(value), encoded)
+
+    def test_round_trip(self):
+        for value in (0, 1, 127, 128, 1000, 16383, 16384, 2 ** 21, 2 ** 28 - 1):
+            self.assertEqual(readQuantity(variableLengthQuantity(value), 0), (value, len(variableLengthQuantity(value))))
+
+    def test_short_quantities(self):
+        track = MIDITrack()
+        track.deltaTime(0x7F)
+        track.deltaTime(0x80)
+        self.assertEqual(bytes(track.data), b"\x7F\x81\x00")
+
+
+class TestRunningStatus(unittest.TestCase):
+    def test_note_offs_keep_the_running_status(self):
+        track = MIDITrack(channel=2)
+        track.noteOn(0, 60)
+        track.noteOff(10, 60)
+        track.noteOn(0, 62)
+        # One status byte, then only delta, key and velocity
+        self.assertEqual(bytes(track.data), bytes([0, NOTEON | 2, 60, VELOCITY, 10, 60, 0, 0, 62, VELOCITY]))
+
+    def test_meta_events_cancel_the_running_status(self):
+        track = MIDITrack()
+        track.noteOn(0, 60)
+        track.tempo(0, 120)
+        track.noteOn(0, 62)
+        self.assertEqual(track.data.count(NOTEON), 2)
+        self.assertEqual(track.events, 3)
+
+
+class TestEncodeTrack(unittest.TestCase):
+    def test_every_note_stops(self):
+        events = readEvents(encodeTrack([(0, 96, 60), (96, 192, 62), (96, 144, 67)], 192, tempo=150))
+        self.assertEqual(sounding(events), set())
+        self.assertEqual(events[-1], (192, META, bytes([ENDOFTRACK, 0])))
+
+    def test_notes_that_stop_come_before_notes_that_start(self):
+        events = readEvents(encodeTrack([(0, 96, 60), (96, 192, 60)], 192))
+        self.assertEqual([(tick, data[1]) for tick, status, data in events if status != META],
+                         [(0, VELOCITY), (96, 0), (96, VELOCITY), (192, 0)])
+
+    def test_zero_length_notes_are_left_out(self):
+        events = readEvents(encodeTrack([(0, 96, 60), (96, 96, 64), (96, 192, 62)], 192))
+        self.assertEqual(sounding(events), set())
+        self.assertNotIn(64, [data[0] for tick, status, data in events if status != META])
+
+    def test_end_of_track_is_after_the_last_note(self):
+        events = readEvents(encodeTrack([(0, 96, 60)], 384))
+        self.assertEqual(events[-1][0], 384)
+
+
+class TestMIDIFile(unittest.TestCase):
+    def test_header(self):
+        midiFile = MIDIFile(format=1)
+        midiFile.addChunk(encodeTrack([], 0, tempo=150))
+        midiFile.addTrack().endOfTrack()
+        data = midiFile.getvalue()
+        self.assertEqual(data[:14], b"MThd\x00\x00\x00\x06\x00\x01\x00\x02" + TICKSPERCROTCHET.to_bytes(2, 'big'))
+
+    def test_corpus_notes_all_stop(self):
+        p = GasparMIDICompiler(os.path.join(corpusDir, "Rujero.sanz"))
+        p.parseLines()
+        data = p.midiFile().getvalue()
+        events = readEvents(data[14:])
+        self.assertTrue(any(status == NOTEON for tick, status, d in events))
+        self.assertEqual(sounding(events), set())
+
+
+class TestTracks(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def midiFile(self, tracks=None, **options):
+        p = GasparMIDICompiler(os.path.join(corpusDir, "Espanoletas.sanz"), tracks=tracks, **options)
+        p.parseLines()
+        return p, p.midiFile().getvalue()
+
+    def test_format_1(self):
+        single = self.midiFile()[1]
+        for tracks in (COURSETRACKS, STRINGTRACKS):
+            p, data = self.midiFile(tracks)
+            chunks = trackChunks(data)
+            self.assertEqual(data[8:12], b"\x00\x01" + len(chunks).to_bytes(2, 'big'))
+            self.assertEqual(len(chunks), len(p.trackNotes()) + 1)
+            # The first track only sets the tempo
+            self.assertEqual([status for tick, status, d in readEvents(chunks[0])], [META, META])
+            statuses = [{status for tick, status, d in readEvents(c) if status != META} for c in chunks[1:]]
+            for status in statuses:
+                self.assertEqual(len(status), 1)
+            self.assertEqual(len(set.union(*statuses)), len(chunks) - 1)
+            self.assertNotIn(NOTEON | 9, set.union(*statuses))
+            # Between them the tracks play the notes of the single track
+            merged = sorted(e for c in chunks for e in noteEvents(readEvents(c)))
+            self.assertEqual(merged, sorted(noteEvents(readEvents(single[14:]))))
+        self.assertGreater(len(self.midiFile(STRINGTRACKS)[0].trackNotes()), len(self.midiFile(COURSETRACKS)[0].trackNotes()))
+
+    def test_track_names(self):
+        names = [name for name, notes in self.midiFile(STRINGTRACKS)[0].trackNotes()]
+        self.assertIn("Course 2 string 1", names)
+        self.assertIn("Course 2 string 2", names)
+        self.assertEqual([name for name, notes in self.midiFile(COURSETRACKS)[0].trackNotes()][0], "Course 1")
+
+    def test_tracks_in_processes(self):
+        self.assertEqual(self.midiFile(COURSETRACKS, jobs=3)[1], self.midiFile(COURSETRACKS)[1])
+
+    def test_cached_tracks(self):
+        cache = ArtifactCache(self.directory)
+        p, data = self.midiFile(STRINGTRACKS, cache=cache)
+        self.assertEqual(p.encodedTracks, len(p.trackNotes()) + 1)
+        p, cached = self.midiFile(STRINGTRACKS, cache=cache)
+        self.assertEqual(p.encodedTracks, 0)
+        self.assertEqual(cached, data)
+        # Only the tracks whose notes change are encoded again
+        p = self.midiFile(STRINGTRACKS)[0]
+        first = p.notes[0]
+        p.notes[0] = [first[0], first[1], first[2], first[3], first[4] + 1]
+        p.cache = cache
+        p.midiFile()
+        self.assertEqual(p.encodedTracks, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+__author__ = 'jimarlow'
+# Tests of rendering the pages of a piece in a pool of processes
+# Run with: python -m pytest tests
+import os
+import shutil
+import tempfile
+import unittest
+
+from GasparBenchmark import syntheticScore
+from GasparCache import ArtifactCache
+from GasparPostscriptCompiler import tabset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestParallelPages(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def engrave(self, sanz, **options):
+        tabset(sanz, **options)
+        with open(os.path.splitext(sanz)[0] + ".ps") as f:
+            return f.read()
+
+    def cache(self, name):
+        return ArtifactCache(os.path.join(self.directory, name))
+
+    def test_the_same_as_rendering_one_by_one(self):
+        for name in ("Chacona.sanz", "Espanoletas.sanz", "CanariosB1P8.sanz"):
+            sanz = shutil.copy(os.path.join(rootDir, "Instruccion", name), self.directory)
+            serial = self.engrave(sanz)
+            self.assertEqual(self.engrave(sanz, jobs=2), serial, name)
+            self.assertEqual(self.engrave(sanz, jobs=3, compact=True), self.engrave(sanz, compact=True), name)
+
+    def test_a_large_score(self):
+        sanz = syntheticScore(12, self.directory)
+        serial = self.engrave(sanz)
+        self.assertEqual(serial.count("%%Page: "), 12)
+        self.assertEqual(self.engrave(sanz, jobs=2), serial)
+        self.assertEqual(self.engrave(sanz, jobs=4, pages="2-5,9"), self.engrave(sanz, pages="2-5,9"))
+
+    def test_with_a_cache(self):
+        sanz = syntheticScore(8, self.directory)
+        serial = self.engrave(sanz, cache=self.cache("serial"))
+        cache = self.cache("parallel")
+        self.assertEqual(self.engrave(sanz, cache=cache, jobs=2), serial)
+        # Every page is cached now, and nothing goes to the pool
+        os.remove(os.path.splitext(sanz)[0] + ".ps")
+        self.assertEqual(self.engrave(sanz, cache=cache, jobs=2), serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+__author__ = 'jimarlow'
+# Tests of the native PDF backend
+# Run with: python -m pytest tests
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from GasparPDF import *
+from GasparPostscriptCompiler import GasparPDFCompiler, pdfset
+
+corpusDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Instruccion")
+
+
+def contentStreams(pdf):
+    # The decompressed content stream of each page
+    return [zlib.decompress(s).decode("latin-1") for s in re.findall(rb"stream\n(.*?)\nendstream", pdf, re.S)]
+
+
+def colours(content):
+    return [tuple(float(c) for c in m) for m in re.findall(r"(\S+) (\S+) (\S+) RG", content)]
+
+
+class TestPDFWriter(unittest.TestCase):
+    def draw(self, fn):
+        out = io.BytesIO()
+        w = PDFWriter(out)
+        fn(w)
+        w.close()
+        return out.getvalue()
+
+    def test_colours_are_clipped_to_one(self):
+        def draw(w):
+            w.setColor(255, 0, 0)
+            w.line(0, 0, 10, 10)
+            w.setColor()
+            w.line(0, 10, 10, 0)
+        content = contentStreams(self.draw(draw))[0]
+        self.assertIn("1 0 0 RG 1 0 0 rg", content)
+        self.assertEqual(colours(content), [(1, 0, 0), (0, 0, 0)])
+
+    def test_cross_reference_offsets(self):
+        pdf = self.draw(lambda w: w.text("Hello", 10, 10))
+        xref = int(pdf.rsplit(b"startxref\n", 1)[1].split()[0])
+        self.assertTrue(pdf[xref:].startswith(b"xref"))
+        offsets = re.findall(rb"(\d{10}) 00000 n ", pdf[xref:])
+        for number, offset in enumerate(offsets, 1):
+            self.assertTrue(pdf[int(offset):].startswith(b"%d 0 obj" % number))
+
+    def test_text_escapes(self):
+        content = contentStreams(self.draw(lambda w: w.text("(a)\\247", 10, 10)))[0]
+        self.assertIn("(\\(a\\)\\247) Tj", content)
+
+    def test_fonts_are_shared(self):
+        def draw(w):
+            w.text("a", 10, 10, face="Times-Roman")
+            w.showpage()
+            w.text("b", 10, 10, face="Times-Roman")
+        pdf = self.draw(draw)
+        self.assertEqual(pdf.count(b"/Type /Font "), 1)
+        self.assertEqual(pdf.count(b"/Type /Page "), 2)
+
+
+class TestPDFCompiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sanz = shutil.copy(os.path.join(corpusDir, "Espanoletas.sanz"), self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_corpus_colours_are_in_range(self):
+        pdfset(self.sanz)
+        with open(os.path.splitext(self.sanz)[0] + ".pdf", "rb") as f:
+            pdf = f.read()
+        self.assertTrue(pdf.startswith(b"%PDF-1.4"))
+        found = [c for content in contentStreams(pdf) for c in colours(content)]
+        self.assertTrue(found)
+        self.assertTrue(all(0 <= c <= 1 for colour in found for c in colour))
+
+    def test_selected_pages(self):
+        pdfset(self.sanz)
+        pdf = os.path.splitext(self.sanz)[0] + ".pdf"
+        with open(pdf, "rb") as f:
+            pages = contentStreams(f.read())
+        self.assertGreater(len(pages), 1)
+        pdfset(self.sanz, pages="2")
+        with open(pdf, "rb") as f:
+            selected = contentStreams(f.read())
+        # Fonts are named in the order they are first used
+        unnamed = lambda content: re.sub(r"/F\d+ ", "/F ", content)
+        self.assertEqual([unnamed(c) for c in selected], [unnamed(pages[1])])
+
+    def test_render_takes_the_pages_to_draw(self):
+        p = GasparPDFCompiler(self.sanz)
+        p.parseLines()
+        out = io.BytesIO()
+        p.render(PDFWriter(out, p.context), p.selectedPages()[:1])
+        self.assertEqual(len(contentStreams(out.getvalue())), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
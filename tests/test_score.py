@@ -0,0 +1,120 @@
+__author__ = 'jimarlow'
+# Tests of the score IR that every backend compiles from
+# Run with: python -m pytest tests
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from GasparScore import *
+from GasparMIDICompiler import GasparMIDICompiler
+from GasparPostscript import PSWriter
+from GasparPostscriptCompiler import GasparPostscriptCompiler
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+source = """COURSES E4 B3-B3 G3-G3 D4-D3 A3-A2
+TITLESIZE 20
+FRENCH
+P-1
+    TITLE Test
+    COMPOSER Gaspar Sanz
+    S-1
+        T-3-4
+        Q. 1-0 2-3
+        2-0
+        ; a comment
+        B-2
+        R-UD
+        AB-A
+        1-[
+    S-2
+        BP-2-4
+P-2
+    S-1
+        W 5-0
+"""
+
+
+def writeSource(text, directory):
+    filename = os.path.join(directory, "Test.sanz")
+    with open(filename, "w") as f:
+        f.write(text)
+    return filename
+
+
+class TestParseScore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.score = parseScore(writeSource(source, self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_settings(self):
+        settings = [(s.name, s.value) for s in self.score.settings]
+        self.assertEqual(settings, [("courses", [["E4"], ["B3", "B3"], ["G3", "G3"], ["D4", "D3"], ["A3", "A2"]]),
+                                    ("numberOfCourses", 5), ("titleSize", 20), ("french", True)])
+
+    def test_pages_and_staves(self):
+        self.assertEqual([p.number for p in self.score.pages], ["1", "2"])
+        page = self.score.pages[0]
+        self.assertEqual((page.title, page.composer), ("Test", "Gaspar Sanz"))
+        self.assertEqual([s.number for s in page.staves], ["1", "2"])
+
+    def test_events(self):
+        events = self.score.pages[0].staves[0].events
+        self.assertEqual([type(e).__name__ for e in events],
+                         ["ScoreTimeSignature", "ScoreChord", "ScoreChord", "ScoreBarline", "ScoreRasgueado",
+                          "ScoreAlfabeto", "ScoreChord"])
+        timeSignature, dotted, plain, barline, rasgueado, alfabeto, slur = events
+        self.assertEqual((timeSignature.top, timeSignature.bottom), ("3", "4"))
+        self.assertEqual((dotted.duration, dotted.dotted), (QUAVER, True))
+        self.assertEqual([(n.course, n.fret) for n in dotted.notes], [(1, "0"), (2, "3")])
+        self.assertIsNone(plain.duration)
+        self.assertEqual((barline.kind, barline.number), ("B", "2"))
+        self.assertEqual((rasgueado.pattern, alfabeto.chord), ("UD", "A"))
+        self.assertEqual(slur.notes[0].ornament, SLURSTART)
+        barberpole = self.score.pages[0].staves[1].events[0]
+        self.assertEqual((barberpole.kind, barberpole.args), ("BP", ["2", "4"]))
+
+    def test_events_in_document_order(self):
+        kinds = [type(e).__name__ for e in self.score.events()]
+        self.assertEqual(kinds[:5], ["ScoreSetting"] * 4 + ["ScorePage"])
+        self.assertEqual(kinds[-3:], ["ScorePage", "ScoreStave", "ScoreChord"])
+
+    def test_the_score_pickles(self):
+        copy = pickle.loads(pickle.dumps(self.score))
+        self.assertEqual([type(e).__name__ for e in copy.events()], [type(e).__name__ for e in self.score.events()])
+
+
+class TestSharedScore(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(rootDir, "Instruccion", "Espanoletas.sanz")
+        self.score = parseScore(self.filename)
+
+    def postscript(self, score):
+        p = GasparPostscriptCompiler(self.filename)
+        p.compile(score)
+        out = io.StringIO()
+        w = PSWriter(out, p.context)
+        p.render(w)
+        w.flush()
+        return out.getvalue()
+
+    def test_compiling_leaves_the_score_unchanged(self):
+        self.assertEqual(self.postscript(self.score), self.postscript(self.score))
+
+    def test_backends_compile_from_one_parse(self):
+        midi = GasparMIDICompiler(self.filename)
+        midi.compile(self.score)
+        reparsed = GasparMIDICompiler(self.filename)
+        reparsed.parseLines()
+        self.assertEqual(midi.midiFile().getvalue(), reparsed.midiFile().getvalue())
+        self.assertEqual(self.postscript(self.score), self.postscript(parseScore(self.filename)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+__author__ = 'jimarlow'
+# Tests of the streaming engraver
+# Run with: python -m pytest tests
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from GasparBenchmark import syntheticScore
+from GasparPostscriptCompiler import streamset, tabset
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def withoutPageCounts(postscript):
+    # A stream doesn't know how many pages there are until the end, so it gives the count and offsets in the trailer
+    return [line for line in postscript.splitlines() if not line.startswith(("%%Pages:", "%%PageOffsets:"))]
+
+
+def peakMemory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def engrave(self, engraver, sanz, **options):
+        engraver(sanz, **options)
+        with open(os.path.splitext(sanz)[0] + ".ps") as f:
+            return f.read()
+
+    def test_the_same_pages_as_engraving_the_whole_file(self):
+        for name in ("Chacona.sanz", "Espanoletas.sanz", "Rujero.sanz"):
+            sanz = shutil.copy(os.path.join(rootDir, "Instruccion", name), self.directory)
+            whole = self.engrave(tabset, sanz)
+            streamed = self.engrave(streamset, sanz)
+            self.assertIn("%%Pages: (atend)", streamed)
+            self.assertEqual(withoutPageCounts(streamed), withoutPageCounts(whole), name)
+
+    def test_selected_pages(self):
+        sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Espanoletas.sanz"), self.directory)
+        self.assertEqual(withoutPageCounts(self.engrave(streamset, sanz, pages="2")),
+                         withoutPageCounts(self.engrave(tabset, sanz, pages="2")))
+
+    def test_memory_is_bounded_by_a_page(self):
+        small = syntheticScore(5, self.directory)
+        large = syntheticScore(40, self.directory)
+        streamset(small)
+        smallPeak = peakMemory(lambda: streamset(small))
+        largePeak = peakMemory(lambda: streamset(large))
+        self.assertLess(largePeak, smallPeak * 1.5)
+        self.assertLess(largePeak, peakMemory(lambda: tabset(large)) / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
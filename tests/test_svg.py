@@ -0,0 +1,72 @@
+__author__ = 'jimarlow'
+# Tests of the SVG backend
+# Run with: python -m pytest tests
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+from GasparSVG import *
+from GasparPostscriptCompiler import GasparSVGCompiler, svgset
+
+corpusDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Instruccion")
+
+
+SVG = "{http://www.w3.org/2000/svg}"
+XLINK = "{http://www.w3.org/1999/xlink}"
+
+
+class TestSVGCompiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sanz = shutil.copy(os.path.join(corpusDir, "Espanoletas.sanz"), self.directory)
+        self.basename = os.path.splitext(self.sanz)[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pages(self):
+        return sorted(os.path.basename(f) for f in glob.glob(self.basename + "-*.svg"))
+
+    def test_a_file_for_each_page(self):
+        svgset(self.sanz)
+        pages = self.pages()
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(pages, sorted("Espanoletas-%d.svg" % n for n in range(1, len(pages) + 1)))
+
+    def test_uses_link_both_ways_to_their_symbols(self):
+        svgset(self.sanz)
+        uses = 0
+        for page in glob.glob(self.basename + "-*.svg"):
+            # Parsing fails if the xlink namespace isn't declared
+            root = ElementTree.parse(page).getroot()
+            symbols = {s.get("id") for s in root.iter(SVG + "symbol")}
+            for use in root.iter(SVG + "use"):
+                self.assertEqual(use.get("href"), use.get(XLINK + "href"))
+                self.assertIn(use.get("href")[1:], symbols)
+                uses += 1
+        self.assertGreater(uses, 0)
+
+    def test_selected_pages_keep_their_numbers(self):
+        svgset(self.sanz)
+        with open(self.basename + "-2.svg") as f:
+            second = f.read()
+        for f in glob.glob(self.basename + "-*.svg"):
+            os.remove(f)
+        svgset(self.sanz, pages="2")
+        self.assertEqual(self.pages(), ["Espanoletas-2.svg"])
+        with open(self.basename + "-2.svg") as f:
+            self.assertEqual(f.read(), second)
+
+    def test_render_takes_the_pages_to_draw(self):
+        p = GasparSVGCompiler(self.sanz)
+        p.parseLines()
+        w = SVGWriter(self.basename, p.context)
+        p.render(w, p.selectedPages()[-1:])
+        self.assertEqual(w.filenames, ["%s-%d.svg" % (self.basename, len(p.pages))])
+
+
+if __name__ == "__main__":
+    unittest.main()
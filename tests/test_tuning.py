@@ -0,0 +1,70 @@
+__author__ = 'jimarlow'
+# Tests of the tuning tables
+# Run with: python -m pytest tests
+import re
+import unittest
+
+from GasparLilyCompiler import courseFretToLily, noteToLily
+from TabToMIDI import *
+
+baroque = [['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D4', 'D4'], ['A4', 'A4']]
+bourdons = [['E4'], ['B3', 'B3'], ['G3', 'G3'], ['D3', 'D4'], ['A2', 'A3']]
+
+
+def referenceKeys(courses, course, fret):
+    # Works the keys out from the note names every time, as courseFretToMIDINumbers did before the tables
+    offsets = {"C": 0, "C#": 1, "D": 2, "D#": 3, "E": 4, "F": 5, "F#": 6, "G": 7, "G#": 8, "A": 9, "A#": 10, "B": 11}
+    keys = []
+    for s in courses[course - 1]:
+        note, octave = re.fullmatch('([A-G]#?)([0-9])', s.strip()).groups()
+        keys.append((int(octave) + 1) * 12 + offsets[note] + fret)
+    return keys
+
+
+def referenceLily(num):
+    octave, note = divmod(num, 12)
+    return ["c", "cis", "d", "dis", "e", "f", "fis", "g", "gis", "a", "ais", "b"][note] + \
+        [",,,,", ",,,", ",,", ",", "", "'", "''", "'''", "''''"][octave]
+
+
+class TestNotes(unittest.TestCase):
+    def test_note_names(self):
+        for note, num in (("C4", 60), ("A4", 69), ("C#3", 49), ("A0", 21), ("G9", 127)):
+            self.assertEqual(noteToMIDINumber(note), num)
+            self.assertEqual(MIDINumberToNote(num), note)
+
+    def test_lily_names(self):
+        for num, lily in ((60, "c'"), (48, "c"), (47, "b,"), (61, "cis'"), (84, "c'''"), (21, "a,,,")):
+            self.assertEqual(MIDINumberToLily(num), lily)
+        self.assertEqual(noteToLily("E4"), "e'")
+
+
+class TestTuning(unittest.TestCase):
+    def test_the_table_matches_the_note_names(self):
+        for courses in (baroque, bourdons):
+            tuning = Tuning(courses)
+            for course in range(1, len(courses) + 1):
+                for fret in range(MAXFRET + 1):
+                    keys = referenceKeys(courses, course, fret)
+                    self.assertEqual(list(tuning.keys(course, fret)), keys)
+                    self.assertEqual(courseFretToMIDINumbers(courses, course, fret), keys)
+                    self.assertEqual(list(tuning.lilyNotes(course, fret)), [referenceLily(k) for k in keys])
+                    self.assertEqual(courseFretToLily(courses, course, fret), [referenceLily(k) for k in keys])
+
+    def test_examples(self):
+        self.assertEqual(courseFretToMIDINumbers(baroque, 2, 2), [61, 61])
+        self.assertEqual(Tuning(bourdons).keys(5, 0), (45, 57))
+        self.assertEqual(Tuning(bourdons).lilyNotes(4, 2), ("e", "e'"))
+
+    def test_beyond_the_table(self):
+        tuning = Tuning(baroque, frets=5)
+        self.assertEqual(tuning.keys(1, 7), (71,))
+        self.assertEqual(tuning.lilyNotes(1, 7), ("b'",))
+
+    def test_each_tuning_is_worked_out_once(self):
+        self.assertIs(getTuning(bourdons), getTuning([list(c) for c in bourdons]))
+        self.assertIsNot(getTuning(bourdons), getTuning(baroque))
+
+
+if __name__ == "__main__":
+    unittest.main()
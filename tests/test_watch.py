@@ -0,0 +1,93 @@
+__author__ = 'jimarlow'
+# Tests of watching .sanz files and re-engraving them as they are saved
+# Run with: python -m pytest tests
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from GasparCache import ArtifactCache
+from GasparWatch import *
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def save(filename, later=0):
+    # Rewrites the file, as an editor does, with a modification time later seconds from now
+    with open(filename) as f:
+        text = f.read()
+    with open(filename, "w") as f:
+        f.write(text)
+    if later:
+        t = time.time() + later
+        os.utime(filename, (t, t))
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, "sub"))
+        self.sanz = shutil.copy(os.path.join(rootDir, "Instruccion", "Rujero.sanz"), os.path.join(self.directory, "sub"))
+        # Keep the rebuilds out of the user's cache
+        cache = ArtifactCache(os.path.join(self.directory, "cache"))
+        patcher = mock.patch("GasparWatch.defaultCache", return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sanz_files(self):
+        self.assertEqual(list(sanzFiles([self.directory])), [self.sanz])
+
+    def watchers(self):
+        yield PollingWatcher([self.directory], interval=0.01)
+        try:
+            yield InotifyWatcher([self.directory])
+        except OSError:
+            # Not Linux, so there is only polling
+            pass
+
+    def test_saves_are_seen(self):
+        for watcher in self.watchers():
+            try:
+                self.assertEqual(watcher.changes(0.01), [])
+                save(self.sanz, later=5)
+                self.assertEqual(set(watcher.changes(1)), {self.sanz}, type(watcher).__name__)
+                self.assertEqual(watcher.changes(0.01), [])
+            finally:
+                watcher.close()
+
+    def test_only_stale_outputs_are_rebuilt(self):
+        built, seconds, error = rebuild(self.sanz, ("ps", "midi"))
+        self.assertEqual((built, error), (["ps", "midi"], None))
+        self.assertEqual(rebuild(self.sanz, ("ps", "midi"))[0], [])
+        os.remove(outputFilename(self.sanz, "midi"))
+        self.assertEqual(rebuild(self.sanz, ("ps", "midi"))[0], ["midi"])
+        save(self.sanz, later=5)
+        self.assertEqual(rebuild(self.sanz, ("ps", "midi", "ly"))[0], ["ps", "midi", "ly"])
+
+    def test_a_burst_of_saves_is_one_rebuild(self):
+        watcher = GasparWatcher([self.directory], backends=("ps",), debounce=0.3)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                for i in range(3):
+                    save(self.sanz)
+                    watcher.step(0.05)
+                self.assertFalse(watcher.running)
+                deadline = time.monotonic() + 30
+                while (watcher.pending or watcher.running) and time.monotonic() < deadline:
+                    watcher.step(0.05)
+        finally:
+            watcher.close()
+        self.assertEqual(watcher.rebuilds, 1)
+        self.assertIn("Rujero.sanz", out.getvalue())
+        self.assertTrue(isUpToDate(self.sanz, outputFilename(self.sanz, "ps")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+__author__ = 'jimarlow'
+# Tests of the buffered Postscript writer
+# Run with: python -m pytest tests
+import io
+import unittest
+
+from GasparPostscript import *
+
+
+def untracked():
+    context = GlobalContext()
+    context.trackGraphicsState = False
+    return context
+
+
+class CountingFile(io.StringIO):
+    # Counts the writes made to it
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return io.StringIO.write(self, s)
+
+
+class TestBuffering(unittest.TestCase):
+    def test_untracked_output_is_what_each_glyph_printed(self):
+        w = PSWriter(context=untracked())
+        w.line(1, 2, 3, 4)
+        w.circle(10, 20, 3)
+        w.text("Canarios", 5, 6, 12, "Times-Roman")
+        w.setColor(255, 0, 0)
+        self.assertEqual(w.getvalue(), "\n".join([psLine(1, 2, 3, 4), psCircle(10, 20, 3),
+                                                  psText("Canarios", 5, 6, 12, "Times-Roman"),
+                                                  psRGBColor(255, 0, 0)]) + "\n")
+
+    def test_output_is_written_in_large_chunks(self):
+        out = CountingFile()
+        w = PSWriter(out, untracked(), chunkSize=1000)
+        expected = []
+        for i in range(200):
+            w.line(i, i, i + 1, i + 1)
+            expected.append(psLine(i, i, i + 1, i + 1) + "\n")
+        w.flush()
+        self.assertEqual(out.getvalue(), "".join(expected))
+        # A write for each chunk, rather than one for each line
+        self.assertLessEqual(out.writes, -(-len(out.getvalue()) // 1000))
+
+    def test_nothing_is_written_until_a_chunk_fills(self):
+        out = CountingFile()
+        w = PSWriter(out)
+        w.line(0, 0, 1, 1)
+        self.assertEqual(out.writes, 0)
+        w.flush()
+        self.assertEqual(out.writes, 1)
+
+    def test_tell_counts_utf8_bytes(self):
+        out = io.StringIO()
+        w = PSWriter(out, chunkSize=8)
+        w.emit("%%Title: Españoletas")
+        self.assertEqual(w.tell(), len("%%Title: Españoletas\n".encode("utf-8")))
+        w.emit("x")
+        w.flush()
+        self.assertEqual(w.tell(), len(out.getvalue().encode("utf-8")))
+
+    def test_pop_empties_the_buffer(self):
+        w = PSWriter()
+        w.emit("a")
+        self.assertEqual(w.pop(), "a\n")
+        w.emit("b")
+        self.assertEqual(w.getvalue(), "b\n")
+
+    def test_write_forgets_the_graphics_state(self):
+        w = PSWriter()
+        w.line(0, 0, 1, 1)
+        w.write("% a cached fragment\n")
+        w.line(0, 0, 1, 1)
+        self.assertEqual(w.getvalue().count("setlinewidth"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()